@@ -0,0 +1,106 @@
+"""
+Concurrent-request throughput benchmark for POST /analyze_meal.
+
+Runs the FastAPI app in-process against a throwaway SQLite database with the
+LLM replaced by a latency-injecting stub, then fires a burst of concurrent
+uploads and reports throughput and latency. The "blocking" mode reproduces the
+old behaviour (a synchronous OpenAI call inside the async route); "async"
+uses the awaitable client path.
+
+    python -m benchmarks.bench_analyze_concurrency --requests 200 --concurrency 100
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _make_image() -> bytes:
+    # A small real JPEG: uploads are decoded and re-encoded before detection
+    import io
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", (320, 240), (200, 150, 90)).save(out, "JPEG")
+    return out.getvalue()
+
+
+IMAGE_BYTES = _make_image()
+
+
+def _setup_app(workdir: str):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    # Measure capacity, not the per-user rate limits
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+    os.chdir(workdir)
+    import main
+    return main
+
+
+async def _run(app, user_id: int, total: int, concurrency: int):
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one():
+            async with sem:
+                start = time.perf_counter()
+                res = await client.post(
+                    "/analyze_meal",
+                    data={"user_id": str(user_id)},
+                    files={"file": ("meal.jpg", IMAGE_BYTES, "image/jpeg")},
+                )
+                res.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies
+
+
+def _report(mode: str, total: int, elapsed: float, latencies):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(
+        f"{mode:>9}: {total} requests in {elapsed:6.2f}s  "
+        f"throughput={total / elapsed:7.1f} req/s  "
+        f"p50={p(0.50):7.0f}ms  p95={p(0.95):7.0f}ms  p99={p(0.99):7.0f}ms  "
+        f"mean={statistics.mean(latencies) * 1000:7.0f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per stubbed LLM call")
+    parser.add_argument("--modes", default="blocking,async")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-analyze-")
+    app_module = _setup_app(workdir)
+    from benchmarks.fake_llm import make_fake_call_openai
+    from schemas import UserCreate
+    from services import meal_service
+    from services.user_service import create_or_update_user
+
+    with app_module.SessionLocal() as db:
+        user_id = create_or_update_user(db, UserCreate(age=30, weight=70.0)).id
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, 3 LLM calls x {args.latency * 1000:.0f}ms each")
+    for mode in args.modes.split(","):
+        meal_service.call_openai = make_fake_call_openai(args.latency, blocking=(mode == "blocking"))
+        elapsed, latencies = asyncio.run(_run(app_module.app, user_id, args.requests, args.concurrency))
+        _report(mode, args.requests, elapsed, latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Bytes and encode time per image for the upload preprocessing stage.
+
+Uses synthetic phone-sized photos by default, or the files given on the
+command line, and reports original vs. processed size, the base64 payload
+that would be sent to the vision model, and preprocessing time.
+
+    python -m benchmarks.bench_image_preprocess --max-dimension 1024 --formats JPEG,WEBP
+    python -m benchmarks.bench_image_preprocess path/to/photo1.jpg path/to/photo2.jpg
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image, ImageFilter
+from services.image_service import preprocess_image
+
+# 12 MP and 48 MP (binned to 12 MP) phone photos are typically 4032x3024
+SYNTHETIC_SIZES = [(4032, 3024), (3024, 4032), (2048, 1536)]
+
+
+def _synthetic_photo(size) -> bytes:
+    """
+    Noise blurred into photo-like texture, saved at phone-camera quality.
+    """
+    small = Image.effect_noise((size[0] // 8, size[1] // 8), 64).convert("RGB")
+    img = small.resize(size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(1))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+
+def _b64_len(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="image files (default: synthetic photos)")
+    parser.add_argument("--max-dimension", type=int, default=1024)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--formats", default="JPEG,WEBP")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.images:
+        samples = [(os.path.basename(p), open(p, "rb").read()) for p in args.images]
+    else:
+        samples = [(f"synthetic {w}x{h}", _synthetic_photo((w, h))) for w, h in SYNTHETIC_SIZES]
+
+    print(f"max dimension {args.max_dimension}px, quality {args.quality}, {args.repeat} runs each")
+    for name, original in samples:
+        print(f"{name}: original {len(original) / 1024:8.1f} KiB, base64 payload {_b64_len(len(original)) / 1024:8.1f} KiB")
+        for fmt in args.formats.split(","):
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data, _ = preprocess_image(io.BytesIO(original), args.max_dimension, fmt, args.quality)
+                times.append(time.perf_counter() - start)
+            print(
+                f"  {fmt:>5}: {len(data) / 1024:8.1f} KiB ({len(data) / len(original):6.1%}), "
+                f"base64 payload {_b64_len(len(data)) / 1024:8.1f} KiB, "
+                f"encode median {statistics.median(times) * 1000:6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Mixed-workload load test for the whole API.
+
+Boots the app in-process against a throwaway SQLite database (or
+--database-url, e.g. a local Postgres) with the real OpenAI client pointed at
+the in-process fake Responses server, seeds users and meals, then runs
+closed-loop workers that pick endpoints by weight. Reports RPS and
+p50/p95/p99 per endpoint plus process memory, and saves everything as JSON
+so runs can be compared across commits.
+
+    python -m benchmarks.bench_load --duration 30 --concurrency 50 --output results.json
+    python -m benchmarks.bench_load --latency-distribution lognormal --latency-ms 400 --compare results.json
+
+With --target the workload is sent to an already running server instead
+(start it with OPENAI_BASE_URL pointing at benchmarks.fake_openai_server);
+memory is then not reported.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from services.resilience import parse_limits
+
+DEFAULT_MIX = "analyze=2,history=4,suggest=2,user=3,user_update=1"
+FRIDGE_ITEMS = ["eggs", "spinach", "rice", "chicken", "tomato", "yogurt", "oats", "beans", "cheese", "apple"]
+
+
+def _make_images(count: int, seed: int) -> List[bytes]:
+    # Distinct photos, so detection sees a realistic mix of cache hits and misses
+    from PIL import Image
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        out = io.BytesIO()
+        Image.new("RGB", (320, 240), tuple(rng.randrange(256) for _ in range(3))).save(out, "JPEG")
+        images.append(out.getvalue())
+    return images
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _memory() -> Dict[str, Optional[float]]:
+    # Resident and peak resident set size of this process, in MiB (Linux)
+    usage: Dict[str, Optional[float]] = {"rss_mib": None, "peak_rss_mib": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mib"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    usage["peak_rss_mib"] = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        usage["peak_rss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    """
+    The request mix. Each operation picks its user, photo and fridge items
+    from the worker's seeded RNG, so a run is repeatable for a given seed.
+    """
+
+    def __init__(self, client, user_ids: List[int], images: List[bytes]):
+        self.client = client
+        self.user_ids = user_ids
+        self.images = images
+
+    async def analyze(self, rng: random.Random):
+        return await self.client.post(
+            "/analyze_meal",
+            data={"user_id": str(rng.choice(self.user_ids))},
+            files={"file": ("meal.jpg", rng.choice(self.images), "image/jpeg")},
+        )
+
+    async def history(self, rng: random.Random):
+        return await self.client.get(f"/meal_history/{rng.choice(self.user_ids)}", params={"limit": 50})
+
+    async def suggest(self, rng: random.Random):
+        return await self.client.post(
+            "/suggest_meal",
+            json={"user_id": rng.choice(self.user_ids), "fridge_items": rng.sample(FRIDGE_ITEMS, 4)},
+        )
+
+    async def user(self, rng: random.Random):
+        return await self.client.get(f"/user/{rng.choice(self.user_ids)}")
+
+    async def user_update(self, rng: random.Random):
+        return await self.client.post(
+            "/user", json={"id": rng.choice(self.user_ids), "age": rng.randint(20, 70), "weight": 70.0},
+        )
+
+
+async def _seed(client, users: int, images: List[bytes]) -> List[int]:
+    user_ids = []
+    for i in range(users):
+        res = await client.post("/user", json={"age": 25 + i % 40, "weight": 60.0 + i % 30, "goals": "stay healthy"})
+        res.raise_for_status()
+        user_ids.append(res.json()["id"])
+    # One meal per user so history and advice context are not empty
+    for i, user_id in enumerate(user_ids):
+        res = await client.post(
+            "/analyze_meal",
+            data={"user_id": str(user_id)},
+            files={"file": ("meal.jpg", images[i % len(images)], "image/jpeg")},
+        )
+        res.raise_for_status()
+    return user_ids
+
+
+async def _drive(workload: Workload, mix: Dict[str, int], args) -> Dict[str, Any]:
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, Dict[str, int]] = {name: {} for name in names}
+    issued = 0
+    start = time.perf_counter()
+    stop_at = start + args.duration if args.duration else None
+
+    async def worker(index: int):
+        nonlocal issued
+        rng = random.Random(args.seed * 1000 + index)
+        while True:
+            if stop_at is not None and time.perf_counter() >= stop_at:
+                return
+            if stop_at is None:
+                if issued >= args.requests:
+                    return
+                issued += 1
+            name = rng.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                res = await getattr(workload, name)(rng)
+                status = str(res.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies[name].append(time.perf_counter() - began)
+            if status != "200":
+                errors[name][status] = errors[name].get(status, 0) + 1
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    def summarize(values: List[float], failed: Dict[str, int]) -> Dict[str, Any]:
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            "errors": sum(failed.values()),
+            "error_statuses": failed,
+            "rps": len(values) / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+            "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        }
+
+    all_errors: Dict[str, int] = {}
+    for failed in errors.values():
+        for status, count in failed.items():
+            all_errors[status] = all_errors.get(status, 0) + count
+    return {
+        "elapsed_seconds": elapsed,
+        "overall": summarize([v for values in latencies.values() for v in values], all_errors),
+        "endpoints": {name: summarize(latencies[name], errors[name]) for name in names},
+    }
+
+
+async def _run_in_process(args, mix: Dict[str, int], images: List[bytes]) -> Dict[str, Any]:
+    import httpx
+    from openai import AsyncOpenAI
+    from benchmarks.fake_openai_server import FakeServerConfig, create_app
+
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    # Measure capacity, not the per-user rate limits
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+    os.environ.setdefault("JOB_WORKERS", "0")
+    os.chdir(workdir)
+    import main
+    from services import openai_service
+
+    fake = create_app(FakeServerConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        latency_distribution=args.latency_distribution,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    ))
+    # The real client, retries and breaker included, talking to the fake server
+    openai_service.client = AsyncOpenAI(
+        api_key="bench",
+        base_url="http://fake-openai/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake)),
+        max_retries=0,
+    )
+    memory_before = _memory()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            user_ids = await _seed(client, args.users, images)
+            results = await _drive(Workload(client, user_ids, images), mix, args)
+    results["memory"] = {"before": memory_before, "after": _memory()}
+    results["fake_llm"] = {k: v for k, v in fake.state.stats.__dict__.items() if k != "in_flight"}
+    return results
+
+
+async def _run_against(args, mix: Dict[str, int], images: List[bytes]) -> Dict[str, Any]:
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.target, timeout=None, limits=limits) as client:
+        user_ids = await _seed(client, args.users, images)
+        results = await _drive(Workload(client, user_ids, images), mix, args)
+    return results
+
+
+def _print_report(results: Dict[str, Any]) -> None:
+    rows = [("overall", results["overall"])] + list(results["endpoints"].items())
+    print(f"{'endpoint':>12} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in rows:
+        print(
+            f"{name:>12} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} "
+            f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}"
+        )
+    memory = results.get("memory")
+    if memory:
+        print(
+            f"memory: rss {memory['before']['rss_mib']:.0f} -> {memory['after']['rss_mib']:.0f} MiB, "
+            f"peak {memory['after']['peak_rss_mib']:.0f} MiB (load generator included)"
+        )
+
+
+def _print_comparison(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"\nvs {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['timestamp']}):")
+    rows = [("overall", results["overall"], baseline["overall"])]
+    rows += [(n, r, baseline["endpoints"][n]) for n, r in results["endpoints"].items() if n in baseline["endpoints"]]
+    for name, new, old in rows:
+        changes = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            delta = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            changes.append(f"{key} {delta:+6.1f}%")
+        print(f"{name:>12}  " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="base URL of a running server; default boots the app in-process")
+    parser.add_argument("--database-url", help="in-process mode; default is a throwaway SQLite file")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run; 0 runs --requests requests")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--images", type=int, default=10, help="distinct photos to upload")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="fake LLM latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--latency-distribution", choices=("uniform", "lognormal"), default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    mix = parse_limits(args.mix)
+    unknown = set(mix) - {n for n in vars(Workload) if not n.startswith("_")}
+    if unknown:
+        parser.error(f"unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    images = _make_images(args.images, args.seed)
+    run = _run_against if args.target else _run_in_process
+    results = asyncio.run(run(args, mix, images))
+    results["meta"] = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": "external" if args.target else os.environ["DATABASE_URL"].split(":", 1)[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+    }
+
+    _print_report(results)
+    if baseline is not None:
+        _print_comparison(results, baseline)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
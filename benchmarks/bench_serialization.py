@@ -0,0 +1,119 @@
+"""
+Meal history serialization microbenchmark.
+
+Builds a throwaway SQLite database with one user's meals and times turning
+a page of N meals into JSON bytes three ways:
+
+  orm:      load Meal objects, build a MealRead per row, then FastAPI's
+            response_model validation and JSON encoding (the old path)
+  validate: column rows as dicts, then response_model validation and encoding
+  direct:   column rows as dicts straight to JSON (FastJSONResponse)
+
+    python -m benchmarks.bench_serialization --sizes 1000,10000 --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _seed(db, count: int) -> int:
+    from models import Meal, User
+    user = User(age=30, weight=70.0)
+    db.add(user)
+    db.flush()
+    base = datetime(2024, 1, 1)
+    db.add_all(
+        Meal(
+            user_id=user.id,
+            timestamp=base + timedelta(minutes=i),
+            image_path=f"uploads/{i:08x}.jpg",
+            food_items={"items": ["oatmeal", "banana", "coffee"]},
+            nutrition_info={"calories": 350, "protein": 12, "carbs": 60, "fat": 6},
+            feedback={"advice": "Solid start to the day.", "reason": "Fiber and slow carbs.", "next_meal": "Salad"},
+        )
+        for i in range(count)
+    )
+    db.commit()
+    return user.id
+
+
+def _fastapi_encode(adapter, content) -> bytes:
+    # What FastAPI does with a response_model: validate, dump in JSON mode, then JSONResponse.render
+    validated = adapter.validate_python(content)
+    dumped = adapter.dump_python(validated, mode="json", exclude_unset=True)
+    return json.dumps(dumped, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    from pydantic import TypeAdapter
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, Meal
+    from schemas import MealPartial, MealRead
+    from services.meal_service import get_meal_history
+    from services.serialization import dumps, orjson
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json (install orjson for the fast path)'}")
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            user_id = _seed(db, max(sizes))
+        full = TypeAdapter(List[MealRead])
+        partial = TypeAdapter(List[MealPartial])
+
+        for size in sizes:
+            with Session() as db:
+                def orm():
+                    meals = (
+                        db.query(Meal).filter(Meal.user_id == user_id)
+                        .order_by(Meal.timestamp.desc(), Meal.id.desc()).limit(size).all()
+                    )
+                    db.expunge_all()
+                    return _fastapi_encode(full, [MealRead.model_validate(m) for m in meals])
+
+                def validate():
+                    return _fastapi_encode(partial, get_meal_history(db, user_id, limit=size)[0])
+
+                def direct():
+                    return dumps(get_meal_history(db, user_id, limit=size)[0])
+
+                assert json.loads(orm()) == json.loads(validate()) == json.loads(direct())
+                rows = get_meal_history(db, user_id, limit=size)[0]
+                results = {
+                    "orm": _time(orm, args.repeat),
+                    "validate": _time(validate, args.repeat),
+                    "direct": _time(direct, args.repeat),
+                    "encode only": _time(lambda: dumps(rows), args.repeat),
+                }
+            print(f"{size:>6} meals: " + "  ".join(f"{name}={ms:8.1f}ms" for name, ms in results.items())
+                  + f"  speedup={results['orm'] / results['direct']:4.1f}x")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
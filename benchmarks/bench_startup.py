@@ -0,0 +1,100 @@
+"""
+Start-up time benchmark.
+
+Boots the app (`import main`) in fresh subprocesses against a throwaway
+SQLite database, first on an empty database and then on an already migrated
+one with several workers starting at once, and times the schema step on its
+own: the old inspect + ALTER checks + create_all path against
+ensure_schema()'s version check.
+
+    python -m benchmarks.bench_startup --workers 8 --repeat 20
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+BOOT = (
+    "import sys, time; sys.path.insert(0, {root!r}); start = time.perf_counter(); "
+    "import main; print(time.perf_counter() - start)"
+)
+
+
+def _boot(env) -> float:
+    # Seconds spent importing the app, as measured inside the child
+    out = subprocess.run(
+        [sys.executable, "-c", BOOT.format(root=ROOT)], env=env, cwd=env["BENCH_WORKDIR"],
+        capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _legacy_schema_step(engine) -> None:
+    # The pre-versioning start-up path, run by every worker on every boot
+    from sqlalchemy import inspect, text
+    from models import Base
+    inspector = inspect(engine)
+    if inspector.has_table("users"):
+        cols = [c["name"] for c in inspector.get_columns("users")]
+        with engine.begin() as conn:
+            for name in ("daily_calories", "daily_protein", "daily_carbs", "daily_fat"):
+                if name not in cols:
+                    conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"))
+    if inspector.has_table("meals"):
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_meals_user_id_timestamp ON meals (user_id, timestamp)"))
+    Base.metadata.create_all(bind=engine)
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="processes booting at once on a migrated database")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations for the in-process schema step timing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        env = dict(os.environ, DATABASE_URL=db_url, OPENAI_API_KEY="bench", JOB_WORKERS="0", BENCH_WORKDIR=workdir)
+
+        first = _boot(env)
+        print(f"first boot (empty database): {first * 1000:7.0f}ms")
+        with ThreadPoolExecutor(args.workers) as pool:
+            boots = list(pool.map(lambda _: _boot(env), range(args.workers)))
+        print(
+            f"{args.workers} concurrent boots (migrated): median={statistics.median(boots) * 1000:7.0f}ms  "
+            f"max={max(boots) * 1000:7.0f}ms"
+        )
+
+        os.environ.update(DATABASE_URL=db_url, OPENAI_API_KEY="bench")
+        from sqlalchemy import create_engine
+        from migrations import ensure_schema
+        engine = create_engine(db_url)
+        legacy = _time(lambda: _legacy_schema_step(engine), args.repeat)
+        versioned = _time(lambda: ensure_schema(engine, mode="auto"), args.repeat)
+        print(f"schema step: legacy={legacy:7.2f}ms  versioned={versioned:7.2f}ms")
+
+        start = time.perf_counter()
+        from services.openai_service import get_client
+        get_client()
+        print(f"deferred OpenAI client (first call): {(time.perf_counter() - start) * 1000:7.0f}ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
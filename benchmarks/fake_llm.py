@@ -0,0 +1,50 @@
+import json
+import time
+import asyncio
+import random
+from typing import List, Dict, Any, Optional
+
+# Canned structured outputs keyed by the schema name passed to call_openai
+CANNED_RESPONSES: Dict[str, Dict[str, Any]] = {
+    "food_items": {"food_items": ["oatmeal", "banana", "coffee"]},
+    "nutrition_info": {"calories": 420, "protein": 12, "carbs": 78, "fat": 8},
+    "advice_response": {
+        "advice": "Nice balanced breakfast.",
+        "reason": "Good fiber and slow carbs.",
+        "next_meal": "Grilled chicken salad with quinoa.",
+    },
+    "meal_suggestion": {
+        "recommendation": "Veggie omelette",
+        "missing_ingredients": ["spinach"],
+        "reason": "Quick protein for the afternoon.",
+        "ingredients": ["eggs", "spinach", "tomato", "onion", "cheese"],
+        "calories": 380,
+        "protein": 26,
+        "carbs": 9,
+        "fat": 26,
+    },
+}
+
+
+def make_fake_call_openai(latency: float = 0.2, jitter: float = 0.0, blocking: bool = False):
+    """
+    Build a stand-in for services.openai_service.call_openai that sleeps for
+    `latency` (+/- `jitter`) seconds before returning a canned response.
+    With blocking=True it sleeps synchronously, reproducing a sync SDK call
+    made from inside an async route.
+    """
+    async def fake_call_openai(
+        messages: List[Dict[str, Any]],
+        schema: Dict[str, Any],
+        name: str,
+        temperature: float = 0.0,
+        max_output_tokens: Optional[int] = None,
+    ) -> str:
+        delay = max(0.0, latency + random.uniform(-jitter, jitter))
+        if blocking:
+            time.sleep(delay)
+        else:
+            await asyncio.sleep(delay)
+        return json.dumps(CANNED_RESPONSES[name])
+
+    return fake_call_openai
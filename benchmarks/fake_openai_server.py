@@ -0,0 +1,188 @@
+"""
+A local stand-in for the OpenAI Responses API with injectable latency and
+errors, for exercising the real client path (retries, deadlines, circuit
+breaker, concurrency caps) without network access or API spend.
+
+    python -m benchmarks.fake_openai_server --port 8100 --latency-ms 300 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake uvicorn main:app
+
+In tests, mount it in-process with httpx.ASGITransport(app=create_app(config)).
+"""
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.fake_llm import CANNED_RESPONSES
+
+
+@dataclass
+class FakeServerConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # uniform: latency_ms +/- jitter_ms; lognormal: median latency_ms with a long tail set by latency_sigma
+    latency_distribution: str = "uniform"
+    latency_sigma: float = 0.5
+    # Fraction of requests answered with `error_status` instead of a response
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Sent as Retry-After on 429/503 errors
+    retry_after: Optional[float] = None
+    # Fail this many requests unconditionally before applying error_rate
+    fail_first: int = 0
+    # Characters per output_text.delta event and pause between events (stream=true)
+    stream_chunk_chars: int = 8
+    stream_interval_ms: float = 0.0
+    # Seed for latency and error injection, for repeatable runs
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeServerStats:
+    requests: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    by_schema: Dict[str, int] = field(default_factory=dict)
+
+
+def _response_body(name: str, text: str) -> Dict:
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": "gpt-4o",
+        "output": [
+            {
+                "id": f"msg_{uuid.uuid4().hex}",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": 100,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": max(1, len(text) // 4),
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": 100 + max(1, len(text) // 4),
+        },
+    }
+
+
+async def _stream_events(config: FakeServerConfig, name: str, text: str):
+    body = _response_body(name, text)
+    item_id = body["output"][0]["id"]
+    yield _sse("response.created", {"type": "response.created", "response": {**body, "status": "in_progress", "output": []}})
+    for i in range(0, len(text), config.stream_chunk_chars):
+        if config.stream_interval_ms:
+            await asyncio.sleep(config.stream_interval_ms / 1000)
+        yield _sse("response.output_text.delta", {
+            "type": "response.output_text.delta",
+            "item_id": item_id,
+            "output_index": 0,
+            "content_index": 0,
+            "delta": text[i:i + config.stream_chunk_chars],
+        })
+    yield _sse("response.completed", {"type": "response.completed", "response": body})
+
+
+def _sse(event: str, data: Dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def _latency_seconds(config: FakeServerConfig, rng: random.Random) -> float:
+    if config.latency_distribution == "lognormal":
+        delay_ms = config.latency_ms * math.exp(rng.gauss(0.0, config.latency_sigma)) if config.latency_ms else 0.0
+    elif config.latency_distribution == "uniform":
+        delay_ms = config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)
+    else:
+        raise ValueError(f"Unknown latency distribution: {config.latency_distribution}")
+    return max(0.0, delay_ms) / 1000
+
+
+def create_app(config: Optional[FakeServerConfig] = None) -> FastAPI:
+    config = config or FakeServerConfig()
+    stats = FakeServerStats()
+    rng = random.Random(config.seed)
+    app = FastAPI()
+    app.state.config = config
+    app.state.stats = stats
+
+    @app.post("/v1/responses")
+    async def create_response(request: Request):
+        payload = await request.json()
+        name = payload.get("text", {}).get("format", {}).get("name", "")
+        stats.requests += 1
+        stats.by_schema[name] = stats.by_schema.get(name, 0) + 1
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            delay = _latency_seconds(config, rng)
+            if delay:
+                await asyncio.sleep(delay)
+            if stats.requests <= config.fail_first or rng.random() < config.error_rate:
+                stats.errors += 1
+                headers = {}
+                if config.retry_after is not None:
+                    headers["retry-after"] = str(config.retry_after)
+                return JSONResponse(
+                    {"error": {"message": "injected failure", "type": "server_error", "code": None}},
+                    status_code=config.error_status,
+                    headers=headers,
+                )
+            text = json.dumps(CANNED_RESPONSES.get(name, {}))
+            if payload.get("stream"):
+                return StreamingResponse(_stream_events(config, name, text), media_type="text/event-stream")
+            return _response_body(name, text)
+        finally:
+            stats.in_flight -= 1
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.__dict__
+
+    return app
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--latency-distribution", choices=("uniform", "lognormal"), default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+    config = FakeServerConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        latency_distribution=args.latency_distribution,
+        latency_sigma=args.latency_sigma,
+        seed=args.seed,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
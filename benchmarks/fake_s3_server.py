@@ -0,0 +1,129 @@
+"""
+A local stand-in for an S3-compatible object store (path-style PUT, GET and
+HEAD on /{bucket}/{key}), for exercising STORAGE_BACKEND=s3 without AWS or
+MinIO. Objects live in memory. Request signatures are checked against the
+configured credentials, so signing mistakes fail with 403 as they would on S3.
+
+    python -m benchmarks.fake_s3_server --port 9000 --bucket meals
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_BUCKET=meals \\
+        S3_ACCESS_KEY_ID=fake S3_SECRET_ACCESS_KEY=fake uvicorn main:app
+
+In tests, mount it in-process with httpx.ASGITransport(app=create_app(config)).
+"""
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from fastapi import FastAPI, Request, Response
+
+from services.storage_service import sign_request
+
+
+@dataclass
+class FakeS3Config:
+    buckets: List[str] = field(default_factory=lambda: ["meals"])
+    region: str = "us-east-1"
+    access_key: str = "fake"
+    secret_key: str = "fake"
+
+
+@dataclass
+class FakeS3Stats:
+    requests: int = 0
+    puts: int = 0
+    gets: int = 0
+    heads: int = 0
+    rejected: int = 0
+    bytes_received: int = 0
+    # Body chunks received by the largest PUT; above 1 means the upload streamed
+    max_put_chunks: int = 0
+
+
+def _signature_ok(config: FakeS3Config, request: Request) -> bool:
+    authorization = request.headers.get("authorization", "")
+    if not authorization.startswith("AWS4-HMAC-SHA256 "):
+        return False
+    parts = dict(p.strip().split("=", 1) for p in authorization[len("AWS4-HMAC-SHA256 "):].split(","))
+    access_key = parts.get("Credential", "").split("/", 1)[0]
+    if access_key != config.access_key:
+        return False
+    names = parts.get("SignedHeaders", "").split(";")
+    headers = {n: request.headers.get(n, "") for n in names if n not in ("host", "x-amz-date")}
+    try:
+        now = datetime.strptime(request.headers.get("x-amz-date", ""), "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return False
+    expected = sign_request(
+        request.method, request.headers.get("host", ""), request.scope["raw_path"].decode(), headers,
+        config.region, config.access_key, config.secret_key, now=now,
+    )
+    return expected["Authorization"] == authorization
+
+
+def create_app(config: FakeS3Config = None) -> FastAPI:
+    config = config or FakeS3Config()
+    stats = FakeS3Stats()
+    objects: Dict[Tuple[str, str], bytes] = {}
+    app = FastAPI()
+    app.state.config = config
+    app.state.stats = stats
+    app.state.objects = objects
+
+    @app.api_route("/{bucket}/{key:path}", methods=["GET", "HEAD", "PUT"])
+    async def object_route(bucket: str, key: str, request: Request):
+        stats.requests += 1
+        if not _signature_ok(config, request):
+            stats.rejected += 1
+            return Response("<Error><Code>SignatureDoesNotMatch</Code></Error>", status_code=403, media_type="application/xml")
+        if bucket not in config.buckets:
+            return Response("<Error><Code>NoSuchBucket</Code></Error>", status_code=404, media_type="application/xml")
+        if request.method == "PUT":
+            stats.puts += 1
+            chunks = []
+            async for chunk in request.stream():
+                if chunk:
+                    chunks.append(chunk)
+            body = b"".join(chunks)
+            if len(body) != int(request.headers.get("content-length", -1)):
+                return Response("<Error><Code>IncompleteBody</Code></Error>", status_code=400, media_type="application/xml")
+            stats.bytes_received += len(body)
+            stats.max_put_chunks = max(stats.max_put_chunks, len(chunks))
+            objects[(bucket, key)] = body
+            return Response(status_code=200)
+        data = objects.get((bucket, key))
+        if data is None:
+            return Response(None if request.method == "HEAD" else "<Error><Code>NoSuchKey</Code></Error>", status_code=404)
+        if request.method == "HEAD":
+            stats.heads += 1
+            return Response(status_code=200, headers={"content-length": str(len(data))})
+        stats.gets += 1
+        return Response(data, media_type="application/octet-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.__dict__
+
+    return app
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--bucket", action="append", default=None)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--access-key", default="fake")
+    parser.add_argument("--secret-key", default="fake")
+    args = parser.parse_args()
+    config = FakeS3Config(
+        buckets=args.bucket or ["meals"],
+        region=args.region,
+        access_key=args.access_key,
+        secret_key=args.secret_key,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
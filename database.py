@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, TypeVar
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from dotenv import load_dotenv
+
+T = TypeVar("T")
+
+# Load environment variables
+load_dotenv()
+
+# Pool sizing per process; total connections = workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Reconnect connections older than this, ahead of server/proxy idle timeouts
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test connections on checkout so a restarted database does not surface as request errors
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Optional async engine, e.g. postgresql+asyncpg://... or sqlite+aiosqlite:///...;
+# DB_ASYNC=1 derives it from DATABASE_URL
+DB_ASYNC_URL = os.getenv("DB_ASYNC_URL")
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+class _PoolInstrumentation:
+    """
+    Mixin for QueuePool subclasses that records how long checkouts wait for
+    a free connection and how many time out.
+    """
+
+    def _init_stats(self) -> None:
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": self.overflow(),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_seconds_total": self.wait_seconds_total,
+                "checkout_wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class InstrumentedQueuePool(_PoolInstrumentation, QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_stats()
+
+
+class InstrumentedAsyncQueuePool(_PoolInstrumentation, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_stats()
+
+
+def _pool_options(url: str, pool_class) -> Dict[str, Any]:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in a single connection; keep SQLAlchemy's default pool
+        return {}
+    options: Dict[str, Any] = {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if parsed.get_backend_name() == "sqlite":
+        # Pooled connections move between threadpool threads
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def build_engine(url: str) -> Engine:
+    return create_engine(url, **_pool_options(url, InstrumentedQueuePool))
+
+
+def async_url_for(url: str) -> str:
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise RuntimeError(f"No async driver known for {parsed.get_backend_name()}; set DB_ASYNC_URL")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def build_async_engine(url: str):
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        return create_async_engine(url, **_pool_options(url, InstrumentedAsyncQueuePool))
+    except ImportError as e:
+        raise RuntimeError(f"The async engine needs its driver installed (asyncpg or aiosqlite): {e}")
+
+
+db_url = os.getenv("DATABASE_URL")
+if not db_url:
+    raise RuntimeError("DATABASE_URL is not set")
+
+# Database setup
+engine = build_engine(db_url)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC_URL or DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    async_engine = build_async_engine(DB_ASYNC_URL or async_url_for(db_url))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _run_in_new_session(fn: Callable[..., T], *args) -> T:
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+
+async def run_db(fn: Callable[..., T], *args) -> T:
+    """
+    Run `fn(session, *args)` in its own short-lived session, so the pooled
+    connection is back in the pool before the caller awaits anything slow
+    (e.g. the LLM). Uses the async engine on the event loop when configured,
+    otherwise a sync session in the threadpool. `fn` commits if it writes.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args)
+    return await run_in_threadpool(_run_in_new_session, fn, *args)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """
+    Connection pool gauges and checkout wait counters per engine.
+    """
+    stats: Dict[str, Any] = {}
+    for name, eng in (("sync", engine), ("async", async_engine.sync_engine if async_engine is not None else None)):
+        if eng is not None and isinstance(eng.pool, _PoolInstrumentation):
+            stats[name] = eng.pool.stats()
+    return stats
@@ -1,55 +1,101 @@
 import os
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Header, Response, Query
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from dotenv import load_dotenv
-from typing import List
-from schemas import UserCreate, UserRead, MealRead, SuggestRequest, MealSuggestion
-from models import Base
-from services.user_service import create_or_update_user, get_user
-from services.meal_service import analyze_meal, get_meal_history, suggest_meal
-
-# Load environment variables
-load_dotenv()
-
-db_url = os.getenv("DATABASE_URL")
-if not db_url:
-    raise RuntimeError("DATABASE_URL is not set")
-
-# Database setup
-engine = create_engine(db_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Runtime migrations: add new columns if missing
-from sqlalchemy import inspect, text
-def run_migrations():
-    inspector = inspect(engine)
-    if inspector.has_table("users"):
-        cols = [c["name"] for c in inspector.get_columns("users")]
-        with engine.begin() as conn:
-            if "daily_calories" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN daily_calories INTEGER NOT NULL DEFAULT 2000"))
-            if "daily_protein" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN daily_protein INTEGER NOT NULL DEFAULT 75"))
-            if "daily_carbs" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN daily_carbs INTEGER NOT NULL DEFAULT 250"))
-            if "daily_fat" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN daily_fat INTEGER NOT NULL DEFAULT 70"))
-run_migrations()
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date, datetime
+from schemas import UserCreate, UserRead, MealRead, MealPartial, SuggestRequest, MealSuggestion, NutritionSummary, JobRead, QueueStats
+from database import SessionLocal, engine, get_db, pool_stats, run_db
+from migrations import ensure_schema
+from services.user_service import configure_user_cache, create_or_update_user, get_user, user_cache
+from services.cache_service import InvalidationChannel
+from services import meal_service
+from services.meal_service import (
+    analyze_meal,
+    analyze_meal_stream,
+    analyze_meals,
+    get_meal_history,
+    suggest_meal,
+    suggest_meal_stream,
+    configure_caches,
+)
+from services.openai_service import close_client
+from services import metrics
+from services.metrics import MetricsMiddleware
+from services.serialization import FastJSONResponse
+from services.timing import StageTimer
+from services.rollup_service import get_nutrition_summary
+from services.recipe_index import configure_recipe_index
+from services.rate_limit import configure_rate_limiter, enforce_rate_limit
+from services import storage_service
+from services.storage_service import MAX_UPLOAD_BYTES, UploadLimitMiddleware
+from services.job_service import JOB_WORKERS, JobWorkerPool, enqueue_analysis, get_job, queue_stats
+from services.streaming import NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, encode_events, wants_ndjson
+
+# Versioned migrations; once the schema is current this is a single version query
+ensure_schema(engine)
+
+# Caches may be backed by the database (CACHE_BACKEND=db)
+configure_caches(SessionLocal)
+
+# Per-user limits on the model-backed endpoints (RATE_LIMIT_BACKEND=db shares them across workers)
+configure_rate_limiter(SessionLocal)
+
+# Local recipe index for /suggest_meal, memory-mapped (built on first start)
+if os.getenv("RECIPE_INDEX", "on") == "on":
+    configure_recipe_index(SessionLocal)
+
+# With several worker processes, CACHE_INVALIDATION=db keeps their user caches coherent
+invalidation_channel = None
+if os.getenv("CACHE_INVALIDATION", "none") == "db":
+    invalidation_channel = InvalidationChannel(
+        SessionLocal, poll_interval=float(os.getenv("CACHE_INVALIDATION_POLL_SECONDS", "1"))
+    )
+configure_user_cache(invalidation_channel)
 
-app = FastAPI()
+# Runs /analyze_meal?mode=async jobs from the analysis_jobs table
+job_pool = JobWorkerPool(SessionLocal)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the nutrition memo from the last snapshot, if configured
+    nutrition_cache_path = os.getenv("NUTRITION_CACHE_PATH")
+    if nutrition_cache_path:
+        meal_service.nutrition_memo.load(nutrition_cache_path)
+    if JOB_WORKERS > 0:
+        job_pool.start()
+    if invalidation_channel is not None:
+        invalidation_channel.start()
+    yield
+    await job_pool.stop()
+    if invalidation_channel is not None:
+        await invalidation_channel.stop()
+    if nutrition_cache_path:
+        meal_service.nutrition_memo.save(nutrition_cache_path)
+    # Release pooled OpenAI and object storage connections on shutdown
+    await close_client()
+    await storage_service.image_storage.close()
+
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "20"))
+# Body limit for routes without file uploads (JSON and plain form posts)
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(1024 * 1024)))
+# Room for the form fields and multipart framing around the files
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+app = FastAPI(lifespan=lifespan)
+# Oversized bodies are cut off while streaming in, before they are spooled to disk;
+# each file is then held to MAX_UPLOAD_BYTES
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_bytes=MAX_REQUEST_BYTES,
+    path_limits={
+        "/analyze_meal": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+        "/analyze_meals": MAX_BATCH_FILES * MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    },
+)
+app.add_middleware(MetricsMiddleware)
 
 @app.post("/user", response_model=UserRead)
 def create_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -59,26 +105,131 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
 def get_user_profile(user_id: int, db: Session = Depends(get_db)):
     return get_user(db, user_id)
 
+def _wants_stream(stream: bool, accept: Optional[str]) -> bool:
+    return stream or any(t in (accept or "") for t in (SSE_MEDIA_TYPE, NDJSON_MEDIA_TYPE))
+
+def _event_stream_response(events, accept: Optional[str]) -> StreamingResponse:
+    # SSE by default; NDJSON when the client asks for it
+    ndjson = wants_ndjson(accept)
+    return StreamingResponse(
+        encode_events(events, ndjson),
+        media_type=NDJSON_MEDIA_TYPE if ndjson else SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/analyze_meal", response_model=MealRead)
-async def analyze_meal_route(user_id: int = Form(...), file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def analyze_meal_route(
+    user_id: int = Form(...),
+    file: UploadFile = File(...),
+    stream: bool = Query(False, description="Stream items, nutrition and advice as they are ready"),
+    mode: str = Query("sync", pattern="^(sync|async)$", description="async: queue the photo and return 202 with a job id"),
+    callback_url: Optional[str] = Form(None),
+    accept: Optional[str] = Header(None),
+):
+    timer = StageTimer("analyze_meal")
+    await enforce_rate_limit("analyze_meal", user_id)
     try:
-        result = await analyze_meal(db, user_id, file)
-        return jsonable_encoder(result)
+        if mode == "async":
+            job, _ = await enqueue_analysis(run_db, user_id, file, callback_url)
+            job_pool.notify()
+            return JSONResponse(status_code=202, content=jsonable_encoder(job), headers={"Location": f"/jobs/{job.id}"})
+        if _wants_stream(stream, accept):
+            events = await analyze_meal_stream(run_db, user_id, file)
+            return _event_stream_response(events, accept)
+        with timer.stage("total"):
+            result = await analyze_meal(run_db, user_id, file, timer)
+        # Per-stage latencies, visible in browser devtools
+        return FastJSONResponse(result, headers={"Server-Timing": timer.server_timing()})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/meal_history/{user_id}", response_model=List[MealRead])
-def meal_history_route(user_id: int, db: Session = Depends(get_db)):
-    return get_meal_history(db, user_id)
+@app.post("/analyze_meals", response_model=List[MealRead])
+async def analyze_meals_route(user_id: int = Form(...), files: List[UploadFile] = File(...)):
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    # Same bucket as single uploads, one token per photo
+    await enforce_rate_limit("analyze_meal", user_id, cost=len(files))
+    timer = StageTimer("analyze_meals")
+    try:
+        with timer.stage("total"):
+            results = await analyze_meals(run_db, user_id, files, timer)
+        return FastJSONResponse(results, headers={"Server-Timing": timer.server_timing()})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/meal_history/{user_id}", response_model=List[MealPartial], response_model_exclude_unset=True)
+async def meal_history_route(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated meal fields to return"),
+):
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    meals, next_cursor = await run_db(get_meal_history, user_id, limit, cursor, since, until, selected)
+    # Pass back as ?cursor= to fetch the next (older) page
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    # Rows already have the MealPartial shape; serialize them directly
+    return FastJSONResponse(meals, headers=headers)
+
+@app.get("/nutrition_summary/{user_id}", response_model=NutritionSummary)
+async def nutrition_summary_route(
+    user_id: int,
+    period: str = Query("day", pattern="^(day|week|month)$"),
+    on: Optional[date] = Query(None, description="Any date inside the period; defaults to today (UTC)"),
+):
+    return await run_db(get_nutrition_summary, user_id, period, on)
 
 @app.post("/suggest_meal", response_model=MealSuggestion)
-def suggest_meal_route(request: SuggestRequest, db: Session = Depends(get_db)):
+async def suggest_meal_route(
+    request: SuggestRequest,
+    stream: bool = Query(False, description="Stream the suggestion text as it is generated"),
+    accept: Optional[str] = Header(None),
+):
+    await enforce_rate_limit("suggest_meal", request.user_id)
     try:
-        suggestion = suggest_meal(db, request.user_id, request.fridge_items)
+        if _wants_stream(stream, accept):
+            events = await suggest_meal_stream(run_db, request.user_id, request.fridge_items)
+            return _event_stream_response(events, accept)
+        suggestion = await suggest_meal(run_db, request.user_id, request.fridge_items)
         return suggestion
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/stats", response_model=QueueStats)
+def job_stats_route(db: Session = Depends(get_db)):
+    return queue_stats(db)
+
+@app.get("/jobs/{job_id}", response_model=JobRead)
+def job_route(job_id: str, db: Session = Depends(get_db)):
+    return get_job(db, job_id)
+
+@app.get("/db/stats")
+def db_stats_route():
+    # Pool gauges plus checkout wait counters; a growing wait means the pool is too small
+    return pool_stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_route():
+    # Cache, queue and pool figures are sampled at scrape time; the rest is recorded as requests run
+    memo = meal_service.nutrition_memo.stats()
+    metrics.record_cache_stats("food_items", **_cache_counts(meal_service.detection_cache.stats()))
+    metrics.record_cache_stats("nutrition", memo["meal_hits"] + memo["item_hits"], memo["misses"])
+    metrics.record_cache_stats("users", **_cache_counts(user_cache.stats()))
+    metrics.record_queue_stats(await run_db(queue_stats))
+    metrics.record_pool_stats(pool_stats())
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def _cache_counts(stats):
+    return {"hits": stats["hits"], "misses": stats["misses"], "entries": stats["size"]}
+
 @app.get("/", response_class=HTMLResponse)
 def read_root():
     with open("frontend/index.html") as f:
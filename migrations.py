@@ -0,0 +1,171 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in schema_migrations. App start-up calls
+ensure_schema(), which costs a single version query once the database is
+current; pending migrations run in one process at a time under an advisory
+lock. Every schema change, including a new table, gets a new entry at the
+end of MIGRATIONS so HEAD moves forward.
+
+    python -m migrations        # apply pending migrations (e.g. as a deploy step)
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional
+from sqlalchemy import exc, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from models import Base, DailyNutrition, RateLimitBucket, SchemaMigration, SuggestedRecipe, User
+
+logger = logging.getLogger(__name__)
+
+# auto: migrate at start-up if behind; check: refuse to start if behind
+# (migrations run as a deploy step); skip: no start-up query at all
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "auto")
+# Application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 724_110_016
+
+_local_lock = threading.Lock()
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+# 1 and 2 replace the old runtime checks and stay idempotent, since databases
+# created before versioning may already have either change
+def _add_user_goal_columns(conn: Connection) -> None:
+    cols = [c["name"] for c in inspect(conn).get_columns("users")]
+    for name, default in (("daily_calories", 2000), ("daily_protein", 75), ("daily_carbs", 250), ("daily_fat", 70)):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} INTEGER NOT NULL DEFAULT {default}"))
+
+
+def _add_meals_user_timestamp_index(conn: Connection) -> None:
+    if inspect(conn).has_table("meals"):
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_meals_user_id_timestamp ON meals (user_id, timestamp)"))
+
+
+def _create_suggested_recipes(conn: Connection) -> None:
+    SuggestedRecipe.__table__.create(conn, checkfirst=True)
+
+
+def _create_rate_limit_buckets(conn: Connection) -> None:
+    RateLimitBucket.__table__.create(conn, checkfirst=True)
+
+
+def _backfill_daily_nutrition(conn: Connection) -> None:
+    # Totals are read only from the rollup, so databases with meals from
+    # before it existed need it rebuilt from the meals table once
+    from services.rollup_service import backfill_daily_rollup
+    DailyNutrition.__table__.create(conn, checkfirst=True)
+    with Session(bind=conn) as db:
+        written = backfill_daily_rollup(db)
+    logger.info("backfilled %d daily_nutrition rows", written)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "user daily macro goals", _add_user_goal_columns),
+    Migration(2, "meals (user_id, timestamp) index", _add_meals_user_timestamp_index),
+    Migration(3, "suggested_recipes table", _create_suggested_recipes),
+    Migration(4, "rate_limit_buckets table", _create_rate_limit_buckets),
+    Migration(5, "backfill daily_nutrition from meals", _backfill_daily_nutrition),
+]
+HEAD = MIGRATIONS[-1].version
+
+
+@contextmanager
+def _migration_lock(conn: Connection) -> Iterator[None]:
+    if conn.dialect.name == "postgresql":
+        # Session-level lock: other processes block here until this one is done
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+    else:
+        # No advisory locks (e.g. SQLite): serialize within this process and
+        # run `python -m migrations` before starting several workers
+        with _local_lock:
+            yield
+
+
+def _record(conn: Connection, migration: Migration) -> None:
+    conn.execute(SchemaMigration.__table__.insert().values(version=migration.version, name=migration.name))
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """
+    Highest applied version, or None if the database is not versioned yet.
+    """
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+    except exc.DBAPIError:
+        return None
+
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Apply pending migrations under the migration lock and return their
+    versions. A new database gets the current schema from the models and is
+    stamped with every version instead of replaying them.
+    """
+    with engine.connect() as conn, _migration_lock(conn):
+        SchemaMigration.__table__.create(conn, checkfirst=True)
+        applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+        pending = [m for m in MIGRATIONS if m.version not in applied]
+        if not pending:
+            # Another process got here first
+            conn.commit()
+            return []
+        if not applied and not inspect(conn).has_table(User.__tablename__):
+            Base.metadata.create_all(conn)
+            for migration in pending:
+                _record(conn, migration)
+            conn.commit()
+            return [m.version for m in pending]
+        for migration in pending:
+            logger.info("applying migration %d: %s", migration.version, migration.name)
+            migration.upgrade(conn)
+            _record(conn, migration)
+            conn.commit()
+        # Tables the database has never had
+        Base.metadata.create_all(conn)
+        conn.commit()
+        return [m.version for m in pending]
+
+
+def ensure_schema(engine: Engine, mode: str = DB_MIGRATE_ON_STARTUP) -> None:
+    """
+    Start-up check: one version query when the schema is current,
+    otherwise migrate (auto) or fail (check).
+    """
+    if mode == "skip":
+        return
+    version = current_version(engine)
+    if version == HEAD:
+        return
+    if version is not None and version > HEAD:
+        # Rolling deploy: a newer release has already migrated
+        logger.warning("database schema version %d is newer than this release (%d)", version, HEAD)
+        return
+    if mode == "check":
+        raise RuntimeError(f"Database schema is at version {version or 0}, expected {HEAD}; run `python -m migrations`")
+    applied = migrate(engine)
+    if applied:
+        logger.info("database schema migrated to version %d", HEAD)
+
+
+if __name__ == "__main__":
+    from database import engine
+    logging.basicConfig(level=logging.INFO)
+    applied = migrate(engine)
+    print(f"applied {applied}" if applied else "nothing to apply", f"- schema version {HEAD}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, Text
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -28,3 +28,87 @@ class Meal(Base):
     food_items = Column(JSON, nullable=False)
     nutrition_info = Column(JSON, nullable=False)
     feedback = Column(JSON, nullable=False)
+
+    # Serves per-user date-range queries (today's meals, history pages)
+    __table_args__ = (Index("ix_meals_user_id_timestamp", "user_id", "timestamp"),)
+
+# Per-user daily intake rollup, updated in the same transaction as Meal inserts
+class DailyNutrition(Base):
+    __tablename__ = "daily_nutrition"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    calories = Column(Integer, nullable=False, default=0)
+    protein = Column(Integer, nullable=False, default=0)
+    carbs = Column(Integer, nullable=False, default=0)
+    fat = Column(Integer, nullable=False, default=0)
+    meal_count = Column(Integer, nullable=False, default=0)
+
+class CacheEntry(Base):
+    __tablename__ = "cache_entries"
+    namespace = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Cross-process cache invalidation events (see cache_service.InvalidationChannel)
+class CacheInvalidation(Base):
+    __tablename__ = "cache_invalidations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    namespace = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Queued /analyze_meal?mode=async work; the table is the queue, so jobs survive restarts
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    image_path = Column(String, nullable=False)
+    image_hash = Column(String, nullable=False)
+    # "<user_id>:<image_hash>" while the job is live or done; cleared on failure so the upload can be retried
+    dedupe_key = Column(String, nullable=True, unique=True)
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    callback_url = Column(String, nullable=True)
+    meal_id = Column(Integer, ForeignKey("meals.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # A running job whose lease has expired (e.g. its worker died) is picked up again
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_analysis_jobs_status_created_at", "status", "created_at"),)
+
+# Recipes learned from /suggest_meal answers; feeds the local recipe index (see services/recipe_index.py)
+class SuggestedRecipe(Base):
+    __tablename__ = "suggested_recipes"
+    # Canonical recipe name
+    key = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    ingredients = Column(JSON, nullable=False)
+    # Per-serving macros as reported by the model; null when it gave none
+    calories = Column(Integer, nullable=True)
+    protein = Column(Integer, nullable=True)
+    carbs = Column(Integer, nullable=True)
+    fat = Column(Integer, nullable=True)
+    times_suggested = Column(Integer, nullable=False, default=1)
+    last_suggested_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Token buckets shared by all workers when RATE_LIMIT_BACKEND=db (see services/rate_limit.py)
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+    # "<endpoint>:<user_id>"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # Unix time of the last refill
+    updated_at = Column(Float, nullable=False)
+    # Bumped on every write; updates are compare-and-set on it
+    version = Column(Integer, nullable=False, default=0)
+
+# Applied schema versions (see migrations.py)
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
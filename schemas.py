@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import date, datetime
 
 class UserBase(BaseModel):
     class Config:
@@ -51,6 +51,16 @@ class MealRead(BaseModel):
     class Config:
         from_attributes = True
 
+# Meal with only the fields selected via `fields=` on /meal_history
+class MealPartial(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    timestamp: Optional[datetime] = None
+    image_path: Optional[str] = None
+    food_items: Optional[Dict[str, Any]] = None
+    nutrition_info: Optional[Dict[str, Any]] = None
+    feedback: Optional[Dict[str, Any]] = None
+
 # Request schema for meal suggestion based on fridge ingredients
 class SuggestRequest(BaseModel):
     user_id: int
@@ -64,3 +74,42 @@ class MealSuggestion(BaseModel):
 
     class Config:
         from_attributes = True
+
+class DailyNutritionRead(BaseModel):
+    date: date
+    calories: int
+    protein: int
+    carbs: int
+    fat: int
+    meal_count: int
+
+# Response schema for daily/weekly/monthly intake served from the rollup
+class NutritionSummary(BaseModel):
+    user_id: int
+    period: str
+    start: date
+    end: date
+    meal_count: int
+    totals: NutritionInfo
+    goals: NutritionInfo
+    remaining: NutritionInfo
+    days: List[DailyNutritionRead]
+
+class JobRead(BaseModel):
+    id: str
+    user_id: int
+    status: str
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    # The saved meal once status is "done"
+    result: Optional[MealRead] = None
+
+class QueueStats(BaseModel):
+    queued: int
+    running: int
+    done: int
+    failed: int
+    oldest_queued_age_seconds: float
@@ -0,0 +1,271 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import CacheEntry, CacheInvalidation
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """
+    Minimal key/value interface shared by the cache backends. Values must be
+    JSON-serializable so every backend can store them.
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await run_in_threadpool(self.get, key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        await run_in_threadpool(self.set, key, value)
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process LRU cache bounded by entry count, with optional TTL in seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """
+        Live (key, value) pairs from least to most recently used.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, exp) in self._data.items() if exp is None or exp > now]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+    # Pure in-memory work: no need to hop to the threadpool
+    async def aget(self, key: str) -> Optional[Any]:
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+
+class SQLCache(CacheBackend):
+    """
+    Cache backed by the `cache_entries` table (works on SQLite and Postgres),
+    so entries are shared between workers and survive restarts.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], namespace: str, ttl: Optional[float] = None):
+        self.session_factory = session_factory
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.session_factory() as db:
+            entry = db.get(CacheEntry, (self.namespace, key))
+            if entry is None:
+                return None
+            if self.ttl and entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+                return None
+            return entry.value
+
+    def set(self, key: str, value: Any) -> None:
+        with self.session_factory() as db:
+            db.merge(CacheEntry(namespace=self.namespace, key=key, value=value, created_at=datetime.utcnow()))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker stored the same key concurrently; keep theirs
+                db.rollback()
+
+    def purge_expired(self) -> int:
+        """
+        Delete entries older than the TTL; returns the number of rows removed.
+        """
+        if not self.ttl:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        with self.session_factory() as db:
+            removed = (
+                db.query(CacheEntry)
+                .filter(CacheEntry.namespace == self.namespace, CacheEntry.created_at < cutoff)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return removed
+
+
+class TieredCache(CacheBackend):
+    """
+    In-process LRU in front of a shared backend: reads fall through to the
+    backend and are promoted, writes go to both.
+    """
+
+    def __init__(self, front: LRUCache, back: CacheBackend):
+        self.front = front
+        self.back = back
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is not None:
+                self.front.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.front.set(key, value)
+        self.back.set(key, value)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        value = self.front.get(key)
+        if value is None:
+            value = await self.back.aget(key)
+            if value is not None:
+                self.front.set(key, value)
+        return value
+
+    async def aset(self, key: str, value: Any) -> None:
+        self.front.set(key, value)
+        await self.back.aset(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        # Front-tier counts: a miss here may still have been served by the backend
+        return self.front.stats()
+
+
+def make_cache(namespace: str, session_factory: Optional[Callable[[], Session]] = None) -> CacheBackend:
+    """
+    Build a cache from environment settings:
+    CACHE_BACKEND (memory|db), CACHE_MAXSIZE and CACHE_TTL_SECONDS.
+    """
+    backend = os.getenv("CACHE_BACKEND", "memory")
+    ttl = float(os.getenv("CACHE_TTL_SECONDS", "0")) or None
+    front = LRUCache(maxsize=int(os.getenv("CACHE_MAXSIZE", "1024")), ttl=ttl)
+    if backend == "db":
+        if session_factory is None:
+            raise RuntimeError("CACHE_BACKEND=db requires a database session factory")
+        return TieredCache(front, SQLCache(session_factory, namespace, ttl=ttl))
+    if backend != "memory":
+        raise RuntimeError(f"Unknown CACHE_BACKEND: {backend}")
+    return front
+
+
+class InvalidationChannel:
+    """
+    Cross-process cache invalidation through the `cache_invalidations` table,
+    a portable stand-in for Postgres LISTEN/NOTIFY. publish() records a
+    (namespace, key) event; every process polls for events newer than the
+    last one it saw and drops those keys from its subscribed local caches.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], poll_interval: float = 1.0, retention: float = 3600.0):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.last_id: Optional[int] = None
+        self._subscribers: Dict[str, List[LRUCache]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, namespace: str, cache: LRUCache) -> None:
+        self._subscribers.setdefault(namespace, []).append(cache)
+
+    def publish(self, namespace: str, key: str) -> None:
+        with self.session_factory() as db:
+            db.add(CacheInvalidation(namespace=namespace, key=key, created_at=datetime.utcnow()))
+            db.commit()
+
+    def poll_once(self) -> int:
+        """
+        Apply events published since the last poll; returns how many were applied.
+        """
+        with self.session_factory() as db:
+            if self.last_id is None:
+                # Start from the current head: the local caches are empty anyway
+                self.last_id = db.query(func.coalesce(func.max(CacheInvalidation.id), 0)).scalar()
+                return 0
+            events = (
+                db.query(CacheInvalidation.id, CacheInvalidation.namespace, CacheInvalidation.key)
+                .filter(CacheInvalidation.id > self.last_id)
+                .order_by(CacheInvalidation.id)
+                .all()
+            )
+            for event_id, namespace, key in events:
+                for cache in self._subscribers.get(namespace, []):
+                    cache.delete(key)
+                self.last_id = event_id
+            return len(events)
+
+    def purge_old(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        with self.session_factory() as db:
+            removed = db.query(CacheInvalidation).filter(CacheInvalidation.created_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+            return removed
+
+    def start(self) -> None:
+        self.poll_once()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        polls = 0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await run_in_threadpool(self.poll_once)
+                polls += 1
+                if polls % 600 == 0:
+                    await run_in_threadpool(self.purge_old)
+            except Exception:
+                logger.exception("cache invalidation poll failed")
@@ -0,0 +1,23 @@
+from typing import Any, Awaitable, Callable
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+# `await run_db(fn, *args)` runs `fn(session, *args)` in its own short-lived
+# session and returns the result. The app uses database.run_db; job workers
+# and tests build one from a sessionmaker with session_runner().
+DbRunner = Callable[..., Awaitable[Any]]
+
+
+def session_runner(session_factory: Callable[[], Session]) -> DbRunner:
+    """
+    A DbRunner that opens a session from `session_factory` per call and runs
+    `fn` in the threadpool, so no connection is held between calls.
+    """
+    def run_in_session(fn: Callable[..., Any], *args) -> Any:
+        with session_factory() as db:
+            return fn(db, *args)
+
+    async def run_db(fn: Callable[..., Any], *args) -> Any:
+        return await run_in_threadpool(run_in_session, fn, *args)
+
+    return run_db
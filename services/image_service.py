@@ -0,0 +1,52 @@
+import os
+import io
+from typing import BinaryIO, Tuple
+from fastapi import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Longest side of the image sent to the vision model and kept for history
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1024"))
+# JPEG or WEBP
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+# Also keep the untouched upload in image storage
+STORE_ORIGINAL_UPLOADS = os.getenv("STORE_ORIGINAL_UPLOADS", "0") == "1"
+
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".png": "image/png", ".gif": "image/gif"}
+
+
+def preprocess_image(
+    source: BinaryIO,
+    max_dimension: int = IMAGE_MAX_DIMENSION,
+    image_format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> Tuple[bytes, str]:
+    """
+    Downscale an uploaded photo to `max_dimension`, apply and drop its EXIF
+    data, and re-encode it compactly. Reads lazily from `source` (e.g. the
+    UploadFile's spooled file) so the original is never copied into memory
+    as a whole. Returns (encoded bytes, file extension).
+    """
+    if image_format not in EXTENSIONS:
+        raise ValueError(f"Unsupported IMAGE_FORMAT: {image_format}")
+    try:
+        with Image.open(source) as img:
+            # JPEG decoders can scale by 1/2..1/8 while decoding, which skips most of the work
+            img.draft("RGB", (max_dimension, max_dimension))
+            # Bake in the EXIF orientation; the metadata itself is not written back out
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("RGB")
+            img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            if image_format == "WEBP":
+                img.save(out, "WEBP", quality=quality, method=4)
+            else:
+                img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Unsupported or corrupt image: {e}")
+    return out.getvalue(), EXTENSIONS[image_format]
+
+
+def mime_type_for(path: str) -> str:
+    return MIME_TYPES.get(os.path.splitext(path)[1].lower(), "image/jpeg")
@@ -0,0 +1,375 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import ipaddress
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import httpx
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import AnalysisJob, Meal
+from schemas import JobRead, MealRead
+from services import meal_service
+from services.db_runner import DbRunner, session_runner
+from services.user_service import get_user
+
+logger = logging.getLogger(__name__)
+
+# Worker tasks per process; 0 disables the in-process workers (e.g. API-only replicas)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often idle workers look for new jobs (enqueues in the same process wake them immediately)
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+# A running job is handed to another worker if not finished within its lease
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "5"))
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_ATTEMPTS = 3
+# Callback hosts to trust even if they resolve to private addresses (e.g. an internal webhook relay)
+JOB_CALLBACK_ALLOWED_HOSTS = {h.strip().lower() for h in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+STATUSES = (QUEUED, RUNNING, DONE, FAILED)
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _validate_callback_url(callback_url: Optional[str]) -> None:
+    """
+    Callbacks are POSTed from inside our network, so the host must resolve
+    only to public addresses (no loopback, link-local, private or reserved
+    ranges) unless it is listed in JOB_CALLBACK_ALLOWED_HOSTS. Resolves DNS,
+    so call it from a thread.
+    """
+    if callback_url is None:
+        return
+    parsed = urlparse(callback_url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise HTTPException(status_code=400, detail="callback_url must be an absolute http(s) URL")
+    host = parsed.hostname.lower()
+    if host in JOB_CALLBACK_ALLOWED_HOSTS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="callback_url host does not resolve")
+    if not all(_is_public_address(a) for a in addresses):
+        raise HTTPException(status_code=400, detail="callback_url must not point to a private or local address")
+
+
+async def enqueue_analysis(
+    run_db: DbRunner,
+    user_id: int,
+    file: UploadFile,
+    callback_url: Optional[str] = None,
+) -> Tuple[JobRead, bool]:
+    """
+    Store the upload and queue it for analysis. Resubmitting the same image
+    for the same user while its job is still queued or running returns that
+    job instead of queueing another; a callback_url given on resubmission is
+    added to a job that had none, and one that conflicts is rejected (409).
+    Returns (job, created).
+    """
+    await run_in_threadpool(_validate_callback_url, callback_url)
+    # Validate user exists
+    await run_db(get_user, user_id)
+    image = await meal_service.store_upload(file)
+    return await run_db(_insert_job, user_id, image.location, image.image_hash, callback_url)
+
+
+def _insert_job(
+    db: Session,
+    user_id: int,
+    file_path: str,
+    image_hash: str,
+    callback_url: Optional[str],
+) -> Tuple[JobRead, bool]:
+    dedupe_key = f"{user_id}:{image_hash}"
+    existing = db.query(AnalysisJob).filter(AnalysisJob.dedupe_key == dedupe_key).first()
+    if existing is not None:
+        return _merge_callback(db, existing, callback_url), False
+    job = AnalysisJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        image_path=file_path,
+        image_hash=image_hash,
+        dedupe_key=dedupe_key,
+        status=QUEUED,
+        attempts=0,
+        callback_url=callback_url,
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent identical submission won the unique dedupe_key
+        db.rollback()
+        existing = db.query(AnalysisJob).filter(AnalysisJob.dedupe_key == dedupe_key).one()
+        return _merge_callback(db, existing, callback_url), False
+    return _job_to_read(db, job), True
+
+
+def _merge_callback(db: Session, job: AnalysisJob, callback_url: Optional[str]) -> JobRead:
+    # A resubmission may add a callback to an in-flight job, but not replace one
+    if callback_url is not None and callback_url != job.callback_url:
+        if job.callback_url is not None:
+            raise HTTPException(status_code=409, detail="Job for this image already has a different callback_url")
+        job.callback_url = callback_url
+        db.commit()
+    return _job_to_read(db, job)
+
+
+def _job_to_read(db: Session, job: AnalysisJob) -> JobRead:
+    meal = db.get(Meal, job.meal_id) if job.meal_id is not None else None
+    return JobRead(
+        id=job.id,
+        user_id=job.user_id,
+        status=job.status,
+        attempts=job.attempts,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+        result=MealRead.model_validate(meal) if meal is not None else None,
+    )
+
+
+def get_job(db: Session, job_id: str) -> JobRead:
+    job = db.get(AnalysisJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_to_read(db, job)
+
+
+def claim_next_job(db: Session, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """
+    Atomically mark the oldest runnable job as running and return it.
+    Runnable means queued (and past any retry delay) or running with an
+    expired lease. The claim is a conditional UPDATE, so concurrent workers
+    in any number of processes never run the same job twice.
+    """
+    now = now or datetime.utcnow()
+    runnable = (
+        AnalysisJob.status.in_((QUEUED, RUNNING)),
+        or_(AnalysisJob.lease_expires_at.is_(None), AnalysisJob.lease_expires_at <= now),
+    )
+    candidates = db.query(AnalysisJob.id).filter(*runnable).order_by(AnalysisJob.created_at).limit(5).all()
+    for (job_id,) in candidates:
+        claimed = db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, *runnable)
+            .values(
+                status=RUNNING,
+                attempts=AnalysisJob.attempts + 1,
+                started_at=now,
+                lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            )
+        ).rowcount
+        db.commit()
+        if claimed:
+            job = db.get(AnalysisJob, job_id)
+            return {
+                "id": job.id,
+                "user_id": job.user_id,
+                "image_path": job.image_path,
+                "image_hash": job.image_hash,
+                "attempts": job.attempts,
+            }
+    db.rollback()
+    return None
+
+
+def _finish_job(session_factory: Callable[[], Session], job_id: str, **values) -> JobRead:
+    with session_factory() as db:
+        job = db.get(AnalysisJob, job_id)
+        for key, value in values.items():
+            setattr(job, key, value)
+        db.commit()
+        return _job_to_read(db, job)
+
+
+def _record_success(session_factory: Callable[[], Session], job_id: str, meal_id: int) -> JobRead:
+    # Dedupe only covers in-flight jobs: the same photo sent later is a new meal
+    return _finish_job(
+        session_factory, job_id,
+        status=DONE, meal_id=meal_id, error=None, dedupe_key=None, finished_at=datetime.utcnow(),
+        lease_expires_at=None,
+    )
+
+
+def _record_failure(session_factory: Callable[[], Session], job_id: str, error: str, attempts: int, final: bool) -> JobRead:
+    if final:
+        # Free the dedupe key so the same photo can be submitted again
+        return _finish_job(
+            session_factory, job_id,
+            status=FAILED, error=error, dedupe_key=None, finished_at=datetime.utcnow(), lease_expires_at=None,
+        )
+    retry_at = datetime.utcnow() + timedelta(seconds=JOB_RETRY_DELAY_SECONDS * 2 ** (attempts - 1))
+    return _finish_job(session_factory, job_id, status=QUEUED, error=error, lease_expires_at=retry_at)
+
+
+def _callback_url(session_factory: Callable[[], Session], job_id: str) -> Optional[str]:
+    # Read at delivery, since a resubmission may have added one after the claim
+    with session_factory() as db:
+        return db.query(AnalysisJob.callback_url).filter(AnalysisJob.id == job_id).scalar()
+
+
+def _requeue(session_factory: Callable[[], Session], job_id: str) -> None:
+    # Interrupted (e.g. shutdown) rather than failed: give the attempt back
+    with session_factory() as db:
+        db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.status == RUNNING)
+            .values(status=QUEUED, attempts=AnalysisJob.attempts - 1, lease_expires_at=None)
+        )
+        db.commit()
+
+
+def _error_text(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return f"{error.status_code}: {error.detail}"
+    return str(error) or type(error).__name__
+
+
+async def run_job(session_factory: Callable[[], Session], job: Dict[str, Any]) -> JobRead:
+    """
+    Run one claimed job through detection, nutrition and advice, record the
+    outcome and notify the callback URL, if any. Client errors (4xx) fail
+    the job immediately; other errors are retried with backoff until
+    JOB_MAX_ATTEMPTS.
+    """
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        # Claimed again after its worker died mid-run too many times
+        result = await run_in_threadpool(
+            _record_failure, session_factory, job["id"], "Lease expired too many times", job["attempts"], True
+        )
+    else:
+        try:
+            meal = await meal_service.analyze_stored_meal(
+                session_runner(session_factory), job["user_id"], job["image_path"], job["image_hash"]
+            )
+        except asyncio.CancelledError:
+            # Shielded, so the cancellation that interrupted the job does not also stop the requeue
+            await asyncio.shield(run_in_threadpool(_requeue, session_factory, job["id"]))
+            raise
+        except Exception as e:
+            final = (isinstance(e, HTTPException) and e.status_code < 500) or job["attempts"] >= JOB_MAX_ATTEMPTS
+            logger.warning("job %s attempt %d failed: %s", job["id"], job["attempts"], _error_text(e))
+            result = await run_in_threadpool(
+                _record_failure, session_factory, job["id"], _error_text(e), job["attempts"], final
+            )
+            if not final:
+                return result
+        else:
+            result = await run_in_threadpool(_record_success, session_factory, job["id"], meal["id"])
+    callback_url = await run_in_threadpool(_callback_url, session_factory, job["id"])
+    if callback_url:
+        await _send_callback(callback_url, result)
+    return result
+
+
+async def _send_callback(callback_url: str, job: JobRead) -> None:
+    try:
+        # Checked again at delivery, since DNS may have changed since the job was queued
+        await run_in_threadpool(_validate_callback_url, callback_url)
+    except HTTPException as e:
+        logger.warning("not calling back job %s: %s", job.id, e.detail)
+        return
+    payload = job.model_dump(mode="json")
+    async with httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT_SECONDS) as client:
+        for attempt in range(JOB_CALLBACK_ATTEMPTS):
+            try:
+                res = await client.post(callback_url, json=payload)
+                if res.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                logger.warning("callback for job %s failed: %s", job.id, e)
+            await asyncio.sleep(2 ** attempt)
+    logger.warning("giving up on callback for job %s to %s", job.id, callback_url)
+
+
+def queue_stats(db: Session, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Job counts by status plus the age of the oldest queued job.
+    """
+    now = now or datetime.utcnow()
+    counts = dict(db.query(AnalysisJob.status, func.count()).group_by(AnalysisJob.status).all())
+    oldest = db.query(func.min(AnalysisJob.created_at)).filter(AnalysisJob.status == QUEUED).scalar()
+    stats: Dict[str, Any] = {status: int(counts.get(status, 0)) for status in STATUSES}
+    stats["oldest_queued_age_seconds"] = (now - oldest).total_seconds() if oldest else 0.0
+    return stats
+
+
+class JobWorkerPool:
+    """
+    `concurrency` worker tasks that claim and run queued jobs. Idle workers
+    poll the table, so several processes can share one queue; notify()
+    wakes this process's workers right after an enqueue.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        concurrency: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        with self.session_factory() as db:
+            return claim_next_job(db)
+
+    async def run_once(self) -> bool:
+        """
+        Claim and run one job; False if none was runnable.
+        """
+        job = await run_in_threadpool(self._claim)
+        if job is None:
+            return False
+        await run_job(self.session_factory, job)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep the worker alive through transient DB errors
+                logger.exception("job worker error")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
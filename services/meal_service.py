@@ -1,49 +1,122 @@
 import os
-import uuid
 import json
-from typing import List, Dict, Any
+import asyncio
+import hashlib
+import logging
+from typing import List, Dict, Any, AsyncIterator, NamedTuple, Optional, Callable, Tuple
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from models import Meal
-from schemas import AdviceResponse, MealRead, NutritionInfo, MealSuggestion
+from schemas import AdviceResponse, NutritionInfo, MealSuggestion, UserRead
 from services.user_service import get_user
-from services.openai_service import call_openai
+from services.openai_service import call_openai, stream_openai
+from services.cache_service import CacheBackend, LRUCache, make_cache
+from services.nutrition_cache import NutritionMemo, canonical_items, meal_key
+from services import recipe_index as recipe_service
+from services.metrics import SUGGESTIONS, timed
+from services.db_runner import DbRunner
+from services.singleflight import SingleFlight
+from services.timing import StageTimer
+from services.rollup_service import add_to_daily_rollup, get_daily_totals, utc_today
+from services.image_service import STORE_ORIGINAL_UPLOADS, mime_type_for, preprocess_image
+from services import storage_service
+from services.storage_service import check_upload_size, upload_size
+from services.streaming import JsonFieldStream
+from services.prompt_context import compact_json, compact_meals, log_prompt_size, prompt_prefix, recipe_row, user_goals
 import base64
-from datetime import date
+from datetime import date, datetime, time, timedelta, timezone
+
+logger = logging.getLogger(__name__)
 
 # GPT API integration uses call_openai; key is loaded by openai_service
 
-# Utility to filter today's meals
-def _get_todays_meals(all_history: List[MealRead]) -> List[Dict[str, Any]]:
-    today = date.today()
+# Concurrent vision/advice calls per batch upload
+BATCH_DETECT_CONCURRENCY = int(os.getenv("BATCH_DETECT_CONCURRENCY", "4"))
+
+# Detected food items keyed by the SHA-256 of the image bytes
+detection_cache: CacheBackend = LRUCache()
+# Nutrition estimates keyed by canonical item list, plus a learned per-item table
+nutrition_memo = NutritionMemo(LRUCache(), LRUCache())
+
+
+def configure_caches(session_factory: Optional[Callable[[], Session]] = None) -> None:
+    """
+    Rebuild the service caches from environment settings (see cache_service.make_cache).
+    """
+    global detection_cache, nutrition_memo
+    detection_cache = make_cache("food_items", session_factory)
+    nutrition_memo = NutritionMemo(
+        make_cache("nutrition_meal", session_factory),
+        make_cache("nutrition_item", session_factory),
+    )
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Utility to bound "today" (a UTC day, like the stored timestamps) for timestamp range queries
+def _today_bounds() -> Tuple[datetime, datetime]:
+    start = datetime.combine(utc_today(), time.min)
+    return start, start + timedelta(days=1)
+
+
+def _todays_meals_query(db: Session, user_id: int):
+    # Served by the (user_id, timestamp) index, so cost tracks meals today, not history length
+    start, end = _today_bounds()
+    return db.query(Meal).filter(Meal.user_id == user_id, Meal.timestamp >= start, Meal.timestamp < end)
+
+
+def get_todays_meals(db: Session, user_id: int) -> List[Dict[str, Any]]:
+    """
+    Today's meals for a user, most recent first, in the shape used in prompts.
+    Feedback text is not loaded; prompts only summarize items and macros.
+    """
+    rows = (
+        _todays_meals_query(db, user_id)
+        .with_entities(Meal.timestamp, Meal.food_items, Meal.nutrition_info)
+        .order_by(Meal.timestamp.desc())
+        .all()
+    )
     return [
         {
-            "timestamp": m.timestamp.isoformat(),
-            "food_items": m.food_items,
-            "nutrition_info": m.nutrition_info,
-            "feedback": m.feedback if not hasattr(m.feedback, "dict") else m.feedback.dict(),
+            "timestamp": timestamp.isoformat(),
+            "food_items": food_items,
+            "nutrition_info": nutrition_info,
         }
-        for m in all_history
-        if m.timestamp.date() == today
+        for timestamp, food_items, nutrition_info in rows
     ]
 
-# Utility to build user profile summary
-def _build_profile_str(user) -> str:
-    profile = user.model_dump()
-    return (
-        f"Age: {profile['age']} yrs, "
-        f"Weight: {profile['weight']} kg, "
-        f"Health cond.: {profile.get('health_conditions','none')}, "
-        f"Diet prefs: {profile.get('diet_preferences','none')}, "
-        f"Goals: {profile.get('goals','none')}."
-    )
 
-def detect_food_items(image_path: str) -> List[str]:
+def get_todays_totals(db: Session, user_id: int) -> Dict[str, int]:
+    """
+    Today's calories/protein/carbs/fat, read from the daily rollup row.
+    """
+    return get_daily_totals(db, user_id, utc_today())
+
+@timed
+async def detect_food_items(
+    image_path: str,
+    image_hash: Optional[str] = None,
+    image_bytes: Optional[bytes] = None,
+) -> List[str]:
     """
     Uses OpenAI GPT-4o with Structured Outputs to detect food items as a JSON array.
+    Results are cached by image content hash, so re-uploads skip the vision call.
+    Pass `image_bytes` when the image is already in memory; otherwise it is
+    read from image storage.
     """
-    with open(image_path, "rb") as img_file:
-        image_bytes = img_file.read()
+    if image_hash is None:
+        if image_bytes is None:
+            image_bytes = await storage_service.image_storage.read(image_path)
+        image_hash = await run_in_threadpool(_content_hash, image_bytes)
+    cached = await detection_cache.aget(image_hash)
+    if cached is not None:
+        return cached
+    if image_bytes is None:
+        image_bytes = await storage_service.image_storage.read(image_path)
     image_b64 = base64.b64encode(image_bytes).decode()
     schema = {
         "type": "object",
@@ -60,122 +133,268 @@ def detect_food_items(image_path: str) -> List[str]:
         "role": "user",
         "content": [
             {"type": "input_text", "text": "List all food items you see in this photo."},
-            {"type": "input_image", "image_url": f"data:image/jpeg;base64,{image_b64}"}
+            {"type": "input_image", "image_url": f"data:{mime_type_for(image_path)};base64,{image_b64}"}
         ]
     }]
-    content = call_openai(messages, schema, "food_items", max_output_tokens=200)
+    content = await call_openai(messages, schema, "food_items", max_output_tokens=200)
     try:
         obj = json.loads(content)
-        return obj["food_items"]
+        items = obj["food_items"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to parse food items: {e}")
+    await detection_cache.aset(image_hash, items)
+    return items
 
 
-def estimate_nutrition(food_items: List[str]) -> Dict[str, Any]:
+# Macro totals plus a per-item breakdown; the breakdown feeds the per-item table
+_MACRO_PROPERTIES = {
+    "calories": {"type": "integer"},
+    "protein": {"type": "integer"},
+    "carbs": {"type": "integer"},
+    "fat": {"type": "integer"},
+}
+NUTRITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **_MACRO_PROPERTIES,
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, **_MACRO_PROPERTIES},
+                "required": ["name", "calories", "protein", "carbs", "fat"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["calories", "protein", "carbs", "fat", "items"],
+    "additionalProperties": False,
+}
+
+
+@timed
+async def estimate_nutrition(food_items: List[str]) -> Dict[str, Any]:
     """
     Uses OpenAI GPT-4o with Structured Outputs (JSON Schema) to estimate nutrition.
+    Memoized on the canonical item list; meals made only of previously seen
+    items are summed from the per-item table without calling the model.
+    """
+    cached = await nutrition_memo.lookup(food_items)
+    if cached is not None:
+        return cached
+    messages = [
+        {"role": "system", "content": "You are a knowledgeable nutrition assistant."},
+        {"role": "user", "content": (
+            f"Estimate total nutrition for these items as accurately as possible: {food_items}. "
+            "Also list each item's own nutrition under items, using the item names as given."
+        )}
+    ]
+    content = await call_openai(messages, NUTRITION_SCHEMA, "nutrition_info", temperature=0.2)
+    try:
+        nutrition = NutritionInfo.model_validate_json(content).model_dump()
+        breakdown = json.loads(content).get("items", [])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Nutrition JSON validation failed: {e}")
+    await nutrition_memo.record(food_items, nutrition, breakdown)
+    return nutrition
+
+
+@timed
+async def estimate_nutrition_batch(meals_items: List[List[str]]) -> List[Dict[str, Any]]:
     """
-    # Prepare JSON schema
+    Estimate nutrition for several meals with at most one model call; meals
+    already answered by the memo are not sent.
+    """
+    results: List[Optional[Dict[str, Any]]] = [await nutrition_memo.lookup(items) for items in meals_items]
+    # Meals with the same canonical item list are only sent once
+    pending_by_key: Dict[str, List[int]] = {}
+    for i, r in enumerate(results):
+        if r is None:
+            pending_by_key.setdefault(meal_key(meals_items[i]), []).append(i)
+    if not pending_by_key:
+        return results
+    pending = [indexes[0] for indexes in pending_by_key.values()]
     schema = {
         "type": "object",
-        "properties": {
-            "calories": {"type": "integer"},
-            "protein": {"type": "integer"},
-            "carbs": {"type": "integer"},
-            "fat": {"type": "integer"},
-        },
-        "required": ["calories", "protein", "carbs", "fat"],
+        "properties": {"meals": {"type": "array", "items": NUTRITION_SCHEMA}},
+        "required": ["meals"],
         "additionalProperties": False,
     }
+    listing = "\n".join(f"{n + 1}. {meals_items[i]}" for n, i in enumerate(pending))
     messages = [
         {"role": "system", "content": "You are a knowledgeable nutrition assistant."},
-        {"role": "user", "content": f"Estimate total nutrition for these items as accurately as possible: {food_items}."}
+        {"role": "user", "content": (
+            "Estimate total nutrition for each of these meals as accurately as possible, "
+            "returning one entry per meal in the same order:\n"
+            f"{listing}\n"
+            "For each meal also list each item's own nutrition under items, using the item names as given."
+        )}
     ]
-    content = call_openai(messages, schema, "nutrition_info", temperature=0.2)
+    content = await call_openai(messages, schema, "nutrition_info_batch", temperature=0.2)
     try:
-        nutrition = NutritionInfo.model_validate_json(content)
-        return nutrition.model_dump()
+        estimates = json.loads(content)["meals"]
+        if len(estimates) != len(pending):
+            raise ValueError(f"expected {len(pending)} meals, got {len(estimates)}")
+        parsed = [NutritionInfo.model_validate(e).model_dump() for e in estimates]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Nutrition JSON validation failed: {e}")
+    for indexes, nutrition, estimate in zip(pending_by_key.values(), parsed, estimates):
+        for i in indexes:
+            results[i] = dict(nutrition)
+        await nutrition_memo.record(meals_items[indexes[0]], nutrition, estimate.get("items", []))
+    return results
 
 
-async def analyze_meal(db: Session, user_id: int, file: UploadFile) -> Dict[str, Any]:
-    # Validate user exists
-    user = get_user(db, user_id)
-
-    # Save uploaded image
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    ext = os.path.splitext(file.filename)[1]
-    filename = f"{uuid.uuid4().hex}{ext}"
-    file_path = os.path.join(upload_dir, filename)
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
-
-    # Detect food items and estimate nutrition
-    items = detect_food_items(file_path)
-    food_items = {"items": items}
-    nutrition_info = estimate_nutrition(items)
+ADVICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "advice": {"type": "string"},
+        "reason": {"type": "string"},
+        "next_meal": {"type": "string"},
+    },
+    "required": ["advice", "reason", "next_meal"],
+    "additionalProperties": False,
+}
 
-    # Prepare today's meals for next meal advice
-    todays_meals = _get_todays_meals(get_meal_history(db, user_id))
 
-    # Build profile summary
-    profile_str = _build_profile_str(user)
+@timed
+async def generate_advice(
+    user: UserRead,
+    todays_meals: List[Dict[str, Any]],
+    macro_totals: Dict[str, int],
+    food_items: Dict[str, Any],
+    nutrition_info: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Uses OpenAI GPT-4o to acknowledge the current meal and recommend the next
+    one, given the day's intake so far (excluding the current meal).
+    """
+    messages = _advice_messages(user, todays_meals, macro_totals, food_items, nutrition_info)
+    content = await call_openai(messages, ADVICE_SCHEMA, "advice_response", temperature=0.7)
+    return _parse_advice(content)
 
-    # Summarize macro totals
-    macro_totals = {
-        "calories": sum(m["nutrition_info"]["calories"] for m in todays_meals),
-        "protein": sum(m["nutrition_info"]["protein"] for m in todays_meals),
-        "carbs":    sum(m["nutrition_info"]["carbs"] for m in todays_meals),
-        "fat":      sum(m["nutrition_info"]["fat"] for m in todays_meals)
-    }
 
+def _advice_messages(
+    user: UserRead,
+    todays_meals: List[Dict[str, Any]],
+    macro_totals: Dict[str, int],
+    food_items: Dict[str, Any],
+    nutrition_info: Dict[str, Any],
+) -> List[Dict[str, Any]]:
     # Compute remaining macros based on user-specific goals
-    user_goals = {
-        "calories": user.daily_calories,
-        "protein": user.daily_protein,
-        "carbs": user.daily_carbs,
-        "fat": user.daily_fat,
-    }
-    macro_remaining = {k: user_goals[k] - macro_totals[k] for k in macro_totals}
+    goals = user_goals(user)
+    macro_remaining = {k: goals[k] - macro_totals[k] for k in macro_totals}
 
-    # Prepare prompt for AI
+    # Static prefix (instructions, profile, goals) first; only this part varies per request
     prompt = (
-        "You are NutriCoach, your friendly personal nutrition coach. "
-        f"{profile_str} "
-        f"Daily goals: {json.dumps(user_goals)}. "
-        f"Intake so far: {json.dumps(macro_totals)}. "
-        f"Remaining macros: {json.dumps(macro_remaining)}. "
-        f"Meals today so far: {json.dumps(todays_meals)}. "
-        f"Your current meal: {json.dumps(food_items)} with nutrition {json.dumps(nutrition_info)}. "
-        "First, acknowledge this meal—highlight positives, remind about mindful eating, and how it fits into the day's macro balance. "
-        "Next, recommend the next meal: specify foods, approximate portions, and explain how it optimally balances the remaining macros and supports personal goals. "
-        "Respond strictly in JSON with keys: advice, reason, next_meal."
+        f"Intake so far: {compact_json(macro_totals)}. "
+        f"Remaining macros: {compact_json(macro_remaining)}.\n"
+        f"Meals today so far:\n{compact_meals(todays_meals)}\n"
+        f"Your current meal: {compact_json(food_items)} with nutrition {compact_json(nutrition_info)}."
     )
+    messages = prompt_prefix("advice", user) + [{"role": "user", "content": prompt}]
+    log_prompt_size("advice_response", messages)
+    return messages
 
-    # Generate advice using Structured Outputs (JSON Schema)
-    advice_schema = {
-        "type": "object",
-        "properties": {
-            "advice": {"type": "string"},
-            "reason": {"type": "string"},
-            "next_meal": {"type": "string"},
-        },
-        "required": ["advice", "reason", "next_meal"],
-        "additionalProperties": False,
-    }
-    messages = [
-        {"role": "system", "content": "You are a friendly personal health coach. Speak with empathy and encouragement."},
-        {"role": "user", "content": prompt}
-    ]
-    content = call_openai(messages, advice_schema, "advice_response", temperature=0.7)
+
+def _parse_advice(content: str) -> Dict[str, Any]:
     try:
-        feedback = AdviceResponse.model_validate_json(content).model_dump()
+        return AdviceResponse.model_validate_json(content).model_dump()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Advice JSON validation failed: {e}")
 
+
+class StoredImage(NamedTuple):
+    location: str
+    image_hash: str
+    # The processed image, handed to detection so it is not read back from storage
+    data: Optional[bytes] = None
+
+
+@timed
+async def store_upload(file: UploadFile) -> StoredImage:
+    """
+    Downscale and re-encode an uploaded image, then save it under its content
+    hash so duplicate uploads share one object. Uploads over MAX_UPLOAD_BYTES
+    are rejected with 413.
+    """
+    check_upload_size(file)
+    # Decoding reads the spooled upload directly; only the compact re-encode is held in memory
+    contents, ext = await run_in_threadpool(preprocess_image, file.file)
+    image_hash = await run_in_threadpool(_content_hash, contents)
+    location = await storage_service.image_storage.save(f"{image_hash}{ext}", contents)
+    if STORE_ORIGINAL_UPLOADS:
+        original_ext = os.path.splitext(file.filename or "")[1].lower()
+        await storage_service.image_storage.save_stream(
+            f"{image_hash}.original{original_ext}", file.file, upload_size(file)
+        )
+    return StoredImage(location, image_hash, contents)
+
+
+async def _gather_stages(*stages):
+    """
+    Run independent pipeline stages concurrently. If one fails, the others
+    are cancelled so e.g. an unknown user does not keep a vision call running.
+    """
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def analyze_meal(run_db: DbRunner, user_id: int, file: UploadFile, timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+    timer = timer or StageTimer("analyze_meal")
+
+    async def upload_stage():
+        with timer.stage("upload"):
+            return await store_upload(file)
+
+    return await _analyze_image(run_db, user_id, upload_stage(), timer)
+
+
+async def analyze_stored_meal(
+    run_db: DbRunner,
+    user_id: int,
+    file_path: str,
+    image_hash: str,
+    timer: Optional[StageTimer] = None,
+) -> Dict[str, Any]:
+    """
+    analyze_meal for an image already saved by store_upload (queued jobs).
+    """
+    async def stored():
+        return StoredImage(file_path, image_hash)
+
+    return await _analyze_image(run_db, user_id, stored(), timer or StageTimer("analyze_job"))
+
+
+async def _analyze_image(run_db: DbRunner, user_id: int, upload, timer: StageTimer) -> Dict[str, Any]:
+    # Validate user and load today's meals in a short session of their own
+    async def load_context():
+        with timer.stage("context"):
+            return await run_db(_load_user_context, user_id)
+
+    # Save uploaded image, detect food items and estimate nutrition
+    async def analyze_image():
+        image = await upload
+        with timer.stage("detect"):
+            items = await detect_food_items(image.location, image.image_hash, image.data)
+        with timer.stage("nutrition"):
+            nutrition_info = await estimate_nutrition(items)
+        return image.location, items, nutrition_info
+
+    # The context stage overlaps the image stages, so latency follows the LLM critical path
+    (user, todays_meals, macro_totals), (file_path, items, nutrition_info) = await _gather_stages(
+        load_context(), analyze_image()
+    )
+    food_items = {"items": items}
+
+    with timer.stage("advice"):
+        feedback = await generate_advice(user, todays_meals, macro_totals, food_items, nutrition_info)
+
     # Persist meal record
     meal = Meal(
         user_id=user_id,
@@ -184,9 +403,128 @@ async def analyze_meal(db: Session, user_id: int, file: UploadFile) -> Dict[str,
         nutrition_info=nutrition_info,
         feedback=feedback,
     )
-    db.add(meal)
-    db.commit()
-    db.refresh(meal)
+    with timer.stage("save"):
+        return await run_db(_save_meal_as_dict, meal)
+
+
+async def analyze_meal_stream(
+    run_db: DbRunner,
+    user_id: int,
+    file: UploadFile,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of analyze_meal. The upload and user lookup run before
+    this returns, so bad images and unknown users still fail with a status
+    code; the returned iterator then yields ("items", ...), ("nutrition", ...),
+    ("delta", {"field", "text"}) pieces of the advice as the model writes
+    them, and finally ("meal", ...) once the row is saved.
+    """
+    (user, todays_meals, macro_totals), image = await _gather_stages(
+        run_db(_load_user_context, user_id), store_upload(file)
+    )
+    return _meal_events(run_db, user, todays_meals, macro_totals, image)
+
+
+async def _meal_events(
+    run_db: DbRunner,
+    user: UserRead,
+    todays_meals: List[Dict[str, Any]],
+    macro_totals: Dict[str, int],
+    image: StoredImage,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    items = await detect_food_items(image.location, image.image_hash, image.data)
+    food_items = {"items": items}
+    yield "items", {"food_items": food_items}
+
+    nutrition_info = await estimate_nutrition(items)
+    yield "nutrition", {"nutrition_info": nutrition_info}
+
+    messages = _advice_messages(user, todays_meals, macro_totals, food_items, nutrition_info)
+    fields = JsonFieldStream()
+    async for chunk in stream_openai(messages, ADVICE_SCHEMA, "advice_response", temperature=0.7):
+        for field, text in fields.feed(chunk):
+            yield "delta", {"field": field, "text": text}
+    feedback = _parse_advice(fields.text())
+
+    # Persist only once the advice is complete
+    meal = Meal(
+        user_id=user.id,
+        image_path=image.location,
+        food_items=food_items,
+        nutrition_info=nutrition_info,
+        feedback=feedback,
+    )
+    yield "meal", await run_db(_save_meal_as_dict, meal)
+
+
+async def analyze_meals(
+    run_db: DbRunner,
+    user_id: int,
+    files: List[UploadFile],
+    timer: Optional[StageTimer] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Analyze several meal photos in one request: detection fans out with
+    bounded concurrency, nutrition is estimated in one call, advice for meal k
+    sees meals 1..k-1 via running totals, and all rows are inserted together.
+    """
+    timer = timer or StageTimer("analyze_meals")
+    semaphore = asyncio.Semaphore(BATCH_DETECT_CONCURRENCY)
+
+    async def load_context():
+        with timer.stage("context"):
+            return await run_db(_load_user_context, user_id)
+
+    async def analyze_image(file: UploadFile):
+        async with semaphore:
+            image = await store_upload(file)
+            return image.location, await detect_food_items(image.location, image.image_hash, image.data)
+
+    async def analyze_images():
+        with timer.stage("detect"):
+            return await _gather_stages(*(analyze_image(f) for f in files))
+
+    (user, todays_meals, macro_totals), detected = await _gather_stages(load_context(), analyze_images())
+    with timer.stage("nutrition"):
+        nutrition = await estimate_nutrition_batch([items for _, items in detected])
+
+    # Running context for each meal is known up front, so advice calls can run concurrently
+    advice_inputs = []
+    eaten_at = datetime.utcnow()
+    running_meals, running_totals = list(todays_meals), dict(macro_totals)
+    for (file_path, items), nutrition_info in zip(detected, nutrition):
+        food_items = {"items": items}
+        advice_inputs.append((list(running_meals), dict(running_totals), food_items, nutrition_info))
+        running_meals.insert(0, {
+            "timestamp": eaten_at.isoformat(),
+            "food_items": food_items,
+            "nutrition_info": nutrition_info,
+        })
+        running_totals = {k: running_totals[k] + int(nutrition_info[k]) for k in running_totals}
+
+    async def advise(meals_so_far, totals_so_far, food_items, nutrition_info):
+        async with semaphore:
+            return await generate_advice(user, meals_so_far, totals_so_far, food_items, nutrition_info)
+
+    with timer.stage("advice"):
+        feedback = await asyncio.gather(*(advise(*args) for args in advice_inputs))
+
+    meals = [
+        Meal(
+            user_id=user_id,
+            timestamp=eaten_at,
+            image_path=file_path,
+            food_items={"items": items},
+            nutrition_info=nutrition_info,
+            feedback=advice,
+        )
+        for (file_path, items), nutrition_info, advice in zip(detected, nutrition, feedback)
+    ]
+    with timer.stage("save"):
+        return await run_db(_save_meals, meals)
+
+
+def _meal_to_dict(meal: Meal) -> Dict[str, Any]:
     return {
         "id": meal.id,
         "user_id": meal.user_id,
@@ -198,48 +536,251 @@ async def analyze_meal(db: Session, user_id: int, file: UploadFile) -> Dict[str,
     }
 
 
-def get_meal_history(db: Session, user_id: int) -> List[MealRead]:
-    meals = db.query(Meal).filter(Meal.user_id == user_id).order_by(Meal.timestamp.desc()).all()
-    return [MealRead.from_orm(m) for m in meals]
+def _load_user_context(db: Session, user_id: int) -> Tuple[UserRead, List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Load the user, today's meals and today's macro totals in one read transaction.
+    """
+    user = get_user(db, user_id)
+    return user, get_todays_meals(db, user_id), get_todays_totals(db, user_id)
+
+
+def _save_meal_as_dict(db: Session, meal: Meal) -> Dict[str, Any]:
+    _save_meal(db, meal)
+    return _meal_to_dict(meal)
+
+
+def _save_meal(db: Session, meal: Meal) -> None:
+    db.add(meal)
+    db.flush()  # assigns the default timestamp
+    # Same transaction as the insert, so the rollup never drifts from meals
+    add_to_daily_rollup(db, meal.user_id, meal.timestamp.date(), meal.nutrition_info)
+    db.commit()
+    db.refresh(meal)
+
+
+MEAL_FIELDS = ("id", "user_id", "timestamp", "image_path", "food_items", "nutrition_info", "feedback")
+
+
+def _encode_cursor(timestamp: datetime, meal_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), meal_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, meal_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(meal_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    # Meal timestamps are stored as naive UTC
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _save_meals(db: Session, meals: List[Meal]) -> List[Dict[str, Any]]:
+    """
+    Insert a batch of meals and their rollup updates in one transaction.
+    """
+    db.add_all(meals)
+    db.flush()  # one multi-row INSERT; assigns ids and timestamps
+    per_day: Dict[Tuple[int, date], Dict[str, int]] = {}
+    for meal in meals:
+        day = per_day.setdefault((meal.user_id, meal.timestamp.date()), {"count": 0})
+        day["count"] += 1
+        for k, v in meal.nutrition_info.items():
+            day[k] = day.get(k, 0) + int(v)
+    for (meal_user_id, day), totals in per_day.items():
+        add_to_daily_rollup(db, meal_user_id, day, totals, meals=totals.pop("count"))
+    results = [_meal_to_dict(meal) for meal in meals]
+    db.commit()
+    return results
+
+
+@timed
+def get_meal_history(
+    db: Session,
+    user_id: int,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a user's meals, newest first, using keyset pagination on
+    (timestamp, id). Returns the rows (restricted to `fields` if given) and an
+    opaque cursor for the next page, or None on the last page.
+    """
+    fields = list(fields or MEAL_FIELDS)
+    unknown = set(fields) - set(MEAL_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # Only the requested columns are loaded; id/timestamp are always needed for the cursor
+    columns = [getattr(Meal, f) for f in MEAL_FIELDS if f in fields or f in ("id", "timestamp")]
+
+    query = db.query(*columns).filter(Meal.user_id == user_id)
+    if since is not None:
+        query = query.filter(Meal.timestamp >= _as_naive_utc(since))
+    if until is not None:
+        query = query.filter(Meal.timestamp < _as_naive_utc(until))
+    if cursor:
+        query = query.filter(tuple_(Meal.timestamp, Meal.id) < tuple_(*_decode_cursor(cursor)))
+    rows = query.order_by(Meal.timestamp.desc(), Meal.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].timestamp, rows[-1].id)
+    # Plain dicts in MealPartial shape, ready for FastJSONResponse
+    loaded = [c.key for c in columns]
+    positions = [loaded.index(f) for f in fields]
+    return [{f: row[i] for f, i in zip(fields, positions)} for row in rows], next_cursor
+
+
+SUGGESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommendation": {"type": "string"},
+        "missing_ingredients": {"type": "array", "items": {"type": "string"}},
+        "reason": {"type": "string"},
+        # Not returned to the client; recorded so the recipe index can learn the meal
+        "ingredients": {"type": "array", "items": {"type": "string"}},
+        "calories": {"type": "integer"},
+        "protein": {"type": "integer"},
+        "carbs": {"type": "integer"},
+        "fat": {"type": "integer"},
+    },
+    "required": ["recommendation", "missing_ingredients", "reason", "ingredients", "calories", "protein", "carbs", "fat"],
+    "additionalProperties": False,
+}
+
+
+# Identical concurrent suggestions (same user, same fridge) share one model call
+suggestion_flights = SingleFlight("suggest_meal")
 
 
 # Suggest meal using fridge items and meal history
-def suggest_meal(db: Session, user_id: int, fridge_items: List[str]) -> Dict[str, Any]:
-    # Validate user exists
-    user = get_user(db, user_id)
-    # Prepare today's meal history
-    all_history = get_meal_history(db, user_id)
-    todays_meals = _get_todays_meals(all_history)
-    # Build user profile summary
-    profile_str = _build_profile_str(user)
-    # Construct prompt
-    prompt = (
-        "You are NutriCoach, your friendly personal nutrition coach. "
-        f"{profile_str} "
-        f"Meals today so far: {json.dumps(todays_meals)}. "
-        f"Available ingredients in fridge: {json.dumps(fridge_items)}. "
-        "Suggest a meal that uses as many available items as possible, "
-        "and list any missing ingredients you recommend ordering. "
-        "Respond strictly in JSON with keys: recommendation, missing_ingredients, reason."
-    )
-    # Define output schema
-    suggestion_schema = {
-        "type": "object",
-        "properties": {
-            "recommendation": {"type": "string"},
-            "missing_ingredients": {"type": "array", "items": {"type": "string"}},
-            "reason": {"type": "string"},
-        },
-        "required": ["recommendation", "missing_ingredients", "reason"],
-        "additionalProperties": False,
-    }
-    messages = [
-        {"role": "system", "content": "You are a friendly personal health coach. Speak with empathy and encouragement."},
-        {"role": "user", "content": prompt}
-    ]
-    content = call_openai(messages, suggestion_schema, "meal_suggestion", temperature=0.7)
+@timed
+async def suggest_meal(run_db: DbRunner, user_id: int, fridge_items: List[str]) -> Dict[str, Any]:
+    key = f"{user_id}:{compact_json(canonical_items(fridge_items))}"
+    suggestion = await suggestion_flights.do(key, lambda: _suggest_meal(run_db, user_id, fridge_items))
+    return dict(suggestion)
+
+
+async def _suggest_meal(run_db: DbRunner, user_id: int, fridge_items: List[str]) -> Dict[str, Any]:
+    direct, messages = await _plan_suggestion(run_db, user_id, fridge_items)
+    if direct is not None:
+        return direct
+    content = await call_openai(messages, SUGGESTION_SCHEMA, "meal_suggestion", temperature=0.7)
+    suggestion = _parse_suggestion(content)
+    await _learn_suggestion(run_db, content, fridge_items)
+    return suggestion
+
+
+async def suggest_meal_stream(
+    run_db: DbRunner, user_id: int, fridge_items: List[str]
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of suggest_meal. The user lookup runs before this
+    returns; the iterator yields ("delta", {"field", "text"}) pieces as the
+    model writes them, then ("suggestion", ...) with the validated result.
+    A suggestion answered from the recipe index has no deltas.
+    """
+    direct, messages = await _plan_suggestion(run_db, user_id, fridge_items)
+
+    async def events():
+        if direct is not None:
+            yield "suggestion", direct
+            return
+        fields = JsonFieldStream()
+        async for chunk in stream_openai(messages, SUGGESTION_SCHEMA, "meal_suggestion", temperature=0.7):
+            for field, text in fields.feed(chunk):
+                yield "delta", {"field": field, "text": text}
+        suggestion = _parse_suggestion(fields.text())
+        await _learn_suggestion(run_db, fields.text(), fridge_items)
+        yield "suggestion", suggestion
+
+    return events()
+
+
+async def _plan_suggestion(
+    run_db: DbRunner, user_id: int, fridge_items: List[str]
+) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Rank recipes from the local index against the fridge and today's
+    remaining macros. Returns (suggestion, []) when the best one is good
+    enough to answer without the model, otherwise (None, messages) with the
+    closest candidates in the prompt.
+    """
+    # Validate user exists and prepare today's meal history; the session is
+    # closed again before the LLM call
+    user, todays_meals = await run_db(_load_suggestion_context, user_id)
+
+    candidates: List[Dict[str, Any]] = []
+    index = recipe_service.recipe_index
+    if index is not None:
+        goals = user_goals(user)
+        eaten = {m: sum((meal["nutrition_info"] or {}).get(m) or 0 for meal in todays_meals) for m in goals}
+        remaining = {m: goals[m] - eaten[m] for m in goals}
+        candidates = index.search(fridge_items, remaining, goals)
+        # The index knows nothing about diets or health conditions, so users
+        # with either always get the model, which sees their profile
+        restricted = bool(user.diet_preferences or user.health_conditions)
+        if candidates and candidates[0]["score"] >= recipe_service.RECIPE_DIRECT_SCORE and not restricted:
+            SUGGESTIONS.inc("index")
+            return _index_suggestion(candidates[0]), []
+        candidates = [c for c in candidates if c["score"] >= recipe_service.RECIPE_MIN_SCORE]
+    SUGGESTIONS.inc("model")
+
+    # Construct prompt; instructions and profile live in the cached prefix
+    if candidates:
+        rows = "\n".join(recipe_row(c) for c in candidates)
+        prompt = (
+            f"Macros left for today: {compact_json(remaining)}.\n"
+            f"Available ingredients in fridge: {compact_json(fridge_items)}.\n"
+            f"Candidate recipes (name | ingredients | macros | missing):\n{rows}"
+        )
+    else:
+        prompt = (
+            f"Meals today so far:\n{compact_meals(todays_meals)}\n"
+            f"Available ingredients in fridge: {compact_json(fridge_items)}."
+        )
+    messages = prompt_prefix("suggestion", user) + [{"role": "user", "content": prompt}]
+    log_prompt_size("meal_suggestion", messages)
+    return None, messages
+
+
+def _load_suggestion_context(db: Session, user_id: int) -> Tuple[UserRead, List[Dict[str, Any]]]:
+    return get_user(db, user_id), get_todays_meals(db, user_id)
+
+
+def _index_suggestion(candidate: Dict[str, Any]) -> Dict[str, Any]:
+    macros = candidate["macros"]
+    reason = f"Uses {len(candidate['ingredients']) - len(candidate['missing'])} of its {len(candidate['ingredients'])} ingredients from your fridge"
+    if macros["calories"] is not None:
+        reason += f" and, at about {macros['calories']} kcal with {macros['protein']}g protein, fits what is left of today's goals"
+    return MealSuggestion(
+        recommendation=candidate["name"],
+        missing_ingredients=candidate["missing"],
+        reason=reason + ".",
+    ).model_dump()
+
+
+async def _learn_suggestion(run_db: DbRunner, content: str, fridge_items: List[str]) -> None:
+    # Record the model's recipe for the next index build; never fails the request
+    try:
+        await run_db(recipe_service.record_suggestion, json.loads(content), fridge_items)
+    except Exception:
+        logger.warning("could not record meal suggestion", exc_info=True)
+
+
+def _parse_suggestion(content: str) -> Dict[str, Any]:
     try:
-        suggestion = MealSuggestion.model_validate_json(content).model_dump()
-        return suggestion
+        return MealSuggestion.model_validate_json(content).model_dump()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Meal suggestion JSON validation failed: {e}")
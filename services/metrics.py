@@ -0,0 +1,286 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cache hit (sub-millisecond) to a slow model call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def set_total(self, value: float, *labelvalues: str) -> None:
+        """
+        Copy a total that is counted elsewhere (e.g. cache stats) at scrape time.
+        """
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self.set_total(value, *labelvalues)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(labelvalues)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._series.items()]
+        lines = self._header()
+        names = self.labelnames + ("le",)
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(names, labelvalues + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Process-local metrics rendered in the Prometheus text format. Recording
+    is a dict update under a lock, so it is cheap enough for the hot path.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status.", ("method", "route", "status"),
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pipeline_stage_duration_seconds", "Latency of request pipeline stages (upload, detect, nutrition, advice, save).",
+    ("operation", "stage"),
+))
+FUNCTION_SECONDS = REGISTRY.register(Histogram(
+    "service_function_duration_seconds", "Latency of service functions.", ("function",),
+))
+OPENAI_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "openai_request_duration_seconds", "OpenAI Responses API latency per schema name, including retries.",
+    ("name", "outcome"),
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "openai_tokens_total", "Tokens reported by the Responses API per schema name (input, cached_input, output).",
+    ("name", "type"),
+))
+SUGGESTIONS = REGISTRY.register(Counter(
+    "meal_suggestions_total", "Meal suggestions by source (index: answered locally, model: LLM call).", ("source",),
+))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by the per-user rate limiter.", ("endpoint",),
+))
+COALESCED = REGISTRY.register(Counter(
+    "coalesced_calls_total", "Calls that joined an identical call already in flight instead of running their own.", ("name",),
+))
+CACHE_HITS = REGISTRY.register(Counter("cache_hits_total", "Cache hits.", ("cache",)))
+CACHE_MISSES = REGISTRY.register(Counter("cache_misses_total", "Cache misses.", ("cache",)))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge("cache_hit_ratio", "Hits over lookups since start.", ("cache",)))
+CACHE_ENTRIES = REGISTRY.register(Gauge("cache_entries", "Entries held in process.", ("cache",)))
+JOBS = REGISTRY.register(Gauge("analysis_jobs", "Analysis jobs by status.", ("status",)))
+JOB_OLDEST_QUEUED_SECONDS = REGISTRY.register(Gauge(
+    "analysis_jobs_oldest_queued_age_seconds", "Age of the oldest queued analysis job.",
+))
+DB_POOL = REGISTRY.register(Gauge("db_pool_connections", "Connection pool gauges.", ("engine", "state")))
+DB_POOL_CHECKOUTS = REGISTRY.register(Counter("db_pool_checkouts_total", "Connection checkouts.", ("engine",)))
+DB_POOL_TIMEOUTS = REGISTRY.register(Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that timed out waiting for a connection.", ("engine",),
+))
+DB_POOL_WAIT_SECONDS = REGISTRY.register(Counter(
+    "db_pool_checkout_wait_seconds_total", "Time spent waiting for a pooled connection.", ("engine",),
+))
+
+
+def timed(function: Callable) -> Callable:
+    """
+    Decorator recording a sync or async function's latency in
+    service_function_duration_seconds.
+    """
+    name = function.__name__
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            with FUNCTION_SECONDS.time(name):
+                return await function(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with FUNCTION_SECONDS.time(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def record_openai_usage(name: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> None:
+    OPENAI_TOKENS.inc(name, "input", amount=input_tokens)
+    OPENAI_TOKENS.inc(name, "cached_input", amount=cached_tokens)
+    OPENAI_TOKENS.inc(name, "output", amount=output_tokens)
+
+
+def record_cache_stats(cache: str, hits: int, misses: int, entries: Optional[int] = None) -> None:
+    CACHE_HITS.set_total(hits, cache)
+    CACHE_MISSES.set_total(misses, cache)
+    CACHE_HIT_RATIO.set(hits / (hits + misses) if hits + misses else 0.0, cache)
+    if entries is not None:
+        CACHE_ENTRIES.set(entries, cache)
+
+
+def record_queue_stats(stats: Dict[str, Any]) -> None:
+    for status, count in stats.items():
+        if status != "oldest_queued_age_seconds":
+            JOBS.set(count, status)
+    JOB_OLDEST_QUEUED_SECONDS.set(stats.get("oldest_queued_age_seconds", 0.0))
+
+
+def record_pool_stats(stats: Dict[str, Dict[str, Any]]) -> None:
+    for engine, pool in stats.items():
+        for state in ("size", "checked_in", "checked_out", "overflow"):
+            DB_POOL.set(pool[state], engine, state)
+        DB_POOL_CHECKOUTS.set_total(pool["checkouts"], engine)
+        DB_POOL_TIMEOUTS.set_total(pool["checkout_timeouts"], engine)
+        DB_POOL_WAIT_SECONDS.set_total(pool["checkout_wait_seconds_total"], engine)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording http_request_duration_seconds, labelled by the
+    matched route template (not the raw path) to keep cardinality bounded.
+    For streamed responses this measures the time to the response start.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        started = False
+
+        def observe(status: int) -> None:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], getattr(route, "path", "unmatched"), str(status),
+            )
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            # Unhandled errors become a 500 further out
+            if not started:
+                observe(500)
+            raise
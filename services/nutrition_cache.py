@@ -0,0 +1,173 @@
+import os
+import re
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from services.cache_service import CacheBackend, LRUCache, TieredCache
+
+MACROS = ("calories", "protein", "carbs", "fat")
+
+# Words ending in "s" that are already singular
+_SINGULAR_WORDS = {"asparagus", "citrus", "couscous", "hummus", "molasses", "octopus", "swiss", "bass"}
+# Plurals the suffix rules below would get wrong
+_IRREGULAR_PLURALS = {
+    "brownies": "brownie",
+    "cookies": "cookie",
+    "pies": "pie",
+    "smoothies": "smoothie",
+    "veggies": "veggie",
+    "leaves": "leaf",
+    "loaves": "loaf",
+}
+
+
+def _singularize(word: str) -> str:
+    if word in _SINGULAR_WORDS or len(word) <= 3:
+        return word
+    if word in _IRREGULAR_PLURALS:
+        return _IRREGULAR_PLURALS[word]
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def canonicalize_item(name: str) -> str:
+    """
+    Normalize a food item name: lowercase, collapse whitespace and
+    punctuation, and singularize the head (last) word.
+    """
+    words = re.sub(r"[^a-z0-9\s-]", " ", name.lower()).split()
+    if not words:
+        return ""
+    words[-1] = _singularize(words[-1])
+    return " ".join(words)
+
+
+def canonical_items(food_items: Iterable[str]) -> List[str]:
+    """
+    Canonical, sorted and deduplicated item list used as the memo key.
+    """
+    return sorted({c for c in (canonicalize_item(i) for i in food_items) if c})
+
+
+def item_counts(food_items: Iterable[str]) -> Dict[str, int]:
+    """
+    How many times each canonical item appears in the list, sorted by name.
+    """
+    counts = Counter(c for c in (canonicalize_item(i) for i in food_items) if c)
+    return dict(sorted(counts.items()))
+
+
+def meal_key(food_items: Iterable[str]) -> str:
+    """
+    Memo key for a meal: canonical items with a count suffix for repeats,
+    so "banana, banana" and "banana" are cached separately.
+    """
+    return "|".join(
+        name if count == 1 else f"{name} x{count}"
+        for name, count in item_counts(food_items).items()
+    )
+
+
+def _front(cache: CacheBackend) -> Optional[LRUCache]:
+    if isinstance(cache, TieredCache):
+        return cache.front
+    return cache if isinstance(cache, LRUCache) else None
+
+
+class NutritionMemo:
+    """
+    Memoizes nutrition estimates by canonical item list, and keeps a per-item
+    nutrition table learned from past model responses so meals made only of
+    known items can be summed locally without calling the model.
+    """
+
+    def __init__(self, meals: CacheBackend, items: CacheBackend):
+        self.meals = meals
+        self.items = items
+        self.meal_hits = 0
+        self.item_hits = 0
+        self.misses = 0
+
+    async def lookup(self, food_items: Iterable[str]) -> Optional[Dict[str, int]]:
+        counts = item_counts(food_items)
+        if not counts:
+            return None
+        cached = await self.meals.aget(meal_key(food_items))
+        if cached is not None:
+            self.meal_hits += 1
+            return {m: cached[m] for m in MACROS}
+        per_item = []
+        for name, count in counts.items():
+            entry = await self.items.aget(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            per_item.append((entry, count))
+        self.item_hits += 1
+        return {m: sum(int(entry[m]) * count for entry, count in per_item) for m in MACROS}
+
+    async def record(
+        self,
+        food_items: Iterable[str],
+        totals: Dict[str, Any],
+        breakdown: Iterable[Dict[str, Any]] = (),
+    ) -> None:
+        counts = item_counts(food_items)
+        if not counts:
+            return
+        await self.meals.aset(meal_key(food_items), {m: int(totals[m]) for m in MACROS})
+        if len(counts) == 1:
+            # A single item repeated n times: learn one serving as totals / n
+            [(name, count)] = counts.items()
+            await self.items.aset(name, {m: round(int(totals[m]) / count) for m in MACROS})
+            return
+        for entry in breakdown:
+            name = canonicalize_item(str(entry.get("name", "")))
+            # Only learn rows that map back to an item eaten once in this meal;
+            # a row for a repeated item may cover one serving or all of them
+            if counts.get(name) == 1 and all(m in entry for m in MACROS):
+                await self.items.aset(name, {m: int(entry[m]) for m in MACROS})
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.meal_hits + self.item_hits + self.misses
+        return {
+            "meal_hits": self.meal_hits,
+            "item_hits": self.item_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.meal_hits + self.item_hits) / lookups if lookups else 0.0,
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Snapshot the in-process tiers to a JSON file (written atomically).
+        """
+        snapshot = {}
+        for label, cache in (("meals", self.meals), ("items", self.items)):
+            front = _front(cache)
+            snapshot[label] = front.items() if front is not None else []
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+        """
+        Warm the in-process tiers from a snapshot written by save().
+        """
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            snapshot = json.load(f)
+        for label, cache in (("meals", self.meals), ("items", self.items)):
+            front = _front(cache)
+            if front is None:
+                continue
+            for key, value in snapshot.get(label, []):
+                front.set(key, value)
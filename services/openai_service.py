@@ -1,21 +1,113 @@
 import os
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import math
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, AsyncIterator, Optional
+import httpx
+from fastapi import HTTPException
+from services.metrics import OPENAI_REQUEST_SECONDS, record_openai_usage
+from services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ConcurrencyLimiter,
+    RetryPolicy,
+    parse_limits,
+    parse_retry_after,
+)
 
-# Initialize OpenAI Responses client
-openai_api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=openai_api_key)
+logger = logging.getLogger(__name__)
 
-def call_openai(
+# Overall budget per call_openai, including queueing for a slot and retries
+OPENAI_DEADLINE_SECONDS = float(os.getenv("OPENAI_DEADLINE_SECONDS", "60"))
+# Budget per individual HTTP attempt
+OPENAI_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_ATTEMPT_TIMEOUT_SECONDS", "30"))
+
+# Built on first use by get_client(); importing the openai SDK alone is a large
+# share of app start-up time
+http_client = None
+client = None
+
+
+def get_client():
+    """
+    The shared async OpenAI Responses client, created on first use over a
+    pooled HTTP client so concurrent requests reuse keep-alive connections.
+    Retries are handled here, not by the SDK.
+    """
+    global client, http_client
+    if client is None:
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),
+                max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50")),
+            ),
+            timeout=httpx.Timeout(OPENAI_ATTEMPT_TIMEOUT_SECONDS, connect=5.0),
+        )
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+    return client
+
+
+retry_policy = RetryPolicy(
+    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "3")),
+    base_delay=float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5")),
+    max_delay=float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "8")),
+)
+breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30")),
+)
+# e.g. OPENAI_SCHEMA_CONCURRENCY="food_items=16,advice_response=32"
+limiter = ConcurrencyLimiter(
+    global_limit=int(os.getenv("OPENAI_MAX_CONCURRENCY", "64")),
+    per_key_limits=parse_limits(os.getenv("OPENAI_SCHEMA_CONCURRENCY", "")),
+)
+
+
+
+def _unavailable(detail: str, retry_after: Optional[float] = None) -> HTTPException:
+    headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+    return HTTPException(status_code=503, detail=detail, headers=headers)
+
+
+async def _create_with_retries(params: Dict[str, Any]):
+    import openai
+    # Rate limits, 5xx, timeouts and connection failures are worth retrying
+    retryable = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+    responses = get_client().responses
+    attempt = 0
+    while True:
+        try:
+            response = await responses.create(**params, timeout=OPENAI_ATTEMPT_TIMEOUT_SECONDS)
+        except retryable as e:
+            retry_after = parse_retry_after(e.response.headers) if isinstance(e, openai.APIStatusError) else None
+            # The breaker counts failed calls, not attempts: one failure once this call gives up
+            if attempt >= retry_policy.max_retries or breaker.state == CircuitBreaker.OPEN:
+                breaker.record_failure()
+                raise _unavailable(f"AI service unavailable: {e}", retry_after)
+            if retry_after is not None and retry_after > retry_policy.max_delay:
+                # Not worth holding the request open; let the client come back later
+                breaker.record_failure()
+                raise _unavailable("AI service is rate limited", retry_after)
+            await asyncio.sleep(retry_policy.delay(attempt, retry_after))
+            attempt += 1
+            continue
+        except openai.APIStatusError:
+            # A 4xx means the upstream is healthy and the request itself is bad
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+
+def _build_params(
     messages: List[Dict[str, Any]],
     schema: Dict[str, Any],
     name: str,
-    temperature: float = 0.0,
-    max_output_tokens: Optional[int] = None
-) -> str:
-    """
-    Helper to call the OpenAI Responses API with structured JSON schema output.
-    """
+    temperature: float,
+    max_output_tokens: Optional[int],
+) -> Dict[str, Any]:
     params: Dict[str, Any] = {
         "model": "gpt-4o",
         "input": messages,
@@ -24,6 +116,142 @@ def call_openai(
     }
     if max_output_tokens is not None:
         params["max_output_tokens"] = max_output_tokens
+    return params
+
+
+def _queue_timeout(name: str) -> HTTPException:
+    # Our own concurrency cap was full for the whole deadline; upstream was never
+    # called, so this is load shedding and not a breaker failure
+    return _unavailable(f"AI service is busy; no free {name} slot in time", 1)
+
+
+def _check_breaker() -> None:
+    try:
+        breaker.before_call()
+    except CircuitOpenError as e:
+        raise _unavailable("AI service temporarily unavailable", e.retry_after)
 
-    response = client.responses.create(**params)
+
+async def call_openai(
+    messages: List[Dict[str, Any]],
+    schema: Dict[str, Any],
+    name: str,
+    temperature: float = 0.0,
+    max_output_tokens: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> str:
+    """
+    Helper to call the OpenAI Responses API with structured JSON schema output.
+    Awaits the request so the event loop stays free while the model is working.
+    Calls are capped globally and per schema name, retried with jittered
+    backoff, bounded by `deadline` seconds (504), and rejected with a 503
+    while the circuit breaker is open or no slot frees up before the deadline.
+    """
+    params = _build_params(messages, schema, name, temperature, max_output_tokens)
+    deadline = deadline or OPENAI_DEADLINE_SECONDS
+    _check_breaker()
+    start = time.perf_counter()
+    called = False
+    try:
+        async with asyncio.timeout(deadline):
+            async with limiter.acquire(name):
+                called = True
+                response = await _create_with_retries(params)
+    except TimeoutError:
+        if not called:
+            OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, name, "queue_timeout")
+            raise _queue_timeout(name)
+        breaker.record_failure()
+        OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, name, "timeout")
+        raise HTTPException(status_code=504, detail=f"AI service did not respond within {deadline:.0f}s")
+    except BaseException:
+        OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, name, "error")
+        raise
+    OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, name, "ok")
+    _log_usage(name, response)
     return response.output_text
+
+
+async def stream_openai(
+    messages: List[Dict[str, Any]],
+    schema: Dict[str, Any],
+    name: str,
+    temperature: float = 0.0,
+    max_output_tokens: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of call_openai: yields the structured output's text
+    deltas as the model produces them. Opening the stream gets the same
+    retries, caps and breaker as call_openai; once text has been yielded,
+    failures are not retried. The deadline covers the whole stream.
+    """
+    import openai
+    params = _build_params(messages, schema, name, temperature, max_output_tokens)
+    params["stream"] = True
+    deadline = deadline or OPENAI_DEADLINE_SECONDS
+    _check_breaker()
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline
+    start = time.perf_counter()
+    outcome = "error"
+    called = False
+    try:
+        async with limiter.acquire(name, timeout=expires_at - loop.time()):
+            called = True
+            stream = await asyncio.wait_for(_create_with_retries(params), expires_at - loop.time())
+            async with stream:
+                events = stream.__aiter__()
+                while True:
+                    try:
+                        event = await asyncio.wait_for(anext(events), expires_at - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    except openai.APIError as e:
+                        # The stream was already open, so this is not retried
+                        breaker.record_failure()
+                        raise _unavailable(f"AI stream interrupted: {e}")
+                    if event.type == "response.output_text.delta":
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        _log_usage(name, event.response)
+                    elif event.type in ("response.failed", "response.incomplete"):
+                        raise HTTPException(status_code=502, detail=f"AI response {event.type.split('.')[-1]}")
+        outcome = "ok"
+    except TimeoutError:
+        if not called:
+            outcome = "queue_timeout"
+            raise _queue_timeout(name)
+        breaker.record_failure()
+        outcome = "timeout"
+        raise HTTPException(status_code=504, detail=f"AI service did not respond within {deadline:.0f}s")
+    finally:
+        # Whole-stream duration; an abandoned stream counts as an error
+        OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, name, outcome)
+
+
+def _log_usage(name: str, response) -> None:
+    # Cached input tokens show whether the stable prompt prefix is hitting the provider cache
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    record_openai_usage(name, usage.input_tokens, cached_tokens, usage.output_tokens)
+    logger.info(
+        "openai name=%s input_tokens=%d cached_tokens=%d output_tokens=%d",
+        name,
+        usage.input_tokens,
+        cached_tokens,
+        usage.output_tokens,
+    )
+
+
+async def close_client() -> None:
+    """
+    Close the shared HTTP connection pool (called on app shutdown).
+    """
+    global client
+    if client is not None:
+        await client.close()
+        client = None
@@ -0,0 +1,167 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+from schemas import UserRead
+from services.cache_service import LRUCache
+from services.nutrition_cache import MACROS
+
+logger = logging.getLogger(__name__)
+
+# Rough token budget for the "meals today" block of a prompt
+PROMPT_MEALS_TOKEN_BUDGET = int(os.getenv("PROMPT_MEALS_TOKEN_BUDGET", "250"))
+# Items listed per meal row before the rest are elided as "+N more"
+PROMPT_MAX_ITEMS_PER_MEAL = int(os.getenv("PROMPT_MAX_ITEMS_PER_MEAL", "6"))
+
+COACH_PERSONA = "You are a friendly personal health coach. Speak with empathy and encouragement."
+
+# Static, per-task instructions. These lead the prompt so the provider's
+# prefix cache can reuse them across requests; keep them byte-for-byte stable.
+TASK_INSTRUCTIONS = {
+    "advice": (
+        "You are NutriCoach, your friendly personal nutrition coach. "
+        "You will get the client's profile and daily goals, their intake so far, and the meal they just logged. "
+        "First, acknowledge this meal—highlight positives, remind about mindful eating, and how it fits into the day's macro balance. "
+        "Next, recommend the next meal: specify foods, approximate portions, and explain how it optimally balances the remaining macros and supports personal goals. "
+        "Respond strictly in JSON with keys: advice, reason, next_meal."
+    ),
+    "suggestion": (
+        "You are NutriCoach, your friendly personal nutrition coach. "
+        "You will get the client's profile and daily goals, their meals (or macros left) for today, what is in their fridge, "
+        "and sometimes candidate recipes from their recipe book to pick from or adapt. "
+        "Suggest a meal that suits their diet preferences and health conditions and uses as many available items as possible, "
+        "and list any missing ingredients you recommend ordering. "
+        "Respond strictly in JSON with keys: recommendation, missing_ingredients, reason, "
+        "plus the meal's full ingredients list and its calories, protein, carbs and fat per serving."
+    ),
+}
+MEAL_ROW_LEGEND = "Meals are listed newest first as: time | items | kcal P(protein g) C(carbs g) F(fat g)."
+
+# Prefix messages per (task, user id), stored with the UserRead they were built from
+_prefix_cache = LRUCache(maxsize=int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "1024")))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English/JSON).
+    """
+    return (len(text) + 3) // 4
+
+
+def user_goals(user: UserRead) -> Dict[str, int]:
+    return {
+        "calories": user.daily_calories,
+        "protein": user.daily_protein,
+        "carbs": user.daily_carbs,
+        "fat": user.daily_fat,
+    }
+
+
+def profile_string(user: UserRead) -> str:
+    profile = user.model_dump()
+    return (
+        f"Age: {profile['age']} yrs, "
+        f"Weight: {profile['weight']} kg, "
+        f"Health cond.: {profile.get('health_conditions','none')}, "
+        f"Diet prefs: {profile.get('diet_preferences','none')}, "
+        f"Goals: {profile.get('goals','none')}."
+    )
+
+
+def prompt_prefix(task: str, user: UserRead) -> List[Dict[str, Any]]:
+    """
+    The static leading messages for `task`: persona and instructions, then the
+    user's profile and goals. Built once per user and reused verbatim so that
+    identical prefixes hit the provider-side prompt cache.
+    """
+    key = f"{task}:{user.id}"
+    cached = _prefix_cache.get(key)
+    # The user cache hands out the same UserRead until the profile changes,
+    # so the identity check usually settles it without formatting anything
+    if cached is None or (cached[0] is not user and cached[0] != user):
+        profile = f"Client profile: {profile_string(user)} Daily goals: {compact_json(user_goals(user))}."
+        cached = (user, [
+            {"role": "system", "content": f"{COACH_PERSONA} {TASK_INSTRUCTIONS[task]} {MEAL_ROW_LEGEND}"},
+            {"role": "system", "content": profile},
+        ])
+        _prefix_cache.set(key, cached)
+    return [dict(m) for m in cached[1]]
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _macros(nutrition: Dict[str, Any]) -> str:
+    n = {m: int(nutrition.get(m) or 0) for m in MACROS}
+    return f"{n['calories']}kcal P{n['protein']} C{n['carbs']} F{n['fat']}"
+
+
+def _meal_time(meal: Dict[str, Any]) -> str:
+    timestamp = meal.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.strftime("%H:%M") if timestamp else "--:--"
+
+
+def _meal_items(meal: Dict[str, Any]) -> List[str]:
+    food_items = meal.get("food_items") or {}
+    return list(food_items.get("items", [])) if isinstance(food_items, dict) else list(food_items)
+
+
+def meal_row(meal: Dict[str, Any]) -> str:
+    """
+    One compact line per meal: "12:30 | rice, beans | 610kcal P22 C95 F12".
+    """
+    items = _meal_items(meal)
+    shown = ", ".join(items[:PROMPT_MAX_ITEMS_PER_MEAL]) or "unknown"
+    if len(items) > PROMPT_MAX_ITEMS_PER_MEAL:
+        shown += f" +{len(items) - PROMPT_MAX_ITEMS_PER_MEAL} more"
+    return f"{_meal_time(meal)} | {shown} | {_macros(meal.get('nutrition_info') or {})}"
+
+
+def recipe_row(recipe: Dict[str, Any]) -> str:
+    """
+    One compact line per candidate recipe:
+    "Veggie omelette | eggs, spinach, onion | 380kcal P26 C9 F26 | missing: spinach".
+    """
+    macros = recipe.get("macros") or {}
+    shown = _macros(macros) if macros.get("calories") is not None else "macros unknown"
+    return f"{recipe['name']} | {', '.join(recipe['ingredients'])} | {shown} | missing: {', '.join(recipe['missing']) or 'none'}"
+
+
+def compact_meals(meals: List[Dict[str, Any]], budget_tokens: int = PROMPT_MEALS_TOKEN_BUDGET) -> str:
+    """
+    Render meals (newest first) as compact rows within `budget_tokens`.
+    Rows are kept newest first while they fit; anything older is folded
+    into a single summary row with its count and summed macros, so the
+    day's intake is never silently dropped.
+    """
+    if not meals:
+        return "none"
+    rows: List[str] = []
+    used = 0
+    for i, meal in enumerate(meals):
+        row = meal_row(meal)
+        cost = estimate_tokens(row) + 1
+        # Leave room for the summary row whenever older meals would be folded
+        reserve = 20 if i < len(meals) - 1 else 0
+        if used + cost + reserve > budget_tokens:
+            older = meals[i:]
+            totals = {m: sum(int((o.get("nutrition_info") or {}).get(m) or 0) for o in older) for m in MACROS}
+            rows.append(f"earlier | {len(older)} more meal{'s' if len(older) != 1 else ''} | {_macros(totals)}")
+            break
+        rows.append(row)
+        used += cost
+    return "\n".join(rows)
+
+
+def log_prompt_size(name: str, messages: List[Dict[str, Any]]) -> None:
+    """
+    Log the estimated input size of a prompt, split into the cacheable
+    prefix (system messages) and the per-request part.
+    """
+    static = sum(estimate_tokens(m["content"]) for m in messages if m["role"] == "system")
+    dynamic = sum(estimate_tokens(m["content"]) for m in messages if m["role"] != "system")
+    logger.info("prompt name=%s est_prefix_tokens=%d est_dynamic_tokens=%d", name, static, dynamic)
@@ -0,0 +1,177 @@
+"""
+Per-user token-bucket rate limits for the endpoints that call the model.
+
+Each (endpoint, user_id) pair has a bucket holding up to `capacity` tokens,
+refilled continuously at capacity/period per second; a request spends one
+token per model-backed unit of work (one per photo for /analyze_meals).
+Requests that find the bucket short get 429 with Retry-After.
+
+    RATE_LIMITS=analyze_meal=30/60,suggest_meal=60/60   # capacity/period in seconds
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import RateLimitBucket
+from services.metrics import RATE_LIMITED
+
+# memory: per process; db: shared by all workers through rate_limit_buckets; off: no limits
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMITS = os.getenv("RATE_LIMITS", "analyze_meal=30/60,suggest_meal=60/60")
+# Buckets kept by the memory backend; the least recently used are dropped (i.e. refilled)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Compare-and-set attempts per request before the db backend gives up and rejects
+RATE_LIMIT_DB_RETRIES = 5
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    "analyze_meal=30/60,suggest_meal=60/60" -> {"analyze_meal": (30.0, 60.0), ...}
+    """
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        endpoint, _, value = part.partition("=")
+        capacity, _, period = value.partition("/")
+        limits[endpoint.strip()] = (float(capacity), float(period or 1))
+    return limits
+
+
+def _refill(tokens: float, elapsed: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + max(elapsed, 0.0) * rate)
+
+
+def _wait(tokens: float, cost: float, rate: float) -> float:
+    return (cost - tokens) / rate if rate > 0 else math.inf
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by string. acquire() takes `cost` tokens and returns
+    0, or leaves the bucket alone and returns the seconds until it would
+    have enough.
+    """
+
+    def acquire(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        raise NotImplementedError
+
+    async def aacquire(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        return await run_in_threadpool(self.acquire, key, capacity, rate, cost)
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        now = self.clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, now - updated_at, capacity, rate)
+            self._buckets[key] = (tokens - cost if tokens >= cost else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if tokens >= cost else _wait(tokens, cost, rate)
+
+    async def aacquire(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        # Never blocks on I/O, so skip the threadpool hop
+        return self.acquire(key, capacity, rate, cost)
+
+
+class SQLRateLimiter(RateLimiter):
+    """
+    Buckets in the `rate_limit_buckets` table, shared by every worker. Each
+    update is a compare-and-set on the row version, so concurrent workers
+    cannot both spend the same token.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], clock: Callable[[], float] = time.time):
+        self.session_factory = session_factory
+        self.clock = clock
+
+    def acquire(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        with self.session_factory() as db:
+            for _ in range(RATE_LIMIT_DB_RETRIES):
+                now = self.clock()
+                row = db.get(RateLimitBucket, key)
+                if row is None:
+                    if capacity < cost:
+                        return _wait(capacity, cost, rate)
+                    db.add(RateLimitBucket(key=key, tokens=capacity - cost, updated_at=now, version=0))
+                    try:
+                        db.commit()
+                        return 0.0
+                    except IntegrityError:
+                        # Another worker created the bucket first; go again against their row
+                        db.rollback()
+                        continue
+                tokens = _refill(row.tokens, now - row.updated_at, capacity, rate)
+                if tokens < cost:
+                    db.rollback()
+                    return _wait(tokens, cost, rate)
+                updated = (
+                    db.query(RateLimitBucket)
+                    .filter(RateLimitBucket.key == key, RateLimitBucket.version == row.version)
+                    .update(
+                        {"tokens": tokens - cost, "updated_at": now, "version": row.version + 1},
+                        synchronize_session=False,
+                    )
+                )
+                db.commit()
+                if updated:
+                    return 0.0
+                # Lost the race; reload the row
+                db.expire_all()
+        # Heavy contention on one user's bucket is itself a sign of too many requests
+        return 1.0 / rate if rate > 0 else math.inf
+
+
+rate_limiter: Optional[RateLimiter] = MemoryRateLimiter() if RATE_LIMIT_BACKEND == "memory" else None
+limits: Dict[str, Tuple[float, float]] = parse_limits(RATE_LIMITS)
+
+
+def configure_rate_limiter(session_factory: Optional[Callable[[], Session]] = None) -> None:
+    """
+    Build the limiter from RATE_LIMIT_BACKEND (memory|db|off).
+    """
+    global rate_limiter
+    if RATE_LIMIT_BACKEND == "off":
+        rate_limiter = None
+    elif RATE_LIMIT_BACKEND == "memory":
+        rate_limiter = MemoryRateLimiter()
+    elif RATE_LIMIT_BACKEND == "db":
+        if session_factory is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=db requires a database session factory")
+        rate_limiter = SQLRateLimiter(session_factory)
+    else:
+        raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+
+
+async def enforce_rate_limit(endpoint: str, user_id: int, cost: float = 1) -> None:
+    """
+    Spend `cost` tokens from the user's bucket for `endpoint`, or raise 429
+    with Retry-After. Endpoints without a configured limit are not limited;
+    a cost above the capacity is capped so a full bucket always admits it.
+    """
+    if rate_limiter is None or endpoint not in limits:
+        return
+    capacity, period = limits[endpoint]
+    cost = min(cost, capacity)
+    wait = await rate_limiter.aacquire(f"{endpoint}:{user_id}", capacity, capacity / period, cost)
+    if wait > 0:
+        RATE_LIMITED.inc(endpoint)
+        retry_after = math.ceil(wait) if math.isfinite(wait) else int(period)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded for {endpoint}; retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
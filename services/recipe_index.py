@@ -0,0 +1,367 @@
+"""
+Local recipe index used to pre-rank /suggest_meal answers.
+
+An inverted index from canonical ingredient to recipes, with per-recipe
+macros, built from a seed dataset plus the recipes the model has suggested
+before (the suggested_recipes table). It is written to a flat binary file
+and memory-mapped at startup, so every worker shares the same pages.
+
+    python -m services.recipe_index build       # rebuild from the seed file and the database
+"""
+import os
+import sys
+import json
+import math
+import mmap
+import uuid
+import array
+import struct
+import logging
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import SuggestedRecipe
+from services.nutrition_cache import MACROS, canonicalize_item
+
+logger = logging.getLogger(__name__)
+
+RECIPE_INDEX_PATH = os.getenv("RECIPE_INDEX_PATH", "recipe_index.bin")
+RECIPE_SEED_PATH = os.getenv(
+    "RECIPE_SEED_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "seed_recipes.json")
+)
+# Candidates passed to the model when the best match is not good enough to answer directly
+RECIPE_TOP_K = int(os.getenv("RECIPE_TOP_K", "5"))
+# Answer without the model at or above this score; above 1 disables direct answers
+RECIPE_DIRECT_SCORE = float(os.getenv("RECIPE_DIRECT_SCORE", "0.9"))
+# Candidates below this score are not worth showing the model
+RECIPE_MIN_SCORE = float(os.getenv("RECIPE_MIN_SCORE", "0.35"))
+
+# Score = COVERAGE_WEIGHT * fridge coverage + (1 - COVERAGE_WEIGHT) * macro fit
+COVERAGE_WEIGHT = 0.7
+# Macro fit used for recipes learned without macros
+UNKNOWN_FIT = 0.5
+
+_MAGIC = b"RCPIDX01"
+
+
+def load_seed_recipes(path: str = RECIPE_SEED_PATH) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_suggested_recipes(db: Session) -> List[Dict[str, Any]]:
+    rows = db.query(SuggestedRecipe).order_by(SuggestedRecipe.times_suggested.desc()).all()
+    return [
+        {"name": row.name, "ingredients": row.ingredients, **{m: getattr(row, m) for m in MACROS}}
+        for row in rows
+    ]
+
+
+def learned_source(db: Session) -> Dict[str, Any]:
+    """
+    Count and latest suggestion time of the suggested_recipes table, stored
+    in the index header so a startup can tell whether the index is stale.
+    """
+    count, latest = db.query(func.count(SuggestedRecipe.key), func.max(SuggestedRecipe.last_suggested_at)).one()
+    return {"learned": int(count), "last_suggested_at": latest.isoformat() if latest else None}
+
+
+def record_suggestion(db: Session, suggestion: Dict[str, Any], fridge_items: List[str]) -> None:
+    """
+    Remember a model suggestion so the next index build can answer it
+    locally. Uses the ingredients and macros the model reported; without
+    them, the fridge items plus the missing ingredients stand in and the
+    macros stay unknown. Commits.
+    """
+    name = str(suggestion.get("recommendation", "")).strip()
+    key = canonicalize_item(name)
+    if not key:
+        return
+    ingredients = suggestion.get("ingredients") or list(fridge_items) + list(suggestion.get("missing_ingredients", []))
+    values = {
+        "name": name,
+        "ingredients": sorted({canonicalize_item(i) for i in ingredients} - {""}),
+        **{m: int(suggestion[m]) if isinstance(suggestion.get(m), (int, float)) else None for m in MACROS},
+        "last_suggested_at": datetime.utcnow(),
+    }
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        stmt = insert(SuggestedRecipe).values(key=key, times_suggested=1, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SuggestedRecipe.key],
+            set_={**values, "times_suggested": SuggestedRecipe.times_suggested + 1},
+        )
+        db.execute(stmt)
+    else:
+        row = db.get(SuggestedRecipe, key)
+        if row is None:
+            db.add(SuggestedRecipe(key=key, times_suggested=1, **values))
+        else:
+            for field, value in values.items():
+                setattr(row, field, value)
+            row.times_suggested += 1
+    db.commit()
+
+
+def build_index(
+    recipes: Iterable[Dict[str, Any]],
+    path: str = RECIPE_INDEX_PATH,
+    source: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Write the index file for `recipes` (first occurrence of a name wins)
+    atomically and return the number of recipes indexed. Each build writes
+    its own temporary file, so concurrent builds never interleave. `source`
+    (see learned_source) is kept in the header.
+    """
+    names: List[str] = []
+    seen: Set[str] = set()
+    vocabulary: Dict[str, int] = {}
+    macros = array.array("f")
+    recipe_offsets = array.array("i", [0])
+    recipe_ingredients = array.array("i")
+    for recipe in recipes:
+        key = canonicalize_item(recipe.get("name", ""))
+        ingredients = sorted({canonicalize_item(i) for i in recipe.get("ingredients", [])} - {""})
+        if not key or key in seen or not ingredients:
+            continue
+        seen.add(key)
+        names.append(recipe["name"])
+        for m in MACROS:
+            value = recipe.get(m)
+            macros.append(float(value) if value is not None else math.nan)
+        for ingredient in ingredients:
+            recipe_ingredients.append(vocabulary.setdefault(ingredient, len(vocabulary)))
+        recipe_offsets.append(len(recipe_ingredients))
+
+    # Inverted index: ingredient id -> recipe ids, as offsets into one postings array
+    postings_by_ingredient: List[List[int]] = [[] for _ in vocabulary]
+    for recipe_id in range(len(names)):
+        for i in recipe_ingredients[recipe_offsets[recipe_id]:recipe_offsets[recipe_id + 1]]:
+            postings_by_ingredient[i].append(recipe_id)
+    posting_offsets = array.array("i", [0])
+    postings = array.array("i")
+    for recipe_ids in postings_by_ingredient:
+        postings.extend(recipe_ids)
+        posting_offsets.append(len(postings))
+
+    sections = [
+        ("macros", macros), ("recipe_offsets", recipe_offsets), ("recipe_ingredients", recipe_ingredients),
+        ("posting_offsets", posting_offsets), ("postings", postings),
+    ]
+    layout, offset = {}, 0
+    for section, values in sections:
+        layout[section] = [offset, len(values)]
+        offset += len(values) * values.itemsize
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "names": names,
+        "vocabulary": sorted(vocabulary, key=vocabulary.get),
+        "layout": layout,
+        "source": source,
+    }).encode()
+    # Arrays start on an 8-byte boundary after the header
+    padding = -(len(_MAGIC) + 4 + len(header)) % 8
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC + struct.pack("<I", len(header)) + header + b"\0" * padding)
+            for _, values in sections:
+                f.write(values.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(names)
+
+
+class RecipeIndex:
+    """
+    Read-only view over an index file. The arrays are memoryviews into the
+    mapped file, so loading costs only the header parse.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a recipe index")
+        (header_len,) = struct.unpack_from("<I", self._mmap, len(_MAGIC))
+        start = len(_MAGIC) + 4
+        header = json.loads(self._mmap[start:start + header_len])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built on a {header['byteorder']}-endian machine; rebuild it")
+        base = start + header_len + (-(start + header_len) % 8)
+        self.names: List[str] = header["names"]
+        self.source: Optional[Dict[str, Any]] = header.get("source")
+        self.vocabulary: Dict[str, int] = {name: i for i, name in enumerate(header["vocabulary"])}
+        self._ingredient_names: List[str] = header["vocabulary"]
+        view = memoryview(self._mmap)
+        arrays = {}
+        for section, (offset, length) in header["layout"].items():
+            fmt = "f" if section == "macros" else "i"
+            itemsize = struct.calcsize(fmt)
+            arrays[section] = view[base + offset:base + offset + length * itemsize].cast(fmt)
+        self._macros = arrays["macros"]
+        self._recipe_offsets = arrays["recipe_offsets"]
+        self._recipe_ingredients = arrays["recipe_ingredients"]
+        self._posting_offsets = arrays["posting_offsets"]
+        self._postings = arrays["postings"]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _ingredient_ids(self, item: str) -> Set[int]:
+        # Whole canonical names only: "eggs" is "egg", but not "eggs benedict"
+        canonical = canonicalize_item(item)
+        return {self.vocabulary[canonical]} if canonical in self.vocabulary else set()
+
+    def _ingredients(self, recipe_id: int) -> List[int]:
+        return list(self._recipe_ingredients[self._recipe_offsets[recipe_id]:self._recipe_offsets[recipe_id + 1]])
+
+    def search(
+        self,
+        fridge_items: List[str],
+        remaining: Dict[str, int],
+        goals: Dict[str, int],
+        k: int = RECIPE_TOP_K,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k recipes sharing at least one ingredient with the fridge, scored
+        by coverage (share of the recipe's ingredients on hand) and fit (how
+        little it overshoots the remaining macros, relative to daily goals).
+        """
+        available: Set[int] = set()
+        for item in fridge_items:
+            available |= self._ingredient_ids(item)
+        # Walk the postings of the available ingredients, counting matches per recipe
+        matched: Dict[int, int] = {}
+        for i in available:
+            for recipe_id in self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]]:
+                matched[recipe_id] = matched.get(recipe_id, 0) + 1
+
+        scored = []
+        for recipe_id, count in matched.items():
+            size = self._recipe_offsets[recipe_id + 1] - self._recipe_offsets[recipe_id]
+            coverage = count / size
+            values = self._macros[recipe_id * len(MACROS):(recipe_id + 1) * len(MACROS)]
+            if any(math.isnan(v) for v in values):
+                fit = UNKNOWN_FIT
+            else:
+                overshoot = [
+                    max(0.0, v - max(remaining[m], 0)) / max(goals[m], 1) for m, v in zip(MACROS, values)
+                ]
+                fit = max(0.0, 1.0 - 2 * sum(overshoot) / len(MACROS))
+            score = COVERAGE_WEIGHT * coverage + (1 - COVERAGE_WEIGHT) * fit
+            scored.append((score, count, recipe_id, coverage, fit))
+        scored.sort(key=lambda s: (-s[0], -s[1], self.names[s[2]]))
+
+        results = []
+        for score, _, recipe_id, coverage, fit in scored[:k]:
+            ingredients = self._ingredients(recipe_id)
+            values = self._macros[recipe_id * len(MACROS):(recipe_id + 1) * len(MACROS)]
+            results.append({
+                "name": self.names[recipe_id],
+                "ingredients": [self._ingredient_names[i] for i in ingredients],
+                "missing": [self._ingredient_names[i] for i in ingredients if i not in available],
+                "macros": {m: None if math.isnan(v) else int(v) for m, v in zip(MACROS, values)},
+                "coverage": coverage,
+                "fit": fit,
+                "score": score,
+            })
+        return results
+
+    def close(self) -> None:
+        self._macros = self._recipe_offsets = self._recipe_ingredients = None
+        self._posting_offsets = self._postings = None
+        self._mmap.close()
+
+
+recipe_index: Optional[RecipeIndex] = None
+
+
+def build_from_sources(session_factory: Callable[[], Session], path: str = RECIPE_INDEX_PATH) -> int:
+    with session_factory() as db:
+        source = learned_source(db)
+        learned = load_suggested_recipes(db)
+    return build_index(load_seed_recipes(RECIPE_SEED_PATH) + learned, path, source)
+
+
+def _stale_reason(session_factory: Callable[[], Session], path: str) -> Optional[str]:
+    index = RecipeIndex(path)
+    try:
+        built_from = index.source
+    finally:
+        index.close()
+    with session_factory() as db:
+        current = learned_source(db)
+    if built_from == current:
+        return None
+    if built_from is None:
+        return "built without a source header"
+    return (
+        f"built from {built_from['learned']} learned recipes (latest {built_from['last_suggested_at']}), "
+        f"database has {current['learned']} (latest {current['last_suggested_at']})"
+    )
+
+
+@contextmanager
+def _build_lock(path: str) -> Iterator[None]:
+    try:
+        import fcntl
+    except ImportError:
+        # No flock (Windows): concurrent first builds are redundant but still safe
+        yield
+        return
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def configure_recipe_index(session_factory: Callable[[], Session], path: str = RECIPE_INDEX_PATH) -> None:
+    """
+    Map the index file, building it first if it does not exist yet or if
+    suggested_recipes changed since it was built; workers starting together
+    wait for one build under a file lock. If the index cannot be built or
+    read, suggestions go to the model alone. Running workers pick up learned
+    suggestions on their next restart.
+    """
+    global recipe_index
+    try:
+        with _build_lock(path):
+            if not os.path.exists(path):
+                count = build_from_sources(session_factory, path)
+                logger.info("built recipe index with %d recipes at %s", count, path)
+            else:
+                reason = _stale_reason(session_factory, path)
+                if reason is not None:
+                    count = build_from_sources(session_factory, path)
+                    logger.info("rebuilt stale recipe index at %s (%s) with %d recipes", path, reason, count)
+        recipe_index = RecipeIndex(path)
+    except Exception:
+        logger.warning("recipe index unavailable at %s; suggesting with the model only", path, exc_info=True)
+        recipe_index = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the local recipe index.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--path", default=RECIPE_INDEX_PATH)
+    args = parser.parse_args()
+
+    # The app's engine, so the CLI gets the same URL handling and pool settings
+    from database import SessionLocal
+    count = build_from_sources(SessionLocal, args.path)
+    print(f"Indexed {count} recipes into {args.path}")
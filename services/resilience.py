@@ -0,0 +1,161 @@
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Mapping, Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is rejecting calls."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Upstream unavailable; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After `failure_threshold` failures it
+    opens and rejects calls for `reset_timeout` seconds, then lets a single
+    trial call through (half-open): success closes it, failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_started: Optional[float] = None
+
+    def before_call(self) -> None:
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # A trial that never reported back (e.g. cancelled) is treated as abandoned
+            if self._trial_started is not None and now - self._trial_started < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout)
+            self._trial_started = now
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._trial_started = None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. A server-provided Retry-After is
+    used as-is; callers decide whether it is too long to wait.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Seconds to wait from `retry-after-ms` / `retry-after` (seconds or HTTP date).
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class ConcurrencyLimiter:
+    """
+    A global cap on in-flight calls plus optional per-key caps (e.g. per
+    schema name), so one slow call type cannot take every slot.
+    """
+
+    def __init__(self, global_limit: int, per_key_limits: Optional[Dict[str, int]] = None, default_per_key: Optional[int] = None):
+        self.global_limit = global_limit
+        self.per_key_limits = dict(per_key_limits or {})
+        self.default_per_key = default_per_key
+        self._loop = None
+        self._global: Optional[asyncio.Semaphore] = None
+        self._per_key: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphores(self, key: str):
+        # asyncio primitives belong to one event loop; rebuild if the loop changed
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._global = asyncio.Semaphore(self.global_limit)
+            self._per_key = {}
+        limit = self.per_key_limits.get(key, self.default_per_key)
+        if limit is None:
+            return self._global, None
+        if key not in self._per_key:
+            self._per_key[key] = asyncio.Semaphore(limit)
+        return self._global, self._per_key[key]
+
+    @asynccontextmanager
+    async def acquire(self, key: str, timeout: Optional[float] = None):
+        """
+        Hold a slot for `key`; raises TimeoutError if none frees up within
+        `timeout` seconds. The timeout covers only the wait, not the body.
+        """
+        global_sem, key_sem = self._semaphores(key)
+        async with asyncio.timeout(timeout):
+            if key_sem is not None:
+                await key_sem.acquire()
+            try:
+                await global_sem.acquire()
+            except BaseException:
+                if key_sem is not None:
+                    key_sem.release()
+                raise
+        try:
+            yield
+        finally:
+            global_sem.release()
+            if key_sem is not None:
+                key_sem.release()
+
+
+def parse_limits(value: str) -> Dict[str, int]:
+    """
+    Parse "food_items=8,advice_response=16" into a dict.
+    """
+    limits = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        key, _, limit = part.partition("=")
+        limits[key.strip()] = int(limit)
+    return limits
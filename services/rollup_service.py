@@ -0,0 +1,148 @@
+import argparse
+import calendar
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import DailyNutrition, Meal
+from services.nutrition_cache import MACROS
+from services.metrics import timed
+from services.user_service import get_user
+
+PERIODS = ("day", "week", "month")
+
+
+def utc_today() -> date:
+    """
+    Meal timestamps are naive UTC, so rollup rows and "today" use UTC days.
+    """
+    return datetime.now(timezone.utc).date()
+
+
+def add_to_daily_rollup(db: Session, user_id: int, day: date, nutrition: Dict[str, Any], meals: int = 1) -> None:
+    """
+    Add one meal's macros to the user's rollup row for `day`. Does not commit,
+    so it joins the caller's transaction (the one inserting the Meal).
+    """
+    values = {m: int(nutrition.get(m, 0) or 0) for m in MACROS}
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        stmt = insert(DailyNutrition).values(user_id=user_id, date=day, meal_count=meals, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyNutrition.user_id, DailyNutrition.date],
+            set_={
+                **{m: getattr(DailyNutrition, m) + stmt.excluded[m] for m in MACROS},
+                "meal_count": DailyNutrition.meal_count + stmt.excluded.meal_count,
+            },
+        )
+        db.execute(stmt)
+        return
+    # Generic fallback: lock the row and update it in place
+    row = db.query(DailyNutrition).filter_by(user_id=user_id, date=day).with_for_update().first()
+    if row is None:
+        db.add(DailyNutrition(user_id=user_id, date=day, meal_count=meals, **values))
+    else:
+        for m in MACROS:
+            setattr(row, m, getattr(row, m) + values[m])
+        row.meal_count += meals
+
+
+def get_daily_totals(db: Session, user_id: int, day: date) -> Dict[str, int]:
+    row = db.get(DailyNutrition, (user_id, day))
+    return {m: getattr(row, m) if row else 0 for m in MACROS}
+
+
+def backfill_daily_rollup(db: Session, user_id: Optional[int] = None) -> int:
+    """
+    Rebuild rollup rows from the meals table (all users, or one user).
+    Returns the number of daily rows written.
+    """
+    day = func.date(Meal.timestamp)
+    query = db.query(
+        Meal.user_id,
+        day.label("day"),
+        *[func.coalesce(func.sum(Meal.nutrition_info[m].as_integer()), 0).label(m) for m in MACROS],
+        func.count(Meal.id).label("meal_count"),
+    ).group_by(Meal.user_id, day)
+    stale = db.query(DailyNutrition)
+    if user_id is not None:
+        query = query.filter(Meal.user_id == user_id)
+        stale = stale.filter(DailyNutrition.user_id == user_id)
+    rows = query.all()
+    stale.delete(synchronize_session=False)
+    for row in rows:
+        # SQLite's date() returns a string, Postgres returns a date
+        row_day = row.day if isinstance(row.day, date) else date.fromisoformat(row.day)
+        db.add(DailyNutrition(
+            user_id=row.user_id,
+            date=row_day,
+            meal_count=row.meal_count,
+            **{m: int(getattr(row, m)) for m in MACROS},
+        ))
+    db.commit()
+    return len(rows)
+
+
+def period_bounds(period: str, on: date) -> Tuple[date, date]:
+    """
+    Inclusive first and last day of the day/ISO week/calendar month containing `on`.
+    """
+    if period == "day":
+        return on, on
+    if period == "week":
+        start = on - timedelta(days=on.weekday())
+        return start, start + timedelta(days=6)
+    if period == "month":
+        return on.replace(day=1), on.replace(day=calendar.monthrange(on.year, on.month)[1])
+    raise ValueError(f"Unknown period: {period}")
+
+
+@timed
+def get_nutrition_summary(db: Session, user_id: int, period: str = "day", on: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Totals for a day/week/month straight from the rollup, with the user's
+    daily goals scaled to the period and what remains.
+    """
+    user = get_user(db, user_id)
+    start, end = period_bounds(period, on or utc_today())
+    rows = (
+        db.query(DailyNutrition)
+        .filter(DailyNutrition.user_id == user_id, DailyNutrition.date >= start, DailyNutrition.date <= end)
+        .order_by(DailyNutrition.date)
+        .all()
+    )
+    days = [
+        {"date": r.date, "meal_count": r.meal_count, **{m: getattr(r, m) for m in MACROS}}
+        for r in rows
+    ]
+    totals = {m: sum(d[m] for d in days) for m in MACROS}
+    n_days = (end - start).days + 1
+    goals = {m: getattr(user, f"daily_{m}") * n_days for m in MACROS}
+    return {
+        "user_id": user_id,
+        "period": period,
+        "start": start,
+        "end": end,
+        "meal_count": sum(d["meal_count"] for d in days),
+        "totals": totals,
+        "goals": goals,
+        "remaining": {m: goals[m] - totals[m] for m in MACROS},
+        "days": days,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily_nutrition rollup table.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--user-id", type=int, default=None, help="only rebuild this user's rows")
+    args = parser.parse_args()
+
+    # The app's engine, so the CLI gets the same URL handling and pool settings
+    from database import SessionLocal, engine
+    DailyNutrition.__table__.create(bind=engine, checkfirst=True)
+    with SessionLocal() as db:
+        written = backfill_daily_rollup(db, args.user_id)
+    print(f"Backfilled {written} daily rows")
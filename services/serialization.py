@@ -0,0 +1,39 @@
+import json
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: `pip install orjson` for the fast path
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize plain dicts/lists (datetimes as ISO 8601, as pydantic would)
+    straight to JSON bytes. Uses orjson when installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response for content that already matches the route's
+    response_model (e.g. rows built by the services). Returning it from a
+    route skips FastAPI's validate-then-encode pass; response_model still
+    documents the schema.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
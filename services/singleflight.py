@@ -0,0 +1,53 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+from services.metrics import COALESCED
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key: the first caller runs the
+    function and later callers wait for the same result or exception.
+    Nothing is kept once the call finishes, so this dedupes in-flight work
+    within one process and is not a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is not None:
+            COALESCED.inc(self.name)
+            try:
+                # Shielded, so a follower going away does not cancel the shared call
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if flight.cancelled() and not asyncio.current_task().cancelling():
+                    # The caller running it was cancelled, not us; run it ourselves
+                    return await self.do(key, fn)
+                raise
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Mark it retrieved so a call nobody joined does not log "exception was never retrieved"
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
@@ -0,0 +1,358 @@
+"""
+Image storage backends.
+
+Uploads are stored under their content hash. LocalStorage keeps them on disk
+in sharded directories (uploads/ab/cd/<hash>.jpg); S3Storage puts them in an
+S3-compatible bucket (AWS S3, MinIO, ...) so every node sees the same images.
+save() returns a location string, which is what Meal.image_path holds and
+what read() takes back.
+"""
+import os
+import hmac
+import uuid
+import shutil
+import hashlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, BinaryIO, Dict, Optional
+from urllib.parse import quote, urlsplit
+import aiofiles
+import aiofiles.os
+import httpx
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# local or s3
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Relative paths resolve against the working directory at save time
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Per-file upload limit; larger files are rejected with 413
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+# Unset means AWS; set it for MinIO or another S3-compatible service
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")
+S3_REGION = os.getenv("S3_REGION", os.getenv("AWS_REGION", "us-east-1"))
+S3_PREFIX = os.getenv("S3_PREFIX", "uploads/")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", os.getenv("AWS_ACCESS_KEY_ID", ""))
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", os.getenv("AWS_SECRET_ACCESS_KEY", ""))
+S3_TIMEOUT_SECONDS = float(os.getenv("S3_TIMEOUT_SECONDS", "30"))
+
+
+def shard_path(name: str) -> str:
+    """
+    "3fa9...c1.jpg" -> "3f/a9/3fa9...c1.jpg", so no directory or key prefix
+    collects every upload.
+    """
+    return f"{name[:2]}/{name[2:4]}/{name}"
+
+
+def upload_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(position)
+    return size
+
+
+def check_upload_size(file: UploadFile) -> int:
+    size = upload_size(file)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    return size
+
+
+def _iter_chunks(source: BinaryIO, chunk_size: int):
+    source.seek(0)
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class StorageBackend:
+    """
+    Content-addressed blob store: saving a name that already exists is a
+    no-op, so duplicate uploads share one object.
+    """
+
+    async def save(self, name: str, data: bytes) -> str:
+        raise NotImplementedError
+
+    async def save_stream(self, name: str, source: BinaryIO, size: int) -> str:
+        """
+        Copy `source` (e.g. an UploadFile's spooled file) in chunks of
+        UPLOAD_CHUNK_BYTES without holding it in memory.
+        """
+        raise NotImplementedError
+
+    async def read(self, location: str) -> bytes:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *shard_path(name).split("/"))
+
+    async def save(self, name: str, data: bytes) -> str:
+        # Filesystem calls go through aiofiles.os so a slow disk never stalls the event loop
+        path = self._path(name)
+        if not await aiofiles.os.path.exists(path):
+            await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp name and rename, so a concurrent duplicate never sees a partial file
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(data)
+            await aiofiles.os.replace(tmp_path, path)
+        return path
+
+    async def save_stream(self, name: str, source: BinaryIO, size: int) -> str:
+        path = self._path(name)
+        if not await aiofiles.os.path.exists(path):
+            await run_in_threadpool(self._copy, source, path)
+        return path
+
+    @staticmethod
+    def _copy(source: BinaryIO, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        source.seek(0)
+        with open(tmp_path, "wb") as dest:
+            shutil.copyfileobj(source, dest, length=UPLOAD_CHUNK_BYTES)
+        os.replace(tmp_path, path)
+
+    async def read(self, location: str) -> bytes:
+        # Also reads pre-sharding paths such as "uploads/<hash>.jpg"
+        async with aiofiles.open(location, "rb") as f:
+            return await f.read()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def sign_request(
+    method: str,
+    host: str,
+    path: str,
+    headers: Dict[str, str],
+    region: str,
+    access_key: str,
+    secret_key: str,
+    now: Optional[datetime] = None,
+    service: str = "s3",
+) -> Dict[str, str]:
+    """
+    AWS Signature Version 4 for a request without a query string. `path`
+    must already be URI-encoded and `headers` must include
+    x-amz-content-sha256. Returns the headers to send, with x-amz-date and
+    Authorization added.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    signed = {k.lower(): str(v).strip() for k, v in headers.items()}
+    signed.update({"host": host, "x-amz-date": amz_date})
+    names = sorted(signed)
+    canonical_request = "\n".join([
+        method,
+        path,
+        "",
+        "".join(f"{name}:{signed[name]}\n" for name in names),
+        ";".join(names),
+        signed["x-amz-content-sha256"],
+    ])
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+    key = _hmac(f"AWS4{secret_key}".encode(), amz_date[:8])
+    for part in (region, service, "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    out = {k: v for k, v in headers.items() if k.lower() != "host"}
+    out["x-amz-date"] = amz_date
+    out["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={';'.join(names)}, Signature={signature}"
+    )
+    return out
+
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3-compatible bucket, addressed path-style
+    ({endpoint}/{bucket}/{key}) so custom endpoints need no DNS setup.
+    Requests are signed with SigV4; bodies are sent unsigned
+    (UNSIGNED-PAYLOAD) so uploads can stream.
+    """
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: str = S3_ENDPOINT_URL,
+        region: str = S3_REGION,
+        prefix: str = S3_PREFIX,
+        access_key: str = S3_ACCESS_KEY_ID,
+        secret_key: str = S3_SECRET_ACCESS_KEY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if not bucket:
+            raise ValueError("S3_BUCKET is required for STORAGE_BACKEND=s3")
+        self.bucket = bucket
+        self.endpoint_url = (endpoint_url or f"https://s3.{region}.amazonaws.com").rstrip("/")
+        self.region = region
+        self.prefix = prefix
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        parts = urlsplit(self.endpoint_url)
+        self._origin = f"{parts.scheme}://{parts.netloc}"
+        self._host = parts.netloc
+        self._base_path = parts.path
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self._transport, timeout=S3_TIMEOUT_SECONDS)
+        return self._client
+
+    def _location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def _key(self, location: str) -> str:
+        bucket_prefix = f"s3://{self.bucket}/"
+        if not location.startswith(bucket_prefix):
+            raise HTTPException(status_code=404, detail=f"Image not found: {location}")
+        return location[len(bucket_prefix):]
+
+    async def _request(
+        self,
+        method: str,
+        key: str,
+        content=None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> httpx.Response:
+        path = quote(f"{self._base_path}/{self.bucket}/{key}", safe="/-_.~")
+        signed = sign_request(
+            method, self._host, path, {**(headers or {}), "x-amz-content-sha256": "UNSIGNED-PAYLOAD"},
+            self.region, self.access_key, self.secret_key,
+        )
+        try:
+            return await self.client.request(method, f"{self._origin}{path}", content=content, headers=signed)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=503, detail=f"Image storage unavailable: {e}")
+
+    @staticmethod
+    def _check(response: httpx.Response) -> None:
+        if response.status_code >= 300:
+            raise HTTPException(
+                status_code=502, detail=f"Image storage returned {response.status_code}: {response.text[:200]}"
+            )
+
+    async def _exists(self, key: str) -> bool:
+        response = await self._request("HEAD", key)
+        if response.status_code == 404:
+            return False
+        self._check(response)
+        return True
+
+    async def save(self, name: str, data: bytes) -> str:
+        key = self.prefix + shard_path(name)
+        if not await self._exists(key):
+            self._check(await self._request("PUT", key, content=data, headers={"content-length": str(len(data))}))
+        return self._location(key)
+
+    async def save_stream(self, name: str, source: BinaryIO, size: int) -> str:
+        key = self.prefix + shard_path(name)
+        if not await self._exists(key):
+            chunks = _iter_chunks(source, UPLOAD_CHUNK_BYTES)
+
+            async def body() -> AsyncIterator[bytes]:
+                while True:
+                    chunk = await run_in_threadpool(next, chunks, b"")
+                    if not chunk:
+                        return
+                    yield chunk
+
+            # S3 needs the length up front for a single PUT, even when the body streams
+            self._check(await self._request("PUT", key, content=body(), headers={"content-length": str(size)}))
+        return self._location(key)
+
+    async def read(self, location: str) -> bytes:
+        response = await self._request("GET", self._key(location))
+        if response.status_code == 404:
+            raise HTTPException(status_code=404, detail=f"Image not found: {location}")
+        self._check(response)
+        return response.content
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def make_storage(backend: str = STORAGE_BACKEND) -> StorageBackend:
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+image_storage: StorageBackend = make_storage()
+
+
+class UploadLimitMiddleware:
+    """
+    Reject request bodies over the limit for their path with 413 before they
+    are fully received: up front from Content-Length, otherwise as soon as
+    the streamed body passes the limit. Paths in `path_limits` get their own
+    limit; every other path gets `max_bytes`.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                await self._reject(send, max_bytes)
+                return
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside body parsing, so FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send: Send, max_bytes: int) -> None:
+        body = f'{{"detail":"Request body exceeds {max_bytes} bytes"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,139 @@
+import json
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from fastapi import HTTPException
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# Marks the closing quote of a string value
+_END = object()
+
+
+class JsonFieldStream:
+    """
+    Incrementally decodes the top-level string fields of a streamed JSON
+    object, so text can be forwarded while the model is still writing it.
+    feed() returns (field, text) pieces; non-string values (arrays, numbers)
+    are skipped and only available from the complete document.
+    """
+
+    def __init__(self):
+        self.buffer: List[str] = []
+        self._state = "start"
+        self._key: List[str] = []
+        self._field = ""
+        self._escape = ""
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        self.buffer.append(chunk)
+        out: List[Tuple[str, str]] = []
+        text: List[str] = []
+        for ch in chunk:
+            if self._state == "value_string":
+                decoded = self._decode(ch)
+                if decoded is None:
+                    continue
+                if decoded is _END:
+                    self._state = "after_value"
+                    continue
+                text.append(decoded)
+                continue
+            if text:
+                out.append((self._field, "".join(text)))
+                text = []
+            self._step(ch)
+        if text:
+            out.append((self._field, "".join(text)))
+        return out
+
+    def _decode(self, ch: str):
+        # Returns a decoded piece, None while inside an escape, or _END at the closing quote
+        if self._escape:
+            self._escape += ch
+            if self._escape[1] == "u":
+                if len(self._escape) < 6:
+                    return None
+                code, self._escape = self._escape[2:], ""
+                return chr(int(code, 16))
+            code, self._escape = self._escape[1], ""
+            return _ESCAPES.get(code, code)
+        if ch == "\\":
+            self._escape = ch
+            return None
+        if ch == '"':
+            return _END
+        return ch
+
+    def _step(self, ch: str) -> None:
+        state = self._state
+        if state in ("start", "after_value", "before_key"):
+            if ch == '"':
+                self._state, self._key = "key", []
+        elif state == "key":
+            if ch == '"' and not self._escape:
+                self._field, self._state = "".join(self._key), "before_value"
+            elif ch == "\\" and not self._escape:
+                self._escape = ch
+            else:
+                self._escape = ""
+                self._key.append(ch)
+        elif state == "before_value":
+            if ch == '"':
+                self._state = "value_string"
+            elif ch in "[{":
+                self._state, self._depth, self._in_string = "value_nested", 1, False
+            elif not ch.isspace() and ch != ":":
+                self._state = "value_scalar"
+        elif state == "value_scalar":
+            if ch in ",}":
+                self._state = "before_key"
+        elif state == "value_nested":
+            if self._in_string:
+                if self._escape:
+                    self._escape = ""
+                elif ch == "\\":
+                    self._escape = ch
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._state = "after_value"
+
+    def text(self) -> str:
+        return "".join(self.buffer)
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def format_ndjson(event: str, data: Dict[str, Any]) -> bytes:
+    return (json.dumps({"event": event, "data": data}) + "\n").encode()
+
+
+def wants_ndjson(accept: str) -> bool:
+    return NDJSON_MEDIA_TYPE in (accept or "")
+
+
+async def encode_events(events: AsyncIterator[Tuple[str, Dict[str, Any]]], ndjson: bool = False) -> AsyncIterator[bytes]:
+    """
+    Serialize (event, data) pairs as SSE or NDJSON. Once the response has
+    started its status code can no longer change, so failures are sent as a
+    final "error" event carrying the status code and detail.
+    """
+    encode = format_ndjson if ndjson else format_sse
+    try:
+        async for event, data in events:
+            yield encode(event, data)
+    except HTTPException as e:
+        yield encode("error", {"status_code": e.status_code, "detail": e.detail})
+    except Exception as e:
+        yield encode("error", {"status_code": 500, "detail": str(e)})
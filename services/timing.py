@@ -0,0 +1,33 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+from services.metrics import STAGE_SECONDS
+
+
+class StageTimer:
+    """
+    Records wall-clock durations of named request stages, in milliseconds.
+    Stages may run concurrently; each is timed independently. Durations are
+    also recorded in the pipeline_stage_duration_seconds histogram under
+    `operation`.
+    """
+
+    def __init__(self, operation: str = "request"):
+        self.operation = operation
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed * 1000
+            STAGE_SECONDS.observe(elapsed, self.operation, name)
+
+    def server_timing(self) -> str:
+        """
+        Format the recorded stages as a `Server-Timing` header value.
+        """
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.timings.items())
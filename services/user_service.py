@@ -1,7 +1,30 @@
+import os
+from typing import Optional
 from sqlalchemy.orm import Session
 from models import User
 from schemas import UserCreate, UserRead
 from fastapi import HTTPException
+from services.cache_service import InvalidationChannel, LRUCache
+
+USER_CACHE_NAMESPACE = "users"
+# Profiles change rarely; TTL bounds staleness when no invalidation channel is configured
+user_cache = LRUCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL_SECONDS", "300")) or None,
+)
+_invalidation_channel: Optional[InvalidationChannel] = None
+
+
+def configure_user_cache(channel: Optional[InvalidationChannel]) -> None:
+    """
+    Broadcast profile updates through `channel` so other processes drop
+    their cached copy (and apply theirs here).
+    """
+    global _invalidation_channel
+    _invalidation_channel = channel
+    if channel is not None:
+        channel.subscribe(USER_CACHE_NAMESPACE, user_cache)
+
 
 def create_or_update_user(db: Session, user: UserCreate) -> UserRead:
     db_user = db.query(User).filter(User.id == user.id).first() if user.id else None
@@ -13,11 +36,25 @@ def create_or_update_user(db: Session, user: UserCreate) -> UserRead:
         db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return UserRead.from_orm(db_user)
+    user_read = UserRead.from_orm(db_user)
+    # Refresh this process's copy and tell the others to drop theirs
+    user_cache.set(str(user_read.id), user_read)
+    if _invalidation_channel is not None:
+        _invalidation_channel.publish(USER_CACHE_NAMESPACE, str(user_read.id))
+    return user_read
 
 
 def get_user(db: Session, user_id: int) -> UserRead:
+    """
+    Read-through: served from user_cache, loaded from the DB on a miss.
+    The returned object is shared; treat it as read-only.
+    """
+    cached = user_cache.get(str(user_id))
+    if cached is not None:
+        return cached
     db_user = db.query(User).filter(User.id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserRead.from_orm(db_user)
+    user_read = UserRead.from_orm(db_user)
+    user_cache.set(str(user_id), user_read)
+    return user_read
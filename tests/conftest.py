@@ -0,0 +1,10 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from services.cache_service import LRUCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_user_cache(monkeypatch):
+    # Every test gets its own database, so cached users must not carry over
+    monkeypatch.setattr("services.user_service.user_cache", LRUCache())
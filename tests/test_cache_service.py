@@ -0,0 +1,83 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base
+from services.cache_service import LRUCache, SQLCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.cache_service.time.monotonic", lambda: now[0])
+    cache = LRUCache(maxsize=10, ttl=5)
+    cache.set("a", ["apple"])
+    now[0] += 4
+    assert cache.get("a") == ["apple"]
+    now[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_sql_cache_roundtrip_and_namespaces(session_factory):
+    food = SQLCache(session_factory, "food_items")
+    other = SQLCache(session_factory, "other")
+    assert food.get("abc") is None
+    food.set("abc", ["rice", "beans"])
+    food.set("abc", ["rice", "black beans"])  # overwrite
+    assert food.get("abc") == ["rice", "black beans"]
+    assert other.get("abc") is None
+
+
+def test_sql_cache_purges_expired_entries(session_factory):
+    cache = SQLCache(session_factory, "food_items", ttl=60)
+    cache.set("fresh", ["egg"])
+    cache.set("stale", ["ham"])
+    from datetime import datetime, timedelta
+    from models import CacheEntry
+    with session_factory() as db:
+        db.get(CacheEntry, ("food_items", "stale")).created_at = datetime.utcnow() - timedelta(minutes=5)
+        db.commit()
+    assert cache.get("stale") is None
+    assert cache.purge_expired() == 1
+    assert cache.get("fresh") == ["egg"]
+
+
+def test_invalidation_channel_drops_keys_in_other_processes(session_factory):
+    from services.cache_service import InvalidationChannel
+    # Two "processes", each with its own local cache and channel over the same table
+    cache_a, cache_b = LRUCache(), LRUCache()
+    channel_a, channel_b = InvalidationChannel(session_factory), InvalidationChannel(session_factory)
+    channel_a.subscribe("users", cache_a)
+    channel_b.subscribe("users", cache_b)
+    channel_a.poll_once()
+    channel_b.poll_once()
+
+    cache_a.set("1", "old profile")
+    cache_b.set("1", "old profile")
+    cache_b.set("2", "other user")
+    channel_a.publish("users", "1")
+    channel_a.publish("meals", "2")  # other namespaces are ignored
+
+    assert channel_b.poll_once() == 2
+    assert cache_b.get("1") is None
+    assert cache_b.get("2") == "other user"
+    assert channel_b.poll_once() == 0
@@ -0,0 +1,48 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import threading
+import pytest
+from sqlalchemy import exc, text
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+import database
+
+
+@pytest.fixture
+def small_pool_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(database, "DB_POOL_TIMEOUT", 0.2)
+    engine = database.build_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    yield engine
+    engine.dispose()
+
+
+def test_instrumented_pool_tracks_checkouts_waits_and_timeouts(small_pool_engine):
+    pool = small_pool_engine.pool
+    assert isinstance(pool, database.InstrumentedQueuePool)
+
+    held = small_pool_engine.connect()
+    assert pool.stats()["checked_out"] == 1
+    with pytest.raises(exc.TimeoutError):
+        small_pool_engine.connect()
+
+    # A checkout that has to wait for the held connection to be returned
+    released = threading.Timer(0.05, held.close)
+    released.start()
+    with small_pool_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    released.join()
+
+    stats = pool.stats()
+    assert stats["checkouts"] == 3
+    assert stats["checkout_timeouts"] == 1
+    assert stats["checkout_wait_seconds_max"] >= 0.04
+    assert stats["checked_out"] == 0
+
+
+def test_async_url_for_maps_drivers():
+    assert database.async_url_for("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert database.async_url_for("sqlite:///app.db") == "sqlite+aiosqlite:///app.db"
+    with pytest.raises(RuntimeError):
+        database.async_url_for("mysql://db/app")
@@ -0,0 +1,53 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import io
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from services.image_service import preprocess_image
+
+
+def _photo_with_orientation(size=(3000, 2000), orientation=6):
+    img = Image.new("RGB", size, (180, 90, 30))
+    exif = Image.Exif()
+    exif[0x0112] = orientation  # rotate 90° CW on display
+    exif[0x010F] = "PhoneMaker"
+    out = io.BytesIO()
+    img.save(out, "JPEG", exif=exif, quality=95)
+    return out.getvalue()
+
+
+def test_preprocess_downscales_rotates_and_strips_exif():
+    data, ext = preprocess_image(io.BytesIO(_photo_with_orientation()), max_dimension=1024)
+    assert ext == ".jpg"
+    img = Image.open(io.BytesIO(data))
+    # Orientation 6 swaps width and height once applied
+    assert img.size == (683, 1024)
+    assert not img.getexif()
+    assert len(data) < 100_000
+
+
+def test_preprocess_webp_and_small_images_not_upscaled():
+    small = io.BytesIO()
+    Image.new("RGBA", (200, 100), (0, 0, 0, 0)).save(small, "PNG")
+    small.seek(0)
+    data, ext = preprocess_image(small, max_dimension=1024, image_format="WEBP")
+    assert ext == ".webp"
+    assert Image.open(io.BytesIO(data)).size == (200, 100)
+
+
+def test_preprocess_rejects_non_images():
+    with pytest.raises(HTTPException) as exc:
+        preprocess_image(io.BytesIO(b"definitely not an image"))
+    assert exc.value.status_code == 400
+
+
+def test_preprocess_rejects_decompression_bombs(monkeypatch):
+    # Far more pixels than allowed (Pillow errors above twice the limit)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    bomb = io.BytesIO()
+    Image.new("RGB", (100, 100)).save(bomb, "PNG")
+    bomb.seek(0)
+    with pytest.raises(HTTPException) as exc:
+        preprocess_image(bomb)
+    assert exc.value.status_code == 400
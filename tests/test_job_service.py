@@ -0,0 +1,202 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import io
+import json
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import AnalysisJob, Base, Meal
+from schemas import UserCreate
+from services import job_service
+from services.cache_service import LRUCache
+from services.db_runner import session_runner
+from services.nutrition_cache import NutritionMemo
+from services.user_service import create_or_update_user
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # uploads/ is created relative to the CWD
+    monkeypatch.setattr("services.meal_service.detection_cache", LRUCache())
+    monkeypatch.setattr("services.meal_service.nutrition_memo", NutritionMemo(LRUCache(), LRUCache()))
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def _upload(color=(10, 120, 200)):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(out, "JPEG")
+    out.seek(0)
+    return UploadFile(file=out, filename="meal.jpg")
+
+
+async def _fake_llm(messages, schema, name, temperature=0.0, max_output_tokens=None):
+    from benchmarks.fake_llm import CANNED_RESPONSES
+    return json.dumps(CANNED_RESPONSES[name])
+
+
+def _enqueue(session_factory, user_id, upload=None, callback_url=None):
+    run_db = session_runner(session_factory)
+    return asyncio.run(job_service.enqueue_analysis(run_db, user_id, upload or _upload(), callback_url))
+
+
+def test_enqueue_deduplicates_identical_submissions(session_factory):
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    first, created = _enqueue(session_factory, user.id)
+    again, created_again = _enqueue(session_factory, user.id)
+    other, created_other = _enqueue(session_factory, user.id, _upload(color=(0, 0, 0)))
+    assert created and not created_again and created_other
+    assert again.id == first.id and other.id != first.id
+    assert first.status == "queued"
+
+    with pytest.raises(HTTPException) as exc:
+        _enqueue(session_factory, user.id + 1)
+    assert exc.value.status_code == 404
+    with pytest.raises(HTTPException) as exc:
+        _enqueue(session_factory, user.id, callback_url="ftp://example.com")
+    assert exc.value.status_code == 400
+
+
+def test_worker_runs_job_to_completion(session_factory, monkeypatch):
+    monkeypatch.setattr("services.meal_service.call_openai", _fake_llm)
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    job, _ = _enqueue(session_factory, user.id)
+
+    pool = job_service.JobWorkerPool(session_factory, concurrency=1)
+    assert asyncio.run(pool.run_once()) is True
+    assert asyncio.run(pool.run_once()) is False
+
+    with session_factory() as db:
+        done = job_service.get_job(db, job.id)
+        assert done.status == "done" and done.attempts == 1
+        assert done.result.food_items == {"items": ["oatmeal", "banana", "coffee"]}
+        assert db.query(Meal).count() == 1
+        assert job_service.queue_stats(db)["done"] == 1
+    # Dedupe only covers in-flight jobs: the same photo later is a new meal
+    later, created = _enqueue(session_factory, user.id)
+    assert created and later.id != job.id
+
+
+def test_resubmission_adds_callback_but_rejects_a_different_one(session_factory, monkeypatch):
+    monkeypatch.setattr("services.meal_service.call_openai", _fake_llm)
+    monkeypatch.setattr(job_service, "JOB_CALLBACK_ALLOWED_HOSTS", {"hooks.test"})
+    delivered = []
+
+    async def fake_send_callback(callback_url, job):
+        delivered.append((callback_url, job.status))
+    monkeypatch.setattr(job_service, "_send_callback", fake_send_callback)
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    job, _ = _enqueue(session_factory, user.id)
+    with session_factory() as db:
+        claimed = job_service.claim_next_job(db)
+
+    # Added while the job is running, and still delivered when it finishes
+    again, created = _enqueue(session_factory, user.id, callback_url="http://hooks.test/a")
+    assert not created and again.id == job.id
+    with pytest.raises(HTTPException) as exc:
+        _enqueue(session_factory, user.id, callback_url="http://hooks.test/b")
+    assert exc.value.status_code == 409
+
+    asyncio.run(job_service.run_job(session_factory, claimed))
+    assert delivered == [("http://hooks.test/a", "done")]
+
+
+def test_failed_jobs_retry_then_fail_and_free_dedupe_key(session_factory, monkeypatch):
+    async def broken_llm(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        raise HTTPException(status_code=503, detail="AI service unavailable")
+    monkeypatch.setattr("services.meal_service.call_openai", broken_llm)
+    monkeypatch.setattr(job_service, "JOB_MAX_ATTEMPTS", 2)
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    job, _ = _enqueue(session_factory, user.id)
+    pool = job_service.JobWorkerPool(session_factory, concurrency=1)
+
+    assert asyncio.run(pool.run_once()) is True
+    with session_factory() as db:
+        retrying = db.get(AnalysisJob, job.id)
+        assert retrying.status == "queued" and retrying.error.startswith("503")
+        # Backed off: not runnable until the retry delay has passed
+        assert job_service.claim_next_job(db) is None
+        retrying.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+
+    assert asyncio.run(pool.run_once()) is True
+    with session_factory() as db:
+        failed = job_service.get_job(db, job.id)
+        assert failed.status == "failed" and failed.attempts == 2
+    resubmitted, created = _enqueue(session_factory, user.id)
+    assert created and resubmitted.id != job.id
+
+
+def test_expired_lease_is_reclaimed_and_stats_report_queue_age(session_factory):
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    job, _ = _enqueue(session_factory, user.id)
+    now = datetime.utcnow()
+    with session_factory() as db:
+        assert job_service.queue_stats(db, now + timedelta(seconds=30))["oldest_queued_age_seconds"] >= 29
+        first = job_service.claim_next_job(db, now)
+        assert first["id"] == job.id
+        # Still leased: nobody else can take it
+        assert job_service.claim_next_job(db, now + timedelta(seconds=1)) is None
+        # The worker died; once the lease runs out the job is claimed again
+        later = now + timedelta(seconds=job_service.JOB_LEASE_SECONDS + 1)
+        second = job_service.claim_next_job(db, later)
+        assert second["id"] == job.id and second["attempts"] == 2
+        assert job_service.queue_stats(db) == {
+            "queued": 0, "running": 1, "done": 0, "failed": 0, "oldest_queued_age_seconds": 0.0,
+        }
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.1.2.3/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:192.168.0.1]/hook",
+])
+def test_callback_urls_to_internal_addresses_are_rejected(url):
+    with pytest.raises(HTTPException) as exc:
+        job_service._validate_callback_url(url)
+    assert exc.value.status_code == 400
+
+
+def test_public_and_allowlisted_callback_urls_are_accepted(monkeypatch):
+    job_service._validate_callback_url("https://93.184.216.34/hook")
+    monkeypatch.setattr(job_service, "JOB_CALLBACK_ALLOWED_HOSTS", {"localhost"})
+    job_service._validate_callback_url("http://localhost:9000/hook")
+
+
+def test_cancelled_job_is_requeued(session_factory, monkeypatch):
+    started = asyncio.Event()
+
+    async def hang(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(60)
+    monkeypatch.setattr("services.meal_service.analyze_stored_meal", hang)
+    with session_factory() as db:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    job, _ = _enqueue(session_factory, user.id)
+
+    async def run():
+        with session_factory() as db:
+            claimed = job_service.claim_next_job(db)
+        task = asyncio.create_task(job_service.run_job(session_factory, claimed))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    with session_factory() as db:
+        requeued = db.get(AnalysisJob, job.id)
+        assert requeued.status == "queued" and requeued.attempts == 0
@@ -1,10 +1,20 @@
 import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 import json
+import asyncio
 import pytest
 from fastapi import HTTPException
-from services.meal_service import detect_food_items, estimate_nutrition, suggest_meal
-from schemas import UserRead
+from services.meal_service import detect_food_items, estimate_nutrition, suggest_meal, analyze_meal
+from schemas import UserRead, UserCreate
+from services.cache_service import LRUCache
+from services.nutrition_cache import NutritionMemo
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    # Keep cached detections/nutrition from leaking between tests
+    monkeypatch.setattr("services.meal_service.detection_cache", LRUCache())
+    monkeypatch.setattr("services.meal_service.nutrition_memo", NutritionMemo(LRUCache(), LRUCache()))
 
 
 def test_detect_food_items_success(monkeypatch, tmp_path):
@@ -14,11 +24,11 @@ def test_detect_food_items_success(monkeypatch, tmp_path):
 
     expected_items = ["apple", "banana"]
     # Mock call_openai to return a JSON object with food_items
-    def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
+    async def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
         return json.dumps({"food_items": expected_items})
     monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
 
-    result = detect_food_items(str(img_file))
+    result = asyncio.run(detect_food_items(str(img_file)))
     assert result == expected_items
 
 
@@ -27,9 +37,11 @@ def test_detect_food_items_invalid_json(monkeypatch, tmp_path):
     img_file.write_bytes(b"data")
 
     # Return invalid JSON
-    monkeypatch.setattr("services.meal_service.call_openai", lambda m, s, n, temperature=0.0, max_output_tokens=None: "not a json")
+    async def fake_call_openai(m, s, n, temperature=0.0, max_output_tokens=None):
+        return "not a json"
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
     with pytest.raises(HTTPException) as exc:
-        detect_food_items(str(img_file))
+        asyncio.run(detect_food_items(str(img_file)))
     assert "Failed to parse food items" in str(exc.value.detail)
 
 
@@ -38,40 +50,315 @@ def test_estimate_nutrition_success(monkeypatch):
     expected_nutrition = {"calories": 150, "protein": 3, "carbs": 35, "fat": 1}
 
     # Mock call_openai to return valid JSON
-    def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
+    async def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
         return json.dumps(expected_nutrition)
     monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
 
-    result = estimate_nutrition(items)
+    result = asyncio.run(estimate_nutrition(items))
     assert result == expected_nutrition
 
 
 def test_estimate_nutrition_invalid_json(monkeypatch):
     items = ["apple"]
-    monkeypatch.setattr("services.meal_service.call_openai", lambda m, s, n, temperature=0.0, max_output_tokens=None: "{invalid-json}")
+    async def fake_call_openai(m, s, n, temperature=0.0, max_output_tokens=None):
+        return "{invalid-json}"
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
     with pytest.raises(HTTPException) as exc:
-        estimate_nutrition(items)
+        asyncio.run(estimate_nutrition(items))
     assert "Nutrition JSON validation failed" in str(exc.value.detail)
 
 
+async def _no_db(fn, *args):
+    # For tests that stub out every query; recording suggestions just logs a warning
+    return fn(None, *args)
+
+
 # Tests for suggest_meal
 def test_suggest_meal_success(monkeypatch):
     # stub user and empty history
     dummy_user = UserRead(id=1, age=30, weight=70.0, health_conditions=None, diet_preferences=None, goals=None)
     monkeypatch.setattr("services.meal_service.get_user", lambda db, user_id: dummy_user)
-    monkeypatch.setattr("services.meal_service.get_meal_history", lambda db, user_id: [])
+    monkeypatch.setattr("services.meal_service.get_todays_meals", lambda db, user_id: [])
     expected = {"recommendation": "omelette", "missing_ingredients": ["salt"], "reason": "quick protein"}
     # mock OpenAI call
-    monkeypatch.setattr("services.meal_service.call_openai", lambda messages, schema, name, temperature=0.7: json.dumps(expected))
-    suggestion = suggest_meal(db=None, user_id=1, fridge_items=["eggs", "milk"])
+    async def fake_call_openai(messages, schema, name, temperature=0.7):
+        return json.dumps(expected)
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+    suggestion = asyncio.run(suggest_meal(_no_db, user_id=1, fridge_items=["eggs", "milk"]))
     assert suggestion == expected
 
 def test_suggest_meal_invalid_json(monkeypatch):
     # stub user and history
     dummy_user = UserRead(id=1, age=30, weight=70.0, health_conditions=None, diet_preferences=None, goals=None)
     monkeypatch.setattr("services.meal_service.get_user", lambda db, user_id: dummy_user)
-    monkeypatch.setattr("services.meal_service.get_meal_history", lambda db, user_id: [])
+    monkeypatch.setattr("services.meal_service.get_todays_meals", lambda db, user_id: [])
     # mock invalid JSON from OpenAI
-    monkeypatch.setattr("services.meal_service.call_openai", lambda messages, schema, name, temperature=0.7: "not-a-json")
+    async def fake_call_openai(messages, schema, name, temperature=0.7):
+        return "not-a-json"
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
     with pytest.raises(HTTPException):
-        suggest_meal(db=None, user_id=1, fridge_items=["eggs"])
+        asyncio.run(suggest_meal(_no_db, user_id=1, fridge_items=["eggs"]))
+
+
+def test_identical_concurrent_suggestions_share_one_call(monkeypatch):
+    dummy_user = UserRead(id=1, age=30, weight=70.0, health_conditions=None, diet_preferences=None, goals=None)
+    monkeypatch.setattr("services.meal_service.get_user", lambda db, user_id: dummy_user)
+    monkeypatch.setattr("services.meal_service.get_todays_meals", lambda db, user_id: [])
+    calls = []
+
+    async def fake_call_openai(messages, schema, name, temperature=0.7):
+        calls.append(messages[-1]["content"])
+        await asyncio.sleep(0.01)
+        return json.dumps({"recommendation": "omelette", "missing_ingredients": [], "reason": "quick"})
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+
+    async def run():
+        return await asyncio.gather(
+            suggest_meal(_no_db, user_id=1, fridge_items=["eggs", "Milk"]),
+            suggest_meal(_no_db, user_id=1, fridge_items=["milk", "eggs"]),
+            suggest_meal(_no_db, user_id=2, fridge_items=["eggs", "milk"]),
+        )
+
+    first, same, other_user = asyncio.run(run())
+    assert first == same == other_user
+    assert len(calls) == 2
+
+
+def test_detect_food_items_cached_by_image_hash(monkeypatch, tmp_path):
+    # Same bytes under two different file names
+    first = tmp_path / "first.jpg"
+    second = tmp_path / "second.jpg"
+    first.write_bytes(b"\xff\xd8same-photo\xff\xd9")
+    second.write_bytes(b"\xff\xd8same-photo\xff\xd9")
+
+    calls = []
+    async def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        calls.append(name)
+        return json.dumps({"food_items": ["toast"]})
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+
+    assert asyncio.run(detect_food_items(str(first))) == ["toast"]
+    assert asyncio.run(detect_food_items(str(second))) == ["toast"]
+    assert calls == ["food_items"]
+
+
+def test_estimate_nutrition_memoized_and_summed_per_item(monkeypatch):
+    calls = []
+    async def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        calls.append(name)
+        return json.dumps({
+            "calories": 250, "protein": 6, "carbs": 50, "fat": 3,
+            "items": [
+                {"name": "banana", "calories": 100, "protein": 1, "carbs": 27, "fat": 0},
+                {"name": "oatmeal", "calories": 150, "protein": 5, "carbs": 23, "fat": 3},
+            ],
+        })
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+
+    first = asyncio.run(estimate_nutrition(["Bananas", "oatmeal"]))
+    assert first == {"calories": 250, "protein": 6, "carbs": 50, "fat": 3}
+    # Same meal in a different order/casing hits the memo
+    assert asyncio.run(estimate_nutrition(["Oatmeal", "banana"])) == first
+    # A repeated item is a different meal, summed from the per-item table
+    assert asyncio.run(estimate_nutrition(["oatmeal", "banana", "banana"])) == {
+        "calories": 350, "protein": 7, "carbs": 77, "fat": 3
+    }
+    # A single known item is answered from the per-item table
+    assert asyncio.run(estimate_nutrition(["banana"])) == {"calories": 100, "protein": 1, "carbs": 27, "fat": 0}
+    assert calls == ["nutrition_info"]
+
+
+@pytest.fixture
+def db_session(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+    monkeypatch.chdir(tmp_path)  # uploads/ is created relative to the CWD
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        yield db
+
+
+@pytest.fixture
+def run_db(db_session):
+    from sqlalchemy.orm import sessionmaker
+    from services.db_runner import session_runner
+    return session_runner(sessionmaker(bind=db_session.get_bind()))
+
+
+def _jpeg(color=(200, 120, 40), size=(64, 48)):
+    import io
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, "JPEG")
+    return out.getvalue()
+
+
+def _upload(data=None, filename="meal.JPG"):
+    import io
+    from fastapi import UploadFile
+    return UploadFile(file=io.BytesIO(data or _jpeg()), filename=filename)
+
+
+async def _fake_llm(messages, schema, name, temperature=0.0, max_output_tokens=None):
+    from benchmarks.fake_llm import CANNED_RESPONSES
+    await asyncio.sleep(0.01)
+    return json.dumps(CANNED_RESPONSES[name])
+
+
+def test_analyze_meal_records_stage_timings(monkeypatch, db_session, run_db):
+    from services.timing import StageTimer
+    from services.user_service import create_or_update_user
+    user = create_or_update_user(db_session, UserCreate(age=30, weight=70.0))
+    monkeypatch.setattr("services.meal_service.call_openai", _fake_llm)
+
+    timer = StageTimer()
+    result = asyncio.run(analyze_meal(run_db, user.id, _upload(), timer))
+    assert result["food_items"] == {"items": ["oatmeal", "banana", "coffee"]}
+    assert result["image_path"].endswith(".jpg")
+    assert set(timer.timings) == {"context", "upload", "detect", "nutrition", "advice", "save"}
+    assert "detect;dur=" in timer.server_timing()
+
+
+def test_analyze_meal_stream_emits_stages_then_persists(monkeypatch, db_session, run_db):
+    from models import Meal
+    from services.meal_service import analyze_meal_stream
+    from services.user_service import create_or_update_user
+    from benchmarks.fake_llm import CANNED_RESPONSES
+    user = create_or_update_user(db_session, UserCreate(age=30, weight=70.0))
+    monkeypatch.setattr("services.meal_service.call_openai", _fake_llm)
+
+    async def fake_stream(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        text = json.dumps(CANNED_RESPONSES[name])
+        for i in range(0, len(text), 5):
+            yield text[i:i + 5]
+    monkeypatch.setattr("services.meal_service.stream_openai", fake_stream)
+
+    async def collect():
+        events = await analyze_meal_stream(run_db, user.id, _upload())
+        return [event async for event in events]
+
+    events = asyncio.run(collect())
+    names = [name for name, _ in events]
+    assert names[:2] == ["items", "nutrition"] and names[-1] == "meal"
+    assert set(names[2:-1]) == {"delta"}
+    advice = "".join(d["text"] for name, d in events if name == "delta" and d["field"] == "advice")
+    assert advice == CANNED_RESPONSES["advice_response"]["advice"]
+    meal = events[-1][1]
+    assert meal["feedback"] == CANNED_RESPONSES["advice_response"]
+    assert db_session.get(Meal, meal["id"]).nutrition_info == events[1][1]["nutrition_info"]
+
+
+def test_analyze_meal_unknown_user_cancels_detection(monkeypatch, run_db):
+    finished = []
+    async def slow_llm(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        await asyncio.sleep(0.5)
+        finished.append(name)
+        return "{}"
+    monkeypatch.setattr("services.meal_service.call_openai", slow_llm)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(analyze_meal(run_db, 999, _upload()))
+    assert exc.value.status_code == 404
+    assert finished == []
+
+
+def test_todays_meals_and_totals_are_date_bounded(db_session, monkeypatch):
+    from datetime import date, datetime
+    from models import Meal
+    from services.meal_service import get_todays_meals, get_todays_totals, _save_meal
+    from services.user_service import create_or_update_user
+    # Fixed clock, so the day boundaries are exercised without depending on when the test runs
+    monkeypatch.setattr("services.meal_service.utc_today", lambda: date(2025, 3, 10))
+    user = create_or_update_user(db_session, UserCreate(age=30, weight=70.0))
+    for ts, kcal in [
+        (datetime(2025, 3, 10, 23, 59, 59), 500),
+        (datetime(2025, 3, 10, 0, 0), 300),
+        (datetime(2025, 3, 9, 23, 59, 59), 700),
+        (datetime(2025, 3, 8, 12, 0), 900),
+    ]:
+        _save_meal(db_session, Meal(
+            user_id=user.id, timestamp=ts, image_path="x.jpg", food_items={"items": ["x"]},
+            nutrition_info={"calories": kcal, "protein": 10, "carbs": 20, "fat": 5}, feedback={},
+        ))
+
+    meals = get_todays_meals(db_session, user.id)
+    assert [m["nutrition_info"]["calories"] for m in meals] == [500, 300]
+    assert get_todays_totals(db_session, user.id) == {"calories": 800, "protein": 20, "carbs": 40, "fat": 10}
+    assert get_todays_totals(db_session, user.id + 1) == {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
+
+
+def test_meal_history_keyset_pages_and_projection(db_session):
+    from datetime import datetime, timedelta
+    from models import Meal
+    from services.meal_service import get_meal_history
+    from services.user_service import create_or_update_user
+    user = create_or_update_user(db_session, UserCreate(age=30, weight=70.0))
+    base = datetime(2025, 1, 1, 12, 0)
+    # Two meals share a timestamp to exercise the id tie-breaker
+    for ts in [base, base, base + timedelta(hours=1), base + timedelta(hours=2), base + timedelta(hours=3)]:
+        db_session.add(Meal(
+            user_id=user.id, timestamp=ts, image_path="x.jpg", food_items={"items": []},
+            nutrition_info={"calories": 1}, feedback={"advice": "long text"},
+        ))
+    db_session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = get_meal_history(db_session, user.id, limit=2, cursor=cursor, fields=["id", "timestamp"])
+        assert all(set(m) == {"id", "timestamp"} for m in page)
+        seen.extend(m["id"] for m in page)
+        if cursor is None:
+            break
+    assert seen == [5, 4, 3, 2, 1]
+
+    window, cursor = get_meal_history(db_session, user.id, since=base + timedelta(hours=1), until=base + timedelta(hours=3))
+    assert [m["id"] for m in window] == [4, 3] and cursor is None
+    assert window[0]["feedback"] == {"advice": "long text"}
+
+    with pytest.raises(HTTPException):
+        get_meal_history(db_session, user.id, fields=["password"])
+    with pytest.raises(HTTPException):
+        get_meal_history(db_session, user.id, cursor="not-a-cursor")
+
+
+def test_analyze_meals_batch_running_totals(monkeypatch, db_session, run_db):
+    from services.meal_service import analyze_meals
+    from services.user_service import create_or_update_user
+    user = create_or_update_user(db_session, UserCreate(age=30, weight=70.0))
+    photos = {(255, 0, 0): ["egg"], (0, 255, 0): ["rice", "beans"], (0, 0, 255): ["apple"]}
+    calls, advice_totals, prompts = [], [], []
+
+    async def fake_call_openai(messages, schema, name, temperature=0.0, max_output_tokens=None):
+        calls.append(name)
+        if name == "food_items":
+            import base64, io
+            from PIL import Image
+            image_url = messages[0]["content"][1]["image_url"]
+            pixel = Image.open(io.BytesIO(base64.b64decode(image_url.split(",", 1)[1]))).getpixel((8, 8))
+            color = min(photos, key=lambda c: sum(abs(a - b) for a, b in zip(c, pixel)))
+            return json.dumps({"food_items": photos[color]})
+        if name == "nutrition_info_batch":
+            meals = [{"calories": 100 * (i + 1), "protein": 1, "carbs": 1, "fat": 1, "items": []} for i in range(3)]
+            return json.dumps({"meals": meals})
+        if name == "advice_response":
+            prompts.append(messages[-1]["content"])
+            intake = messages[-1]["content"].split("Intake so far: ")[1].split("}")[0] + "}"
+            advice_totals.append(json.loads(intake)["calories"])
+            return json.dumps({"advice": "ok", "reason": "r", "next_meal": "n"})
+        raise AssertionError(name)
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+
+    files = [_upload(_jpeg(color), f"p{i}.jpg") for i, color in enumerate(photos)]
+    results = asyncio.run(analyze_meals(run_db, user.id, files))
+
+    assert [r["food_items"]["items"] for r in results] == list(photos.values())
+    assert [r["nutrition_info"]["calories"] for r in results] == [100, 200, 300]
+    assert sorted(advice_totals) == [0, 100, 300]
+    # Earlier meals of the batch are listed with the time they are saved under
+    assert not any("--:--" in p for p in prompts)
+    assert len({r["timestamp"] for r in results}) == 1
+    assert calls.count("nutrition_info_batch") == 1 and calls.count("food_items") == 3
+    from services.meal_service import get_todays_totals
+    assert get_todays_totals(db_session, user.id)["calories"] == 600
@@ -0,0 +1,63 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from services import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    latency = registry.register(metrics.Histogram("op_seconds", "Op latency.", ("name",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, "food_items")
+    text = registry.render()
+    assert '# TYPE op_seconds histogram' in text
+    assert 'op_seconds_bucket{name="food_items",le="0.1"} 1' in text
+    assert 'op_seconds_bucket{name="food_items",le="1.0"} 3' in text
+    assert 'op_seconds_bucket{name="food_items",le="+Inf"} 4' in text
+    assert 'op_seconds_count{name="food_items"} 4' in text
+    assert 'op_seconds_sum{name="food_items"} 4.05' in text
+
+
+def test_timed_records_sync_and_async_functions():
+    @metrics.timed
+    def lookup():
+        return 1
+
+    @metrics.timed
+    async def fetch():
+        return 2
+
+    before = metrics.FUNCTION_SECONDS.count("lookup"), metrics.FUNCTION_SECONDS.count("fetch")
+    assert lookup() == 1 and asyncio.run(fetch()) == 2
+    assert metrics.FUNCTION_SECONDS.count("lookup") == before[0] + 1
+    assert metrics.FUNCTION_SECONDS.count("fetch") == before[1] + 1
+
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="missing")
+        return {"id": item_id}
+
+    client = TestClient(app)
+    ok = metrics.HTTP_REQUEST_SECONDS.count("GET", "/items/{item_id}", "200")
+    missing = metrics.HTTP_REQUEST_SECONDS.count("GET", "/items/{item_id}", "404")
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/0")
+    assert metrics.HTTP_REQUEST_SECONDS.count("GET", "/items/{item_id}", "200") == ok + 2
+    assert metrics.HTTP_REQUEST_SECONDS.count("GET", "/items/{item_id}", "404") == missing + 1
+
+
+def test_cache_stats_become_counters_and_ratio():
+    metrics.record_cache_stats("test_cache", hits=3, misses=1, entries=2)
+    text = metrics.REGISTRY.render()
+    assert 'cache_hits_total{cache="test_cache"} 3' in text
+    assert 'cache_hit_ratio{cache="test_cache"} 0.75' in text
+    assert 'cache_entries{cache="test_cache"} 2' in text
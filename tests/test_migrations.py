@@ -0,0 +1,82 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+import migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _count_statements(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_new_database_is_created_and_stamped(engine):
+    assert migrations.current_version(engine) is None
+    assert migrations.migrate(engine) == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.HEAD
+    tables = inspect(engine).get_table_names()
+    assert {"users", "meals", "analysis_jobs", "schema_migrations"} <= set(tables)
+    assert migrations.migrate(engine) == []
+
+
+def test_unversioned_database_is_upgraded_in_place(engine):
+    # Schema from before the goal columns, index and later tables existed
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER NOT NULL, weight FLOAT NOT NULL, "
+                          "health_conditions VARCHAR, diet_preferences VARCHAR, goals VARCHAR)"))
+        conn.execute(text("CREATE TABLE meals (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, timestamp DATETIME, "
+                          "image_path VARCHAR NOT NULL, food_items JSON NOT NULL, nutrition_info JSON NOT NULL, "
+                          "feedback JSON NOT NULL)"))
+        conn.execute(text("INSERT INTO users (id, age, weight) VALUES (1, 30, 70.0)"))
+
+    migrations.ensure_schema(engine, mode="auto")
+
+    inspector = inspect(engine)
+    assert "daily_calories" in [c["name"] for c in inspector.get_columns("users")]
+    assert "ix_meals_user_id_timestamp" in [i["name"] for i in inspector.get_indexes("meals")]
+    assert inspector.has_table("analysis_jobs")
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT daily_calories FROM users WHERE id = 1")).scalar() == 2000
+
+
+def test_current_schema_costs_one_query_at_startup(engine):
+    migrations.migrate(engine)
+    statements = _count_statements(engine)
+    migrations.ensure_schema(engine, mode="auto")
+    assert len(statements) == 1 and "schema_migrations" in statements[0]
+    migrations.ensure_schema(engine, mode="skip")
+    assert len(statements) == 1
+
+
+def test_check_mode_refuses_to_start_on_an_old_schema(engine):
+    with pytest.raises(RuntimeError):
+        migrations.ensure_schema(engine, mode="check")
+    assert not inspect(engine).has_table("users")
+
+
+def test_daily_rollup_is_backfilled_for_existing_meals(engine):
+    migrations.migrate(engine)
+    # A database at version 4 whose meals predate the rollup
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 5"))
+        conn.execute(text("INSERT INTO users (id, age, weight, daily_calories, daily_protein, daily_carbs, daily_fat) "
+                          "VALUES (1, 30, 70.0, 2000, 75, 250, 70)"))
+        for ts, kcal in (("2025-03-10 08:00:00", 300), ("2025-03-10 19:00:00", 500), ("2025-03-11 08:00:00", 200)):
+            conn.execute(
+                text("INSERT INTO meals (user_id, timestamp, image_path, food_items, nutrition_info, feedback) "
+                     "VALUES (1, :ts, 'x.jpg', '[]', :info, '{}')"),
+                {"ts": ts, "info": '{"calories": %d, "protein": 10, "carbs": 20, "fat": 5}' % kcal},
+            )
+
+    assert migrations.migrate(engine) == [5]
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT date, calories, meal_count FROM daily_nutrition ORDER BY date")).all()
+    assert [tuple(r) for r in rows] == [("2025-03-10", 800, 2), ("2025-03-11", 200, 1)]
@@ -0,0 +1,54 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
+from services.cache_service import LRUCache
+from services.nutrition_cache import NutritionMemo, canonicalize_item, canonical_items, meal_key
+
+
+def test_canonicalize_item():
+    assert canonicalize_item("  Bananas ") == "banana"
+    assert canonicalize_item("Cherry Tomatoes") == "cherry tomato"
+    assert canonicalize_item("berries") == "berry"
+    assert canonicalize_item("sandwiches") == "sandwich"
+    assert canonicalize_item("Cookies") == "cookie"
+    assert canonicalize_item("hummus") == "hummus"
+    assert canonicalize_item("Coffee!") == "coffee"
+
+
+def test_canonical_items_sorted_and_deduplicated():
+    assert canonical_items(["eggs", "Toast", "egg", ""]) == ["egg", "toast"]
+
+
+def test_memo_counts_and_snapshot_roundtrip(tmp_path):
+    memo = NutritionMemo(LRUCache(), LRUCache())
+    totals = {"calories": 80, "protein": 6, "carbs": 1, "fat": 5}
+    assert asyncio.run(memo.lookup(["egg"])) is None
+    asyncio.run(memo.record(["eggs"], totals))
+    assert asyncio.run(memo.lookup(["Egg"])) == totals
+    assert memo.stats()["misses"] == 1 and memo.stats()["meal_hits"] == 1
+
+    path = str(tmp_path / "nutrition.json")
+    memo.save(path)
+    warm = NutritionMemo(LRUCache(), LRUCache())
+    warm.load(path)
+    assert asyncio.run(warm.lookup(["egg"])) == totals
+
+
+def test_repeated_items_keep_their_count():
+    memo = NutritionMemo(LRUCache(), LRUCache())
+    assert meal_key(["banana", "Bananas", "toast"]) == "banana x2|toast"
+    two = {"calories": 210, "protein": 2, "carbs": 54, "fat": 1}
+    asyncio.run(memo.record(["banana", "banana"], two))
+    # The per-item table holds one banana, not the two-banana totals
+    assert memo.items.get("banana") == {"calories": 105, "protein": 1, "carbs": 27, "fat": 0}
+    assert asyncio.run(memo.lookup(["banana", "banana"])) == two
+    assert asyncio.run(memo.lookup(["banana"]))["calories"] == 105
+    assert asyncio.run(memo.lookup(["banana"] * 3))["calories"] == 315
+
+
+def test_memo_bounded_by_lru():
+    memo = NutritionMemo(LRUCache(maxsize=2), LRUCache(maxsize=2))
+    for name in ("apple", "pear", "plum"):
+        asyncio.run(memo.record([name], {"calories": 50, "protein": 0, "carbs": 12, "fat": 0}))
+    assert len(memo.meals) == 2
+    assert asyncio.run(memo.lookup(["apple"])) is None
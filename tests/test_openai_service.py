@@ -0,0 +1,175 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import asyncio
+import httpx
+import pytest
+from fastapi import HTTPException
+from openai import AsyncOpenAI
+from services import metrics, openai_service
+from services.resilience import CircuitBreaker, ConcurrencyLimiter, RetryPolicy, parse_retry_after
+from benchmarks.fake_openai_server import FakeServerConfig, create_app
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+SCHEMA = {"type": "object", "properties": {"food_items": {"type": "array", "items": {"type": "string"}}}}
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """
+    Point the real client at the in-process fake Responses server and give
+    each test its own retry policy, breaker and limiter.
+    """
+    config = FakeServerConfig()
+    app = create_app(config)
+    client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://fake/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+        max_retries=0,
+    )
+    monkeypatch.setattr(openai_service, "client", client)
+    monkeypatch.setattr(openai_service, "retry_policy", RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.5))
+    monkeypatch.setattr(openai_service, "breaker", CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    monkeypatch.setattr(openai_service, "limiter", ConcurrencyLimiter(global_limit=64))
+    return app
+
+
+def _call(**kwargs):
+    return openai_service.call_openai(MESSAGES, SCHEMA, "food_items", **kwargs)
+
+
+def test_call_openai_returns_structured_output(fake_server):
+    calls = metrics.OPENAI_REQUEST_SECONDS.count("food_items", "ok")
+    input_tokens = metrics.OPENAI_TOKENS.value("food_items", "input")
+    text = asyncio.run(_call())
+    assert json.loads(text) == {"food_items": ["oatmeal", "banana", "coffee"]}
+    # Latency and the usage block are recorded per schema name
+    assert metrics.OPENAI_REQUEST_SECONDS.count("food_items", "ok") == calls + 1
+    assert metrics.OPENAI_TOKENS.value("food_items", "input") == input_tokens + 100
+
+
+def test_retries_rate_limit_honoring_retry_after(fake_server, monkeypatch):
+    fake_server.state.config.error_status = 429
+    fake_server.state.config.retry_after = 0.05
+    fake_server.state.config.fail_first = 2
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def recording_sleep(seconds):
+        delays.append(seconds)
+        await real_sleep(0)
+
+    monkeypatch.setattr(openai_service.asyncio, "sleep", recording_sleep)
+    text = asyncio.run(_call())
+    assert json.loads(text)["food_items"]
+    assert fake_server.state.stats.requests == 3
+    assert delays == [0.05, 0.05]
+    assert openai_service.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_long_retry_after_fails_fast_with_503(fake_server):
+    fake_server.state.config.error_status = 429
+    fake_server.state.config.retry_after = 120
+    fake_server.state.config.fail_first = 1
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_call())
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "120"
+    assert fake_server.state.stats.requests == 1
+
+
+def test_breaker_opens_and_rejects_without_calling_upstream(fake_server):
+    fake_server.state.config.error_rate = 1.0
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_call())
+    assert exc.value.status_code == 503
+    # One failed call, however many attempts it took, is one breaker failure
+    assert fake_server.state.stats.requests == 4
+    assert openai_service.breaker.failures == 1
+    assert openai_service.breaker.state == CircuitBreaker.CLOSED
+
+    # Threshold of 3 consecutive failed calls opens the breaker
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            asyncio.run(_call())
+    assert fake_server.state.stats.requests == 12
+    assert openai_service.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_call())
+    assert exc.value.status_code == 503
+    assert "Retry-After" in exc.value.headers
+    assert fake_server.state.stats.requests == 12
+
+
+def test_deadline_returns_504(fake_server):
+    fake_server.state.config.latency_ms = 500
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(_call(deadline=0.05))
+    assert exc.value.status_code == 504
+
+
+def test_waiting_for_a_slot_does_not_trip_the_breaker(fake_server, monkeypatch):
+    fake_server.state.config.latency_ms = 300
+    monkeypatch.setattr(openai_service, "limiter", ConcurrencyLimiter(global_limit=1))
+    monkeypatch.setattr(openai_service, "breaker", CircuitBreaker(failure_threshold=1, reset_timeout=60))
+
+    async def saturated():
+        holder = asyncio.create_task(_call())
+        await asyncio.sleep(0.05)
+        results = await asyncio.gather(
+            _call(deadline=0.05),
+            _drain(openai_service.stream_openai(MESSAGES, SCHEMA, "food_items", deadline=0.05)),
+            return_exceptions=True,
+        )
+        await holder
+        return results
+
+    queued, streamed = asyncio.run(saturated())
+    for error in (queued, streamed):
+        assert isinstance(error, HTTPException) and error.status_code == 503
+    assert fake_server.state.stats.requests == 1
+    assert openai_service.breaker.state == CircuitBreaker.CLOSED and openai_service.breaker.failures == 0
+
+
+async def _drain(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_per_schema_concurrency_cap(fake_server, monkeypatch):
+    fake_server.state.config.latency_ms = 20
+    monkeypatch.setattr(openai_service, "limiter", ConcurrencyLimiter(global_limit=64, per_key_limits={"food_items": 3}))
+
+    async def burst():
+        await asyncio.gather(*(_call() for _ in range(12)))
+
+    asyncio.run(burst())
+    assert fake_server.state.stats.requests == 12
+    assert fake_server.state.stats.max_in_flight == 3
+
+
+def test_circuit_breaker_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_parse_retry_after_variants():
+    assert parse_retry_after({"retry-after": "3"}) == 3.0
+    assert parse_retry_after({"retry-after-ms": "250"}) == 0.25
+    assert parse_retry_after({}) is None
+
+
+def test_stream_openai_yields_text_deltas(fake_server):
+    async def collect():
+        return [chunk async for chunk in openai_service.stream_openai(MESSAGES, SCHEMA, "food_items")]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert json.loads("".join(chunks)) == {"food_items": ["oatmeal", "banana", "coffee"]}
+    assert openai_service.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,48 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+from schemas import UserRead
+from services.prompt_context import compact_meals, estimate_tokens, meal_row, prompt_prefix
+
+
+def _meal(hour, items, kcal):
+    return {
+        "timestamp": f"2025-01-01T{hour:02d}:15:00",
+        "food_items": {"items": items},
+        "nutrition_info": {"calories": kcal, "protein": 10, "carbs": 20, "fat": 5},
+        "feedback": {"advice": "a long paragraph of advice " * 20},
+    }
+
+
+def test_meal_row_is_compact_and_drops_feedback():
+    row = meal_row(_meal(8, ["oatmeal", "banana"], 420))
+    assert row == "08:15 | oatmeal, banana | 420kcal P10 C20 F5"
+    assert len(row) < len(json.dumps(_meal(8, ["oatmeal", "banana"], 420))) / 10
+
+
+def test_compact_meals_folds_older_meals_over_budget():
+    meals = [_meal(h, [f"dish {h}"], 100 * h) for h in range(20, 0, -1)]
+    text = compact_meals(meals, budget_tokens=60)
+    rows = text.splitlines()
+    assert estimate_tokens(text) <= 60
+    assert rows[0].startswith("20:15")
+    # Folded meals still contribute to the summary row's totals
+    folded = meals[len(rows) - 1:]
+    assert rows[-1] == (
+        f"earlier | {len(folded)} more meals | "
+        f"{sum(100 * int(m['timestamp'][11:13]) for m in folded)}kcal P{10 * len(folded)} C{20 * len(folded)} F{5 * len(folded)}"
+    )
+    assert compact_meals([]) == "none"
+
+
+def test_prompt_prefix_is_stable_per_user_and_tracks_profile_changes():
+    user = UserRead(id=7, age=30, weight=70.0, goals="lose fat")
+    first = prompt_prefix("advice", user)
+    assert prompt_prefix("advice", user) == first
+    assert "Goals: lose fat." in first[1]["content"]
+    assert prompt_prefix("suggestion", user)[0] != first[0]
+
+    updated = user.model_copy(update={"goals": "build muscle"})
+    assert "Goals: build muscle." in prompt_prefix("advice", updated)[1]["content"]
+    # The instruction message is shared by every user, so it stays cacheable
+    assert prompt_prefix("advice", updated)[0] == first[0]
@@ -0,0 +1,80 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base
+from services import rate_limit
+from services.rate_limit import MemoryRateLimiter, SQLRateLimiter, enforce_rate_limit, parse_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'limits.db'}", connect_args={"timeout": 30})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_parse_limits():
+    assert parse_limits("analyze_meal=30/60, suggest_meal=5") == {"analyze_meal": (30.0, 60.0), "suggest_meal": (5.0, 1.0)}
+
+
+@pytest.mark.parametrize("backend", ["memory", "db"])
+def test_bucket_allows_a_burst_then_refills(backend, session_factory):
+    clock = Clock()
+    limiter = MemoryRateLimiter(clock=clock) if backend == "memory" else SQLRateLimiter(session_factory, clock=clock)
+    # 3 tokens, refilled at 1 per 10 s
+    assert [limiter.acquire("suggest_meal:1", 3, 0.1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("suggest_meal:1", 3, 0.1) == pytest.approx(10.0)
+    # Other users and endpoints have their own buckets
+    assert limiter.acquire("suggest_meal:2", 3, 0.1) == 0.0
+    assert limiter.acquire("analyze_meal:1", 3, 0.1) == 0.0
+
+    clock.now += 5
+    assert limiter.acquire("suggest_meal:1", 3, 0.1) == pytest.approx(5.0)
+    clock.now += 5
+    assert limiter.acquire("suggest_meal:1", 3, 0.1) == 0.0
+    # A batch needs all of its tokens at once
+    clock.now += 20
+    assert limiter.acquire("suggest_meal:1", 3, 0.1, cost=3) == pytest.approx(10.0)
+    clock.now += 10
+    assert limiter.acquire("suggest_meal:1", 3, 0.1, cost=3) == 0.0
+
+
+def test_db_buckets_are_not_overspent_by_concurrent_workers(session_factory):
+    limiters = [SQLRateLimiter(session_factory, clock=lambda: 1000.0) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        waits = list(pool.map(lambda i: limiters[i % 4].acquire("analyze_meal:1", 10, 0.001), range(40)))
+    assert waits.count(0.0) == 10
+
+
+def test_enforce_rate_limit_raises_429_with_retry_after(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "rate_limiter", MemoryRateLimiter(clock=clock))
+    monkeypatch.setattr(rate_limit, "limits", {"suggest_meal": (2.0, 60.0)})
+
+    async def run():
+        await enforce_rate_limit("suggest_meal", 1)
+        await enforce_rate_limit("suggest_meal", 1)
+        # Not configured, so not limited
+        for _ in range(5):
+            await enforce_rate_limit("analyze_meal", 1)
+        with pytest.raises(HTTPException) as exc:
+            await enforce_rate_limit("suggest_meal", 1)
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "30"}
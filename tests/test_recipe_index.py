@@ -0,0 +1,171 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, SuggestedRecipe
+from schemas import UserRead
+from services import recipe_index
+from services.meal_service import suggest_meal
+from services.db_runner import session_runner
+from services.recipe_index import RecipeIndex, build_from_sources, build_index, learned_source, record_suggestion
+
+RECIPES = [
+    {"name": "Veggie omelette", "ingredients": ["eggs", "spinach", "onion"], "calories": 380, "protein": 26, "carbs": 9, "fat": 26},
+    {"name": "Chicken stir-fry", "ingredients": ["chicken breast", "rice", "broccoli", "soy sauce"], "calories": 560, "protein": 42, "carbs": 66, "fat": 12},
+    {"name": "Pancake stack", "ingredients": ["eggs", "flour", "milk", "syrup"], "calories": 900, "protein": 20, "carbs": 150, "fat": 25},
+]
+GOALS = {"calories": 2000, "protein": 75, "carbs": 250, "fat": 70}
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _index(tmp_path, recipes=RECIPES):
+    path = str(tmp_path / "recipes.bin")
+    assert build_index(recipes, path) == len(recipes)
+    return RecipeIndex(path)
+
+
+def test_search_ranks_by_coverage_and_macro_fit(tmp_path):
+    index = _index(tmp_path)
+    results = index.search(["Eggs", "spinach", "onions", "milk"], remaining=GOALS, goals=GOALS)
+    assert [r["name"] for r in results] == ["Veggie omelette", "Pancake stack"]
+    assert results[0]["coverage"] == 1.0 and results[0]["missing"] == []
+    assert results[1]["missing"] == ["flour", "syrup"]
+    # Same fridge, but almost nothing left of today's calories: the big meal loses fit
+    late = index.search(["eggs", "flour", "milk", "syrup"], remaining={"calories": 300, "protein": 10, "carbs": 20, "fat": 5}, goals=GOALS)
+    assert late[0]["name"] == "Pancake stack" and late[0]["fit"] < 1.0
+    index.close()
+
+
+def test_fridge_items_match_whole_ingredient_names(tmp_path):
+    index = _index(tmp_path, RECIPES + [
+        {"name": "Eggs benedict", "ingredients": ["eggs benedict"], "calories": 700, "protein": 30, "carbs": 40, "fat": 45},
+    ])
+    (result,) = index.search(["Chicken breasts", "rice"], remaining=GOALS, goals=GOALS)
+    assert result["name"] == "Chicken stir-fry"
+    assert result["missing"] == ["broccoli", "soy sauce"]
+    # "chicken" is not "chicken breast", and "eggs" is not "eggs benedict"
+    (result,) = index.search(["chicken", "rice"], remaining=GOALS, goals=GOALS)
+    assert result["missing"] == ["broccoli", "chicken breast", "soy sauce"]
+    assert "Eggs benedict" not in [r["name"] for r in index.search(["eggs"], remaining=GOALS, goals=GOALS)]
+    assert index.search(["kale"], remaining=GOALS, goals=GOALS) == []
+    index.close()
+
+
+def test_concurrent_builds_publish_a_complete_index(tmp_path, session_factory, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(recipe_index, "recipe_index", None)
+    path = str(tmp_path / "recipes.bin")
+    with session_factory() as db:
+        source = learned_source(db)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        counts = list(pool.map(lambda _: build_index(RECIPES, path, source), range(16)))
+    assert counts == [len(RECIPES)] * 16
+    assert len(RecipeIndex(path)) == len(RECIPES)
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+    # Startup maps the existing file instead of rebuilding it
+    recipe_index.configure_recipe_index(session_factory, path)
+    assert len(recipe_index.recipe_index) == len(RECIPES)
+    recipe_index.recipe_index.close()
+
+
+def test_unreadable_index_falls_back_to_the_model(tmp_path, session_factory, monkeypatch):
+    path = tmp_path / "recipes.bin"
+    path.write_bytes(b"not an index")
+    monkeypatch.setattr(recipe_index, "recipe_index", None)
+    recipe_index.configure_recipe_index(session_factory, str(path))
+    assert recipe_index.recipe_index is None
+
+
+def test_recorded_suggestions_join_the_next_build(tmp_path, session_factory, monkeypatch):
+    monkeypatch.setattr(recipe_index, "RECIPE_SEED_PATH", str(tmp_path / "missing.json"))
+    suggestion = {
+        "recommendation": "Tofu scramble", "missing_ingredients": ["turmeric"], "reason": "Plant protein",
+        "ingredients": ["tofu", "turmeric", "peppers"], "calories": 350, "protein": 24, "carbs": 10, "fat": 20,
+    }
+    with session_factory() as db:
+        record_suggestion(db, suggestion, ["tofu", "peppers"])
+        record_suggestion(db, {**suggestion, "recommendation": "tofu  scramble"}, ["tofu"])
+        (row,) = db.query(SuggestedRecipe).all()
+        assert row.times_suggested == 2 and row.ingredients == ["pepper", "tofu", "turmeric"]
+
+    path = str(tmp_path / "learned.bin")
+    assert build_from_sources(session_factory, path) == 1
+    index = RecipeIndex(path)
+    (result,) = index.search(["tofu", "pepper"], remaining=GOALS, goals=GOALS)
+    assert result["macros"]["calories"] == 350 and result["missing"] == ["turmeric"]
+    index.close()
+
+
+def test_startup_rebuilds_an_index_older_than_suggested_recipes(tmp_path, session_factory, monkeypatch):
+    monkeypatch.setattr(recipe_index, "RECIPE_SEED_PATH", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(recipe_index, "recipe_index", None)
+    path = str(tmp_path / "recipes.bin")
+    assert build_from_sources(session_factory, path) == 0
+    with session_factory() as db:
+        record_suggestion(db, {"recommendation": "Tofu scramble", "ingredients": ["tofu", "turmeric"]}, ["tofu"])
+
+    recipe_index.configure_recipe_index(session_factory, path)
+    assert recipe_index.recipe_index.names == ["Tofu scramble"]
+    with session_factory() as db:
+        assert recipe_index.recipe_index.source == learned_source(db)
+    recipe_index.recipe_index.close()
+
+
+def test_confident_match_is_answered_without_the_model(tmp_path, session_factory, monkeypatch):
+    index = _index(tmp_path)
+    monkeypatch.setattr(recipe_index, "recipe_index", index)
+    dummy_user = UserRead(id=1, age=30, weight=70.0, health_conditions=None, diet_preferences=None, goals=None)
+    monkeypatch.setattr("services.meal_service.get_user", lambda db, user_id: dummy_user)
+    monkeypatch.setattr("services.meal_service.get_todays_meals", lambda db, user_id: [])
+    prompts = []
+
+    async def fake_call_openai(messages, schema, name, temperature=0.7):
+        prompts.append(messages[-1]["content"])
+        return json.dumps({"recommendation": "Fried rice", "missing_ingredients": [], "reason": "Uses leftovers"})
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+    run_db = session_runner(session_factory)
+
+    suggestion = asyncio.run(suggest_meal(run_db, user_id=1, fridge_items=["eggs", "spinach", "onion"]))
+    assert suggestion["recommendation"] == "Veggie omelette"
+    assert suggestion["missing_ingredients"] == []
+    assert prompts == []
+
+    # A partial match goes to the model with the candidates in the prompt
+    suggestion = asyncio.run(suggest_meal(run_db, user_id=1, fridge_items=["chicken", "rice"]))
+    assert suggestion["recommendation"] == "Fried rice"
+    assert "Chicken stir-fry | broccoli, chicken breast, rice, soy sauce | 560kcal P42 C66 F12" in prompts[0]
+    # The model's answer is kept for the next index build
+    with session_factory() as db:
+        assert [r.name for r in db.query(SuggestedRecipe)] == ["Fried rice"]
+    index.close()
+
+
+def test_restricted_profiles_are_not_answered_from_the_index(tmp_path, session_factory, monkeypatch):
+    index = _index(tmp_path)
+    monkeypatch.setattr(recipe_index, "recipe_index", index)
+    vegan = UserRead(id=1, age=30, weight=70.0, health_conditions=None, diet_preferences="vegan", goals=None)
+    monkeypatch.setattr("services.meal_service.get_user", lambda db, user_id: vegan)
+    monkeypatch.setattr("services.meal_service.get_todays_meals", lambda db, user_id: [])
+    prompts = []
+
+    async def fake_call_openai(messages, schema, name, temperature=0.7):
+        prompts.append(messages[-1]["content"])
+        return json.dumps({"recommendation": "Tofu scramble", "missing_ingredients": ["tofu"], "reason": "Vegan"})
+    monkeypatch.setattr("services.meal_service.call_openai", fake_call_openai)
+
+    suggestion = asyncio.run(suggest_meal(session_runner(session_factory), user_id=1, fridge_items=["eggs", "spinach", "onion"]))
+    assert suggestion["recommendation"] == "Tofu scramble"
+    # The match still reaches the model as a candidate, next to the profile
+    assert "Veggie omelette" in prompts[0]
+    index.close()
@@ -0,0 +1,80 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from datetime import date, datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, DailyNutrition, Meal
+from schemas import UserCreate
+from services.meal_service import _save_meal
+from services.rollup_service import backfill_daily_rollup, get_nutrition_summary, period_bounds
+from services.user_service import create_or_update_user
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rollup.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+
+
+def _meal(user_id, ts, kcal):
+    return Meal(
+        user_id=user_id, timestamp=ts, image_path="x.jpg", food_items={"items": []},
+        nutrition_info={"calories": kcal, "protein": 10, "carbs": 30, "fat": 5}, feedback={},
+    )
+
+
+def test_period_bounds():
+    assert period_bounds("day", date(2025, 3, 12)) == (date(2025, 3, 12), date(2025, 3, 12))
+    assert period_bounds("week", date(2025, 3, 12)) == (date(2025, 3, 10), date(2025, 3, 16))
+    assert period_bounds("month", date(2024, 2, 12)) == (date(2024, 2, 1), date(2024, 2, 29))
+
+
+def test_rollup_maintained_on_insert_and_summarized(db):
+    user = create_or_update_user(db, UserCreate(age=30, weight=70.0, daily_calories=2000))
+    _save_meal(db, _meal(user.id, datetime(2025, 3, 10, 8), 400))
+    _save_meal(db, _meal(user.id, datetime(2025, 3, 10, 13), 700))
+    _save_meal(db, _meal(user.id, datetime(2025, 3, 12, 8), 500))
+
+    monday = db.get(DailyNutrition, (user.id, date(2025, 3, 10)))
+    assert (monday.calories, monday.protein, monday.meal_count) == (1100, 20, 2)
+
+    week = get_nutrition_summary(db, user.id, "week", date(2025, 3, 12))
+    assert week["meal_count"] == 3
+    assert week["totals"]["calories"] == 1600
+    assert week["goals"]["calories"] == 14000
+    assert week["remaining"]["calories"] == 12400
+    assert [d["date"] for d in week["days"]] == [date(2025, 3, 10), date(2025, 3, 12)]
+
+
+def test_backfill_rebuilds_from_meals(db):
+    user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+    # Rows inserted directly, bypassing the rollup
+    db.add_all([_meal(user.id, datetime(2025, 3, 10, 8), 400), _meal(user.id, datetime(2025, 3, 11, 8), 600)])
+    db.add(DailyNutrition(user_id=user.id, date=date(2025, 1, 1), calories=1, protein=1, carbs=1, fat=1, meal_count=1))
+    db.commit()
+
+    assert backfill_daily_rollup(db) == 2
+    rows = db.query(DailyNutrition).order_by(DailyNutrition.date).all()
+    assert [(r.date, r.calories, r.meal_count) for r in rows] == [(date(2025, 3, 10), 400, 1), (date(2025, 3, 11), 600, 1)]
+
+
+def test_today_is_the_utc_day_on_non_utc_hosts(db, monkeypatch):
+    import time
+    from services.meal_service import get_todays_meals, get_todays_totals
+    # UTC+14: local "today" is a day ahead of UTC for most of the day
+    monkeypatch.setenv("TZ", "Etc/GMT-14")
+    time.tzset()
+    try:
+        user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+        meal = _meal(user.id, None, 450)
+        _save_meal(db, meal)  # default timestamp: naive UTC now
+        assert [m["nutrition_info"]["calories"] for m in get_todays_meals(db, user.id)] == [450]
+        assert get_todays_totals(db, user.id)["calories"] == 450
+        summary = get_nutrition_summary(db, user.id, "day")
+        assert summary["start"] == meal.timestamp.date() and summary["totals"]["calories"] == 450
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
@@ -0,0 +1,79 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import pytest
+from datetime import datetime
+from typing import List
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from schemas import MealPartial, MealRead
+from services import serialization
+from services.serialization import FastJSONResponse
+
+MEALS = [
+    {
+        "id": 2,
+        "user_id": 1,
+        "timestamp": datetime(2024, 5, 1, 12, 30, 15, 123456),
+        "image_path": "uploads/b.jpg",
+        "food_items": {"items": ["crème brûlée"]},
+        "nutrition_info": {"calories": 300, "protein": 5, "carbs": 40, "fat": 12},
+        "feedback": {"advice": "Nice", "reason": "Treat", "next_meal": "Salad"},
+    },
+    {
+        "id": 1,
+        "user_id": 1,
+        "timestamp": datetime(2024, 5, 1, 8, 0),
+        "image_path": "uploads/a.jpg",
+        "food_items": {"items": ["oatmeal"]},
+        "nutrition_info": {"calories": 350, "protein": 12, "carbs": 60, "fat": 6},
+        "feedback": {"advice": "Good", "reason": "Fiber", "next_meal": "Lunch"},
+    },
+]
+
+
+def _client():
+    app = FastAPI()
+
+    @app.get("/validated", response_model=List[MealRead])
+    def validated():
+        return MEALS
+
+    @app.get("/fast", response_model=List[MealRead])
+    def fast():
+        return FastJSONResponse(MEALS)
+
+    @app.get("/partial/validated", response_model=List[MealPartial], response_model_exclude_unset=True)
+    def partial_validated():
+        return [{"id": m["id"], "timestamp": m["timestamp"]} for m in MEALS]
+
+    @app.get("/partial/fast", response_model=List[MealPartial], response_model_exclude_unset=True)
+    def partial_fast():
+        return FastJSONResponse([{"id": m["id"], "timestamp": m["timestamp"]} for m in MEALS])
+
+    return TestClient(app)
+
+
+def test_fast_response_matches_the_validated_response():
+    client = _client()
+    for path in ("/validated", "/fast"):
+        assert client.get(path).headers["content-type"] == "application/json"
+    assert client.get("/fast").json() == client.get("/validated").json()
+    assert client.get("/partial/fast").json() == client.get("/partial/validated").json()
+
+
+def test_stdlib_fallback_matches(monkeypatch):
+    monkeypatch.setattr(serialization, "orjson", None)
+    body = serialization.dumps(MEALS)
+    assert json.loads(body)[0]["timestamp"] == "2024-05-01T12:30:15.123456"
+    assert "crème brûlée" in body.decode("utf-8")
+    assert json.loads(body) == _client().get("/validated").json()
+
+
+def test_orjson_path_matches():
+    pytest.importorskip("orjson")
+    assert serialization.orjson is not None
+    body = serialization.dumps(MEALS)
+    assert json.loads(body)[0]["timestamp"] == "2024-05-01T12:30:15.123456"
+    assert json.loads(body) == json.loads(serialization.json.dumps(MEALS, default=serialization._default))
+    assert json.loads(body) == _client().get("/validated").json()
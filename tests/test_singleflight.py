@@ -0,0 +1,65 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
+import pytest
+from services.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return {"value": value}
+
+    async def run():
+        same = await asyncio.gather(*(flights.do("a", lambda: work(1)) for _ in range(5)))
+        other = await flights.do("b", lambda: work(2))
+        # Finished calls are not cached
+        again = await flights.do("a", lambda: work(3))
+        return same, other, again
+
+    same, other, again = asyncio.run(run())
+    assert same == [{"value": 1}] * 5
+    assert other == {"value": 2} and again == {"value": 3}
+    assert calls == [1, 2, 3]
+    assert len(flights) == 0
+
+
+def test_followers_share_the_error():
+    flights = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("a", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_follower_takes_over_when_the_leader_is_cancelled():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("a", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("a", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+    assert len(calls) == 2
@@ -0,0 +1,45 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import asyncio
+from fastapi import HTTPException
+from services.streaming import JsonFieldStream, encode_events
+
+
+def _feed_in_chunks(document: str, size: int):
+    stream = JsonFieldStream()
+    fields = {}
+    for i in range(0, len(document), size):
+        for field, text in stream.feed(document[i:i + size]):
+            fields[field] = fields.get(field, "") + text
+    return stream, fields
+
+
+def test_json_field_stream_decodes_string_fields_across_chunk_boundaries():
+    value = {
+        "recommendation": 'Omelette with "herbs"\nand toast ✓',
+        "missing_ingredients": ["chives", 'a "quoted" item'],
+        "reason": "Protein \\ fiber",
+    }
+    document = json.dumps(value)
+    for size in (1, 2, 3, 7, len(document)):
+        stream, fields = _feed_in_chunks(document, size)
+        assert fields == {"recommendation": value["recommendation"], "reason": value["reason"]}
+        assert json.loads(stream.text()) == value
+
+
+def test_encode_events_formats_sse_and_ndjson_and_reports_errors():
+    async def events():
+        yield "items", {"food_items": {"items": ["egg"]}}
+        raise HTTPException(status_code=503, detail="AI service unavailable")
+
+    async def collect(ndjson):
+        return [chunk async for chunk in encode_events(events(), ndjson)]
+
+    sse = asyncio.run(collect(False))
+    assert sse[0] == b'event: items\ndata: {"food_items": {"items": ["egg"]}}\n\n'
+    assert sse[1].startswith(b"event: error\n")
+
+    lines = [json.loads(line) for line in asyncio.run(collect(True))]
+    assert lines[0] == {"event": "items", "data": {"food_items": {"items": ["egg"]}}}
+    assert lines[1] == {"event": "error", "data": {"status_code": 503, "detail": "AI service unavailable"}}
@@ -0,0 +1,55 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from models import Base
+from schemas import UserCreate
+from services.cache_service import InvalidationChannel, LRUCache
+from services import user_service
+from services.user_service import create_or_update_user, get_user
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+
+
+def test_get_user_reads_through_cache_and_updates_refresh_it(db):
+    user = create_or_update_user(db, UserCreate(age=30, weight=70.0, goals="lose fat"))
+    user_service.user_cache.delete(str(user.id))
+
+    first = get_user(db, user.id)
+    # Served from the cache: the row is no longer consulted
+    db.execute(text("UPDATE users SET goals = 'changed behind our back'"))
+    db.commit()
+    assert get_user(db, user.id) is first
+
+    create_or_update_user(db, UserCreate(id=user.id, age=31, weight=70.0))
+    updated = get_user(db, user.id)
+    assert updated.age == 31 and updated.goals == "changed behind our back"
+
+    with pytest.raises(HTTPException) as exc:
+        get_user(db, user.id + 1)
+    assert exc.value.status_code == 404
+
+
+def test_profile_update_is_broadcast_to_other_processes(db, monkeypatch):
+    channel = InvalidationChannel(sessionmaker(bind=db.get_bind()))
+    monkeypatch.setattr(user_service, "_invalidation_channel", channel)
+    user = create_or_update_user(db, UserCreate(age=30, weight=70.0))
+
+    # Another worker's cache, kept coherent by polling the same channel
+    other = InvalidationChannel(sessionmaker(bind=db.get_bind()))
+    other_cache = LRUCache()
+    other.subscribe(user_service.USER_CACHE_NAMESPACE, other_cache)
+    other.poll_once()
+    other_cache.set(str(user.id), get_user(db, user.id))
+
+    create_or_update_user(db, UserCreate(id=user.id, age=45, weight=70.0))
+    other.poll_once()
+    assert other_cache.get(str(user.id)) is None